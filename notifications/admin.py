@@ -1,10 +1,27 @@
 from django.contrib import admin
-from .models import Notification, SalesReport
+from .models import Notification, NotificationCounter, NotificationPreference, QueuedEmail, SalesReport
 
 class NotificationAdmin(admin.ModelAdmin):
-    list_display = ('user', 'message', 'is_read', 'created_at')
-    list_filter = ('is_read',)
-    search_fields = ('user__username', 'message')
+    list_display = ('user', 'kind', 'render_message', 'count', 'is_read', 'created_at')
+    list_filter = ('kind', 'is_read')
+    search_fields = ('user__username',)
+    raw_id_fields = ('user', 'order', 'store')
+    date_hierarchy = 'created_at'
+
+class NotificationCounterAdmin(admin.ModelAdmin):
+    list_display = ('user', 'unread')
+    search_fields = ('user__username',)
+    raw_id_fields = ('user',)
+
+class NotificationPreferenceAdmin(admin.ModelAdmin):
+    list_display = ('user', 'digest_seconds')
+    search_fields = ('user__username',)
+    raw_id_fields = ('user',)
+
+class QueuedEmailAdmin(admin.ModelAdmin):
+    list_display = ('subject', 'recipients', 'status', 'attempts', 'next_attempt_at', 'created_at', 'sent_at')
+    list_filter = ('status',)
+    search_fields = ('subject',)
     date_hierarchy = 'created_at'
 
 class SalesReportAdmin(admin.ModelAdmin):
@@ -13,4 +30,7 @@ class SalesReportAdmin(admin.ModelAdmin):
     date_hierarchy = 'report_date'
 
 admin.site.register(Notification, NotificationAdmin)
+admin.site.register(NotificationCounter, NotificationCounterAdmin)
+admin.site.register(NotificationPreference, NotificationPreferenceAdmin)
+admin.site.register(QueuedEmail, QueuedEmailAdmin)
 admin.site.register(SalesReport, SalesReportAdmin)
@@ -1,11 +1,18 @@
 from django.urls import path
 from .api_views import (
-    NotificationListView, MarkNotificationReadView,
+    NotificationListView, MarkNotificationReadView, MarkNotificationsReadView, MarkAllNotificationsReadView,
+    UnreadNotificationCountView, NotificationPreferenceView, StreamTicketView, notification_stream_view,
     SalesReportListView, GenerateReportView, SalesReportDetailView
 )
 
 urlpatterns = [
     path('', NotificationListView.as_view(), name='api_notification_list'),
+    path('mark-read/', MarkNotificationsReadView.as_view(), name='api_notifications_mark_read'),
+    path('mark-all-read/', MarkAllNotificationsReadView.as_view(), name='api_notifications_mark_all_read'),
+    path('preferences/', NotificationPreferenceView.as_view(), name='api_notification_preferences'),
+    path('stream/', notification_stream_view, name='api_notification_stream'),
+    path('stream/ticket/', StreamTicketView.as_view(), name='api_notification_stream_ticket'),
+    path('unread-count/', UnreadNotificationCountView.as_view(), name='api_notification_unread_count'),
     path('<str:notification_id>/read/', MarkNotificationReadView.as_view(), name='api_notification_mark_read'),
     path('reports/', SalesReportListView.as_view(), name='api_sales_report_list'),
     path('reports/generate/', GenerateReportView.as_view(), name='api_generate_report'),
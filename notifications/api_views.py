@@ -1,12 +1,24 @@
 from rest_framework import generics, permissions, status
 from rest_framework.response import Response
 from rest_framework.views import APIView
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Max, Q
+from django.http import JsonResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
-from .models import Notification, SalesReport
-from .serializers import NotificationSerializer, SalesReportSerializer
+from .broker import broker
+from .models import Notification, NotificationCounter, NotificationPreference, SalesReport, StreamTicket
+from .serializers import NotificationSerializer, NotificationPreferenceSerializer, SalesReportSerializer
+from orders.models import OrderEvent
 from django.utils import timezone
-from datetime import datetime, timedelta
-from django.db.models import Q
+from datetime import datetime, timedelta, timezone as dt_timezone
+from django.utils.dateparse import parse_datetime
+import asyncio
+import json
 import logging
 import traceback
 
@@ -18,15 +30,15 @@ class NotificationListView(generics.ListAPIView):
     permission_classes = [permissions.IsAuthenticated]
     
     def get_queryset(self):
-        queryset = Notification.objects.filter(user=self.request.user).order_by('-created_at')
+        queryset = Notification.objects.filter(user=self.request.user).select_related('store').order_by('-updated_at', '-pk')
+        
+        kind = self.request.query_params.get('kind')
+        if kind:
+            queryset = queryset.filter(kind=kind)
         
         store_id = self.request.query_params.get('store_id')
         if store_id and hasattr(self.request.user, 'store') and self.request.user.store.store_id == store_id:
-            store_notifications = queryset.filter(
-                Q(message__icontains=store_id) | 
-                Q(message__icontains=self.request.user.store.store_name)
-            )
-            return store_notifications
+            return queryset.filter(store=self.request.user.store)
         
         return queryset
 
@@ -39,26 +51,87 @@ class MarkNotificationReadView(APIView):
                                 notification_id=notification_id,
                                 user=self.request.user)
     
-    def post(self, request, notification_id):
+    def mark_read(self, notification_id):
         notification = self.get_object(notification_id)
+        Notification.objects.filter(pk=notification.pk).mark_read(self.request.user)
         notification.is_read = True
-        notification.save()
         serializer = NotificationSerializer(notification)
         return Response(serializer.data)
     
+    def post(self, request, notification_id):
+        return self.mark_read(notification_id)
+    
     def put(self, request, notification_id):
-        notification = self.get_object(notification_id)
-        notification.is_read = True
-        notification.save()
-        serializer = NotificationSerializer(notification)
-        return Response(serializer.data)
+        return self.mark_read(notification_id)
     
     def patch(self, request, notification_id):
-        notification = self.get_object(notification_id)
-        notification.is_read = True
-        notification.save()
-        serializer = NotificationSerializer(notification)
-        return Response(serializer.data)
+        return self.mark_read(notification_id)
+
+class MarkNotificationsReadView(APIView):
+    """Mark a list of notifications as read with one UPDATE"""
+    permission_classes = [permissions.IsAuthenticated]
+    max_notifications = 1000
+    
+    def post(self, request):
+        notification_ids = request.data.get('notification_ids')
+        if (not isinstance(notification_ids, list) or not notification_ids
+                or not all(isinstance(notification_id, str) for notification_id in notification_ids)):
+            return Response({'error': 'notification_ids must be a non-empty list of notification IDs'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if len(notification_ids) > self.max_notifications:
+            return Response({'error': f'At most {self.max_notifications} notifications can be marked at once'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        
+        # Ids of other users' or already read notifications are simply not matched
+        marked = Notification.objects.filter(notification_id__in=notification_ids).mark_read(request.user)
+        return Response({'marked': marked, 'unread_count': NotificationCounter.unread_for(request.user)})
+
+class MarkAllNotificationsReadView(APIView):
+    """Mark every notification as read, or only those created up to 'before'"""
+    permission_classes = [permissions.IsAuthenticated]
+    
+    def post(self, request):
+        notifications = Notification.objects.all()
+        before = request.data.get('before')
+        if before:
+            try:
+                before_date = parse_datetime(before) if isinstance(before, str) else None
+            except ValueError:
+                # Well formed but not a real date and time, e.g. month 13
+                before_date = None
+            if before_date is None:
+                return Response({'error': 'before must be an ISO 8601 date and time'}, status=status.HTTP_400_BAD_REQUEST)
+            if timezone.is_naive(before_date):
+                before_date = timezone.make_aware(before_date)
+            notifications = notifications.filter(created_at__lte=before_date)
+        
+        marked = notifications.mark_read(request.user)
+        return Response({'marked': marked, 'unread_count': NotificationCounter.unread_for(request.user)})
+
+class UnreadNotificationCountView(APIView):
+    """Number of unread notifications, read from the per-user counter"""
+    permission_classes = [permissions.IsAuthenticated]
+    
+    def get(self, request):
+        return Response({'unread_count': NotificationCounter.unread_for(request.user)})
+
+class NotificationPreferenceView(generics.RetrieveUpdateAPIView):
+    """The user's notification settings, e.g. how long seller notifications are merged into a digest"""
+    serializer_class = NotificationPreferenceSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    
+    def get_object(self):
+        preference, _ = NotificationPreference.objects.get_or_create(user=self.request.user)
+        return preference
+
+class StreamTicketView(APIView):
+    """A single-use ticket for opening the notification stream with EventSource"""
+    permission_classes = [permissions.IsAuthenticated]
+    
+    def post(self, request):
+        ticket = StreamTicket.issue(request.user)
+        return Response({'ticket': ticket.ticket, 'expires_in': settings.NOTIFICATION_STREAM_TICKET_SECONDS},
+                        status=status.HTTP_201_CREATED)
 
 class SalesReportListView(generics.ListAPIView):
     """List all sales reports for the authenticated seller's store"""
@@ -134,3 +207,160 @@ class SalesReportDetailView(generics.RetrieveAPIView):
             return SalesReport.objects.none()
         
         return SalesReport.objects.filter(store=self.request.user.store)
+
+def stream_user(request):
+    """
+    The user of a stream request: a session user, a JWT access token in the Authorization header,
+    or, since EventSource cannot set headers, a ticket from StreamTicketView in the 'ticket' parameter.
+    Access tokens are not accepted in the URL, where they would be logged.
+    """
+    if request.user.is_authenticated:
+        return request.user
+    ticket = request.GET.get('ticket')
+    if ticket:
+        return StreamTicket.redeem(ticket)
+    authentication = JWTAuthentication()
+    header = authentication.get_header(request)
+    raw_token = authentication.get_raw_token(header) if header else None
+    if not raw_token:
+        return None
+    try:
+        return authentication.get_user(authentication.get_validated_token(raw_token))
+    except (InvalidToken, TokenError):
+        return None
+
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+def stream_event_id(cursor):
+    updated_at, notification_pk, event_pk = cursor
+    return f"{(updated_at - EPOCH) // timedelta(microseconds=1)}-{notification_pk}-{event_pk}"
+
+def stream_cursor(user, last_event_id):
+    """
+    (updated_at and pk of the last notification change, last order event pk) already seen.
+    Stream event ids are "<updated_at in epoch microseconds>-<notification pk>-<order event pk>";
+    without one the stream starts from now.
+    """
+    try:
+        micros, notification_pk, event_pk = (int(part) for part in last_event_id.split('-'))
+        return EPOCH + timedelta(microseconds=micros), notification_pk, event_pk
+    except (AttributeError, ValueError, OverflowError):
+        pass
+    updated_at, notification_pk = (
+        Notification.objects.filter(user=user).order_by('-updated_at', '-pk').values_list('updated_at', 'pk').first()
+        or (EPOCH, 0)
+    )
+    return updated_at, notification_pk, OrderEvent.objects.filter(user=user).aggregate(last=Max('pk'))['last'] or 0
+
+def format_sse(event, data, event_id):
+    return f"id: {event_id}\nevent: {event}\ndata: {json.dumps(data, cls=DjangoJSONEncoder)}\n\n"
+
+def stream_updates(user, cursor, unread_count, sent, batch_size=100):
+    """
+    Server-sent event messages for what happened since cursor: new notifications and digests
+    that took in another notification, order events and the unread count.
+    Returns (messages, cursor, unread_count).
+    
+    Rows are sent as soon as they are read, but as with the order event log consumers the cursor
+    only moves past rows older than ORDER_EVENT_SETTLE_SECONDS, since a slow transaction can still
+    commit a row that sorts before them. sent, kept by the caller from one call to the next, maps
+    the rows read past the cursor to the version that went out, so they are not sent twice.
+    A client resuming from an event id can get a notification again and should key on notification_id.
+    """
+    settled_before = timezone.now() - timedelta(seconds=settings.ORDER_EVENT_SETTLE_SECONDS)
+    updated_at, notification_pk, event_pk = cursor
+    notifications = list(
+        Notification.objects.filter(user=user)
+        .filter(Q(updated_at__gt=updated_at) | Q(updated_at=updated_at, pk__gt=notification_pk))
+        .select_related('store').order_by('updated_at', 'pk')[:batch_size]
+    )
+    events = list(OrderEvent.objects.filter(user=user, pk__gt=event_pk).order_by('pk')[:batch_size])
+    
+    messages = []
+    settled = True
+    for notification in notifications:
+        settled = settled and notification.updated_at <= settled_before
+        if settled:
+            updated_at, notification_pk = notification.updated_at, notification.pk
+        if sent.get(('notification', notification.pk)) != notification.updated_at:
+            sent['notification', notification.pk] = notification.updated_at
+            messages.append(format_sse('notification', NotificationSerializer(notification).data,
+                                       stream_event_id((updated_at, notification_pk, event_pk))))
+    settled = True
+    for event in events:
+        settled = settled and event.created_at <= settled_before
+        if settled:
+            event_pk = event.pk
+        if ('order', event.pk) not in sent:
+            sent['order', event.pk] = event.created_at
+            messages.append(format_sse('order', {
+                'order_id': event.order_id,
+                'event_type': event.event_type,
+                'order_status': event.order_status,
+                'payment_status': event.payment_status,
+                'created_at': event.created_at,
+            }, stream_event_id((updated_at, notification_pk, event_pk))))
+    
+    # Rows at or before the cursor are not read again
+    for (kind, pk), version in list(sent.items()):
+        if (kind == 'notification' and (version, pk) <= (updated_at, notification_pk)
+                or kind == 'order' and pk <= event_pk):
+            del sent[kind, pk]
+    
+    current_unread = NotificationCounter.unread_for(user)
+    if current_unread != unread_count:
+        messages.append(format_sse('unread_count', {'unread_count': current_unread},
+                                   stream_event_id((updated_at, notification_pk, event_pk))))
+    return messages, (updated_at, notification_pk, event_pk), current_unread
+
+async def notification_stream_view(request):
+    """
+    Server-sent events with the user's new notifications, order events and unread count,
+    replacing timed polling of the notification and order endpoints.
+    
+    The stream is only live under ASGI. Under WSGI, Django reads a streaming response's async
+    iterator to the end before sending any of it, so there the view sends one batch of updates
+    and ends, and the client reconnects after the poll interval as with long polling.
+    """
+    user = await sync_to_async(stream_user)(request)
+    if user is None:
+        return JsonResponse({'error': 'Authentication credentials were not provided.'}, status=401)
+    
+    last_event_id = request.headers.get('Last-Event-ID') or request.GET.get('last_event_id')
+    cursor = await sync_to_async(stream_cursor)(user, last_event_id)
+    
+    live = isinstance(request, ASGIRequest)
+    # Reconnection delay the client should use, in milliseconds
+    retry = 3000 if live else int(settings.NOTIFICATION_STREAM_POLL_SECONDS * 1000)
+    
+    async def stream():
+        nonlocal cursor
+        subscription = broker.subscribe(user.pk)
+        loop = asyncio.get_running_loop()
+        started = last_sent = loop.time()
+        unread_count = None
+        sent = {}
+        try:
+            yield f"retry: {retry}\n\n"
+            while loop.time() - started < settings.NOTIFICATION_STREAM_MAX_SECONDS:
+                # Re-armed before reading, so a publish during the read triggers another one
+                subscription.clear()
+                messages, cursor, unread_count = await sync_to_async(stream_updates)(
+                    user, cursor, unread_count, sent
+                )
+                if messages:
+                    yield ''.join(messages)
+                    last_sent = loop.time()
+                elif loop.time() - last_sent >= settings.NOTIFICATION_STREAM_KEEPALIVE_SECONDS:
+                    yield ": keepalive\n\n"
+                    last_sent = loop.time()
+                if not live:
+                    break
+                await subscription.wait(settings.NOTIFICATION_STREAM_POLL_SECONDS)
+        finally:
+            broker.unsubscribe(subscription)
+    
+    response = StreamingHttpResponse(stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # stop nginx from buffering the stream
+    return response
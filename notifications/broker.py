@@ -0,0 +1,79 @@
+"""
+In-process wake-ups for the live notification stream.
+
+Each open stream subscribes for its user. When a notification or order
+event is committed, the writer publishes the user ids concerned, and every
+matching stream in this process wakes up and reads the new rows from the
+database. The database stays the source of truth: streams also re-check it
+every NOTIFICATION_STREAM_POLL_SECONDS, which is how rows written by other
+worker processes arrive.
+"""
+
+import asyncio
+import threading
+from collections import defaultdict
+
+from django.db import transaction
+
+
+class Subscription:
+    def __init__(self, user_id, loop):
+        self.user_id = user_id
+        self.loop = loop
+        self.event = asyncio.Event()
+
+    async def wait(self, timeout):
+        """Wait until woken or timeout seconds have passed"""
+        try:
+            await asyncio.wait_for(self.event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def clear(self):
+        self.event.clear()
+
+
+class Broker:
+    def __init__(self):
+        self._subscriptions = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def subscribe(self, user_id):
+        """Must be called from the event loop the subscriber waits on"""
+        subscription = Subscription(user_id, asyncio.get_running_loop())
+        with self._lock:
+            self._subscriptions[user_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.user_id)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscriptions[subscription.user_id]
+
+    def publish(self, user_ids):
+        """Wake the streams of user_ids. Safe to call from any thread."""
+        with self._lock:
+            subscriptions = [
+                subscription
+                for user_id in set(user_ids)
+                for subscription in self._subscriptions.get(user_id, ())
+            ]
+        for subscription in subscriptions:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.event.set)
+            except RuntimeError:
+                # The subscriber's loop has closed; its stream is gone
+                pass
+
+
+broker = Broker()
+
+
+def publish_on_commit(user_ids):
+    """Wake the streams of user_ids once the current transaction commits"""
+    user_ids = {user_id for user_id in user_ids if user_id is not None}
+    if user_ids:
+        transaction.on_commit(lambda: broker.publish(user_ids))
@@ -0,0 +1,135 @@
+"""
+Delivery of QueuedEmail rows by the send_queued_emails worker.
+
+A worker claims a batch of due emails by moving their next_attempt_at past
+the time it needs to send them, so other workers skip them, then sends the
+batch over one open mail server connection at no more than EMAIL_QUEUE_RATE
+messages per second. A failed email is retried with exponential backoff and
+marked FAILED after EMAIL_QUEUE_MAX_ATTEMPTS. If a worker dies mid-batch its
+claim runs out and the emails are sent again: an email can occasionally
+arrive twice, but is never lost.
+"""
+
+import logging
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage
+from django.db import transaction
+from django.utils import timezone
+
+from .models import QueuedEmail
+
+logger = logging.getLogger(__name__)
+
+
+class MailServerUnavailable(Exception):
+    """No connection to the mail server could be opened"""
+
+
+class Throttle:
+    """Spaces calls to wait() at least 1 / rate seconds apart"""
+
+    def __init__(self, rate):
+        self.interval = 1 / rate if rate else 0
+        self.next_at = time.monotonic()
+
+    def wait(self):
+        delay = self.next_at - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        self.next_at = max(self.next_at, time.monotonic()) + self.interval
+
+
+def claim(batch_size, claim_seconds):
+    """Due pending emails, oldest first, hidden from other workers for claim_seconds"""
+    now = timezone.now()
+    with transaction.atomic():
+        emails = list(
+            QueuedEmail.objects.select_for_update(skip_locked=True)
+            .filter(status=QueuedEmail.PENDING, next_attempt_at__lte=now)
+            .order_by('next_attempt_at')[:batch_size]
+        )
+        if emails:
+            QueuedEmail.objects.filter(pk__in=[email.pk for email in emails]).update(
+                next_attempt_at=now + timedelta(seconds=claim_seconds)
+            )
+    return emails
+
+
+def release(emails, error):
+    """Put claimed emails back for a later retry without using up an attempt, e.g. when the server is down"""
+    QueuedEmail.objects.filter(pk__in=[email.pk for email in emails], status=QueuedEmail.PENDING).update(
+        next_attempt_at=timezone.now() + timedelta(seconds=settings.EMAIL_QUEUE_RETRY_SECONDS),
+        last_error=describe(error)
+    )
+
+
+def record_failure(email, error):
+    email.attempts += 1
+    email.last_error = describe(error)
+    if email.attempts >= settings.EMAIL_QUEUE_MAX_ATTEMPTS:
+        email.status = QueuedEmail.FAILED
+    else:
+        email.next_attempt_at = timezone.now() + timedelta(
+            seconds=settings.EMAIL_QUEUE_RETRY_SECONDS * 2 ** (email.attempts - 1)
+        )
+    email.save(update_fields=['attempts', 'last_error', 'status', 'next_attempt_at'])
+
+
+def describe(error):
+    return f"{type(error).__name__}: {error}"
+
+
+def open_connection(connection):
+    try:
+        connection.open()
+    except Exception as e:
+        raise MailServerUnavailable(describe(e)) from e
+
+
+def send_batch(connection, emails, throttle):
+    """
+    Send claimed emails over connection, opening it if needed, and record each outcome.
+    Returns (sent, failed). Raises MailServerUnavailable, after releasing the emails
+    not yet sent, if no connection can be opened.
+    """
+    try:
+        open_connection(connection)
+    except MailServerUnavailable as e:
+        release(emails, e)
+        raise
+
+    sent = []
+    failed = 0
+    for position, email in enumerate(emails):
+        throttle.wait()
+        message = EmailMessage(email.subject, email.body, email.from_email, email.recipients,
+                               connection=connection)
+        try:
+            # One message per call, so a failure is recorded against the right email
+            connection.send_messages([message])
+        except Exception as e:
+            logger.warning(f"Could not send queued email {email.pk}: {describe(e)}")
+            record_failure(email, e)
+            failed += 1
+            # The error may have broken the connection; start the rest of the batch on a fresh one
+            connection.close()
+            try:
+                open_connection(connection)
+            except MailServerUnavailable as unavailable:
+                mark_sent(sent)
+                release(emails[position + 1:], unavailable)
+                raise
+        else:
+            sent.append(email.pk)
+    mark_sent(sent)
+    return len(sent), failed
+
+
+def mark_sent(email_ids):
+    if email_ids:
+        QueuedEmail.objects.filter(pk__in=email_ids).update(
+            status=QueuedEmail.SENT, sent_at=timezone.now(), last_error=''
+        )
@@ -0,0 +1,63 @@
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+
+from notifications.models import Notification, NotificationCounter
+
+
+class Command(BaseCommand):
+    help = 'Recount unread notifications and repair per-user counters that drifted'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Users checked per transaction')
+        parser.add_argument('--dry-run', action='store_true', help='Only report the counters that are wrong')
+
+    def handle(self, *args, **options):
+        User = get_user_model()
+        checked = repaired = drift = 0
+        started = time.perf_counter()
+        last_pk = 0
+        while True:
+            user_ids = list(
+                User.objects.filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[:options['batch_size']]
+            )
+            if not user_ids:
+                break
+
+            with transaction.atomic():
+                # Counters are locked before counting, so a notification created meanwhile is either
+                # already in the count or increments the counter after this transaction
+                stored = dict(
+                    NotificationCounter.objects.select_for_update()
+                    .filter(user_id__in=user_ids)
+                    .values_list('user_id', 'unread')
+                )
+                actual = dict(
+                    Notification.objects.filter(user_id__in=user_ids, is_read=False)
+                    .values('user')
+                    .annotate(unread=Count('id'))
+                    .values_list('user', 'unread')
+                )
+                fixes = [
+                    NotificationCounter(user_id=user_id, unread=actual.get(user_id, 0))
+                    for user_id in stored.keys() | actual.keys()
+                    if stored.get(user_id, 0) != actual.get(user_id, 0)
+                ]
+                if fixes and not options['dry_run']:
+                    NotificationCounter.objects.bulk_create(
+                        fixes, update_conflicts=True, unique_fields=['user'], update_fields=['unread']
+                    )
+
+            checked += len(user_ids)
+            repaired += len(fixes)
+            drift += sum(abs(fix.unread - stored.get(fix.user_id, 0)) for fix in fixes)
+            last_pk = user_ids[-1]
+
+        verb = 'Would repair' if options['dry_run'] else 'Repaired'
+        self.stdout.write(self.style.SUCCESS(
+            f"Checked {checked} users. {verb} {repaired} counters off by {drift} in total "
+            f"({time.perf_counter() - started:.2f}s)"
+        ))
@@ -0,0 +1,37 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from notifications.models import Notification
+
+
+class Command(BaseCommand):
+    help = 'Queue an email for every notification digest whose window has closed, once'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Digests read per query')
+
+    def handle(self, *args, **options):
+        queued = 0
+        started = time.perf_counter()
+        now = timezone.now()
+        while True:
+            due = list(
+                Notification.objects.filter(digest_until__lte=now, emailed_at__isnull=True)
+                .select_related('user').order_by('digest_until')[:options['batch_size']]
+            )
+            if not due:
+                break
+
+            for notification in due:
+                with transaction.atomic():
+                    # Claimed in the transaction that queues the email, so two runs never queue it twice
+                    if Notification.objects.filter(pk=notification.pk, emailed_at__isnull=True).update(emailed_at=now):
+                        notification.send_email()
+                        queued += 1
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Queued emails for {queued} digests ({time.perf_counter() - started:.2f}s)"
+        ))
@@ -0,0 +1,55 @@
+import time
+
+from django.conf import settings
+from django.core.mail import get_connection
+from django.core.management.base import BaseCommand
+
+from notifications import mailer
+
+
+class Command(BaseCommand):
+    help = 'Send queued emails in batches over one mail server connection, with rate limiting and retries'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100, help='Emails claimed at a time')
+        parser.add_argument('--rate', type=float, default=None,
+                            help='Messages per second (default EMAIL_QUEUE_RATE, 0 for no limit)')
+        parser.add_argument('--loop', action='store_true', help='Keep waiting for new emails instead of exiting')
+        parser.add_argument('--idle-sleep', type=float, default=5, help='Seconds to wait when the queue is empty')
+
+    def handle(self, *args, **options):
+        rate = settings.EMAIL_QUEUE_RATE if options['rate'] is None else options['rate']
+        throttle = mailer.Throttle(rate)
+        # The claim covers sending the whole batch at the rate limit, with a margin for slow servers
+        claim_seconds = (options['batch_size'] / rate if rate else 0) + 300
+        connection = get_connection(fail_silently=False)
+        sent = failed = 0
+        started = time.perf_counter()
+        try:
+            while True:
+                emails = mailer.claim(options['batch_size'], claim_seconds)
+                if not emails:
+                    # Servers drop idle connections, so do not hold one while there is nothing to send
+                    connection.close()
+                    if not options['loop']:
+                        break
+                    time.sleep(options['idle_sleep'])
+                    continue
+
+                try:
+                    batch_sent, batch_failed = mailer.send_batch(connection, emails, throttle)
+                except mailer.MailServerUnavailable as e:
+                    # The unsent emails were put back for a later retry
+                    self.stderr.write(f"Mail server unavailable: {e}")
+                    if not options['loop']:
+                        break
+                    time.sleep(options['idle_sleep'])
+                    continue
+                sent += batch_sent
+                failed += batch_failed
+        finally:
+            connection.close()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Sent {sent} emails, {failed} failed ({time.perf_counter() - started:.2f}s)"
+        ))
@@ -0,0 +1,33 @@
+from django.db import migrations
+from django.db.models import Count
+
+
+def backfill_counters(apps, schema_editor):
+    """Count the unread notifications that existed before the counters did"""
+    Notification = apps.get_model('notifications', 'Notification')
+    NotificationCounter = apps.get_model('notifications', 'NotificationCounter')
+
+    unread = (
+        Notification.objects.filter(is_read=False)
+        .values('user')
+        .annotate(unread=Count('id'))
+        .values_list('user', 'unread')
+    )
+    NotificationCounter.objects.bulk_create(
+        [NotificationCounter(user_id=user_id, unread=count) for user_id, count in unread],
+        batch_size=1000,
+        update_conflicts=True,
+        unique_fields=['user'],
+        update_fields=['unread']
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifications', '0002_notification_counter'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 5.1.7 on 2026-10-19 03:18
+
+import django.core.serializers.json
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifications', '0004_notification_user_unread_index'),
+        ('orders', '0011_order_events'),
+        ('stores', '0004_remove_store_description'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notification',
+            name='kind',
+            field=models.CharField(choices=[('message', 'Message'), ('order_placed', 'Order placed'), ('order_received', 'Order received'), ('order_status_changed', 'Order status changed'), ('order_cancelled', 'Order cancelled'), ('seller_order_cancelled', 'Order cancelled by buyer'), ('payment_failed', 'Payment failed')], default='message', max_length=30),
+        ),
+        migrations.AddField(
+            model_name='notification',
+            name='order',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='notifications', to='orders.order'),
+        ),
+        migrations.AddField(
+            model_name='notification',
+            name='payload',
+            field=models.JSONField(blank=True, default=dict, encoder=django.core.serializers.json.DjangoJSONEncoder),
+        ),
+        migrations.AddField(
+            model_name='notification',
+            name='store',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='notifications', to='stores.store'),
+        ),
+        migrations.AlterField(
+            model_name='notification',
+            name='message',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['user', 'created_at'], name='notif_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['store', 'created_at'], name='notif_store_created_idx'),
+        ),
+    ]
@@ -0,0 +1,73 @@
+import re
+
+from django.db import migrations
+
+# The texts notifications were created with before they had a kind and payload
+LEGACY_MESSAGES = [
+    ('order_placed', re.compile(
+        r'^Your order #(?P<order_id>\S+) has been placed successfully\. Total amount: \$(?P<total_amount>[\d.]+)\.$')),
+    ('order_received', re.compile(
+        r'^New order #(?P<order_id>\S+) received from (?P<buyer>.+)\. Please check your orders\.$')),
+    ('order_status_changed', re.compile(
+        r'^Your order #(?P<order_id>\S+) status has been updated to (?P<status>\w+)\.$')),
+    ('order_cancelled', re.compile(
+        r'^Your order #(?P<order_id>\S+) has been cancelled and payment refunded\.$')),
+    ('seller_order_cancelled', re.compile(
+        r'^Order #(?P<order_id>\S+) from (?P<buyer>.+) has been cancelled\.$')),
+    ('payment_failed', re.compile(
+        r'^Payment for your order #(?P<order_id>\S+) failed \((?P<reason>.*)\)\. The order has been cancelled\.$')),
+]
+SELLER_KINDS = ('order_received', 'seller_order_cancelled')
+
+
+def structure_legacy_notifications(apps, schema_editor):
+    """Give free-text notifications a kind, payload, order and store, and drop their stored text"""
+    Notification = apps.get_model('notifications', 'Notification')
+    Order = apps.get_model('orders', 'Order')
+    Store = apps.get_model('stores', 'Store')
+
+    last_pk = 0
+    while True:
+        batch = list(Notification.objects.filter(pk__gt=last_pk, kind='message').order_by('pk')[:1000])
+        if not batch:
+            return
+        last_pk = batch[-1].pk
+
+        parsed = []
+        for notification in batch:
+            for kind, pattern in LEGACY_MESSAGES:
+                match = pattern.match(notification.message)
+                if match:
+                    parsed.append((notification, kind, match.groupdict()))
+                    break
+
+        order_pks = dict(
+            Order.objects.filter(order_id__in={payload['order_id'] for _, _, payload in parsed})
+            .values_list('order_id', 'pk')
+        )
+        store_pks = dict(
+            Store.objects.filter(user_id__in={notification.user_id for notification, _, _ in parsed})
+            .values_list('user_id', 'pk')
+        )
+        for notification, kind, payload in parsed:
+            notification.kind = kind
+            notification.payload = payload
+            notification.order_id = order_pks.get(payload['order_id'])
+            if kind in SELLER_KINDS:
+                notification.store_id = store_pks.get(notification.user_id)
+            notification.message = ''
+        Notification.objects.bulk_update(
+            [notification for notification, _, _ in parsed],
+            ['kind', 'payload', 'order', 'store', 'message']
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifications', '0005_notification_structured_fields'),
+    ]
+
+    operations = [
+        migrations.RunPython(structure_legacy_notifications, migrations.RunPython.noop),
+    ]
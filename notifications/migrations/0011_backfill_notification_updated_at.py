@@ -0,0 +1,19 @@
+from django.db import migrations
+from django.db.models import F
+
+
+def backfill_updated_at(apps, schema_editor):
+    """Existing notifications were last changed when they were created, as far as we know"""
+    Notification = apps.get_model('notifications', 'Notification')
+    Notification.objects.update(updated_at=F('created_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifications', '0010_notification_updated_at'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_updated_at, migrations.RunPython.noop),
+    ]
@@ -1,19 +1,174 @@
-from django.db import models
+from collections import Counter
+from datetime import timedelta
+from django.db import models, transaction
+from django.db.models import F, Q
+from django.db.models.functions import Greatest
 from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+import secrets
 import uuid
+from techshelf.db import upsert
+from techshelf.ids import generate_id
+from .broker import publish_on_commit
+
+class NotificationQuerySet(models.QuerySet):
+    def bulk_create(self, objs, *args, **kwargs):
+        with transaction.atomic(using=self.db):
+            objs = super().bulk_create(objs, *args, **kwargs)
+            NotificationCounter.add_unread(Counter(obj.user_id for obj in objs if not obj.is_read))
+            publish_on_commit(obj.user_id for obj in objs)
+        return objs
+    
+    def mark_read(self, user):
+        """
+        Mark user's unread notifications in this queryset read with one UPDATE
+        and take them off the unread counter. Returns the number marked.
+        """
+        with transaction.atomic(using=self.db):
+            marked = self.filter(user=user, is_read=False).update(is_read=True)
+            if marked:
+                NotificationCounter.objects.filter(user=user).update(unread=Greatest(F('unread') - marked, 0))
+                publish_on_commit([user.pk])
+        return marked
+    
+    def delete(self):
+        """Delete the notifications and take the unread ones among them off their users' counters"""
+        with transaction.atomic(using=self.db):
+            # Locked, so that a concurrent mark_read cannot take them off the counter as well
+            unread = Counter(self.filter(is_read=False).select_for_update().values_list('user_id', flat=True))
+            deleted = super().delete()
+            if unread:
+                NotificationCounter.remove_unread(unread)
+                publish_on_commit(unread)
+        return deleted
+    
+    def coalesce_create(self, objs):
+        """
+        Create objs, merging each one of a DIGEST_KINDS kind into its recipient's open
+        digest (an unread notification of the same kind and store created within the
+        recipient's digest window) instead of adding a row. Returns the created notifications.
+        """
+        now = timezone.now()
+        windows = NotificationPreference.digest_windows(
+            {obj.user_id for obj in objs if obj.kind in Notification.DIGEST_KINDS}
+        )
+        created = []
+        with transaction.atomic(using=self.db):
+            open_digests = {}
+            if any(windows.values()):
+                open_digests = {
+                    (user_id, kind, store_id): pk
+                    for pk, user_id, kind, store_id in self.filter(
+                        user_id__in=[user_id for user_id, window in windows.items() if window],
+                        kind__in=Notification.DIGEST_KINDS, is_read=False, digest_until__gt=now
+                    ).order_by('digest_until').values_list('pk', 'user_id', 'kind', 'store_id')
+                }
+            
+            for obj in objs:
+                window = windows.get(obj.user_id) if obj.kind in Notification.DIGEST_KINDS else None
+                if not window:
+                    created.append(obj)
+                    continue
+                
+                open_digest = open_digests.get((obj.user_id, obj.kind, obj.store_id))
+                # The digest takes over the latest notification's order and payload, and moves up the
+                # inbox and into the stream again; the is_read condition re-checks that it was not
+                # marked read since the lookup
+                if open_digest and self.filter(pk=open_digest, is_read=False).update(
+                    count=F('count') + 1, order_id=obj.order_id, payload=obj.payload, updated_at=now
+                ):
+                    publish_on_commit([obj.user_id])
+                    continue
+                
+                obj.digest_until = now + timedelta(seconds=window)
+                created.append(obj)
+            self.bulk_create(created)
+        return created
 
 class Notification(models.Model):
+    MESSAGE = 'message'
+    ORDER_PLACED = 'order_placed'
+    ORDER_RECEIVED = 'order_received'
+    ORDER_STATUS_CHANGED = 'order_status_changed'
+    ORDER_CANCELLED = 'order_cancelled'
+    SELLER_ORDER_CANCELLED = 'seller_order_cancelled'
+    PAYMENT_FAILED = 'payment_failed'
+    KINDS = (
+        (MESSAGE, 'Message'),
+        (ORDER_PLACED, 'Order placed'),
+        (ORDER_RECEIVED, 'Order received'),
+        (ORDER_STATUS_CHANGED, 'Order status changed'),
+        (ORDER_CANCELLED, 'Order cancelled'),
+        (SELLER_ORDER_CANCELLED, 'Order cancelled by buyer'),
+        (PAYMENT_FAILED, 'Payment failed'),
+    )
+    
+    # Kinds a busy recipient receives many of; coalesce_create merges them into digests
+    DIGEST_KINDS = (ORDER_RECEIVED, SELLER_ORDER_CANCELLED)
+    
+    # Text is rendered from the payload when read, so only the variable parts are stored
+    TEMPLATES = {
+        ORDER_PLACED: "Your order #{order_id} has been placed successfully. Total amount: ${total_amount}.",
+        ORDER_RECEIVED: "New order #{order_id} received from {buyer}. Please check your orders.",
+        ORDER_STATUS_CHANGED: "Your order #{order_id} status has been updated to {status}.",
+        ORDER_CANCELLED: "Your order #{order_id} has been cancelled and payment refunded.",
+        SELLER_ORDER_CANCELLED: "Order #{order_id} from {buyer} has been cancelled.",
+        PAYMENT_FAILED: "Payment for your order #{order_id} failed ({reason}). The order has been cancelled.",
+    }
+    DIGEST_TEMPLATES = {
+        ORDER_RECEIVED: "{count} new orders received. Latest: #{order_id} from {buyer}. Please check your orders.",
+        SELLER_ORDER_CANCELLED: "{count} orders have been cancelled. Latest: #{order_id} from {buyer}.",
+    }
+    
     notification_id = models.CharField(max_length=50, unique=True)
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='notifications')
-    message = models.TextField()
+    kind = models.CharField(max_length=30, choices=KINDS, default=MESSAGE)
+    # Archiving deletes the Order row, so the payload also keeps the order_id the text needs
+    order = models.ForeignKey('orders.Order', on_delete=models.SET_NULL, null=True, blank=True,
+                              related_name='notifications')
+    store = models.ForeignKey('stores.Store', on_delete=models.SET_NULL, null=True, blank=True,
+                              related_name='notifications')
+    payload = models.JSONField(default=dict, blank=True, encoder=DjangoJSONEncoder)
+    message = models.TextField(blank=True)  # free text, only for the MESSAGE kind
+    # Notifications merged into this one; order and payload are those of the latest
+    count = models.PositiveIntegerField(default=1)
+    # Digests take more notifications until then and are emailed after it
+    digest_until = models.DateTimeField(null=True, blank=True)
+    emailed_at = models.DateTimeField(null=True, blank=True)
     is_read = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Set when created and whenever a notification is merged into the digest, not when read
+    updated_at = models.DateTimeField(default=timezone.now)
+    
+    objects = NotificationQuerySet.as_manager()
+    
+    class Meta:
+        indexes = [
+            # Inbox listing, and unread lookups and mark-read UPDATEs, are always scoped to one user
+            models.Index(fields=['user', 'updated_at'], name='notif_user_updated_idx'),
+            models.Index(fields=['user', 'is_read'], name='notif_user_unread_idx'),
+            models.Index(fields=['store', 'created_at'], name='notif_store_created_idx'),
+            models.Index(fields=['digest_until'], name='notif_digest_due_idx',
+                         condition=Q(digest_until__isnull=False, emailed_at__isnull=True)),
+        ]
     
     def save(self, *args, **kwargs):
         if not self.notification_id:
-            # Generate a unique ID in production
-            self.notification_id = f"notif_{uuid.uuid4().hex[:8]}"
-        super().save(*args, **kwargs)
+            self.notification_id = generate_id('notif')
+        adding = self._state.adding
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if adding and not self.is_read:
+                NotificationCounter.add_unread({self.user_id: 1})
+            if adding:
+                publish_on_commit([self.user_id])
+    
+    def delete(self, *args, **kwargs):
+        # Through the queryset, which keeps the unread counter in step
+        deleted = Notification.objects.filter(pk=self.pk).delete()
+        self.pk = None
+        return deleted
     
     @classmethod
     def send_notification(cls, user, message):
@@ -25,23 +180,154 @@ class Notification(models.Model):
         # You could trigger email/push notifications here
         return notification
     
+    def render_message(self):
+        if self.count > 1 and self.kind in self.DIGEST_TEMPLATES:
+            template = self.DIGEST_TEMPLATES[self.kind]
+        else:
+            template = self.TEMPLATES.get(self.kind)
+        if template is None:
+            return self.message
+        try:
+            return template.format(count=self.count, **self.payload)
+        except (KeyError, IndexError):
+            return self.message
+    
     def send_email(self):
-        # In production, integrate with email service
-        from django.core.mail import send_mail
-        send_mail(
-            'Notification from TechShelf',
-            self.message,
-            'noreply@techshelf.com',
-            [self.user.email],
-            fail_silently=False,
-        )
+        """Queue an email of this notification; the send_queued_emails worker delivers it"""
+        return QueuedEmail.enqueue('Notification from TechShelf', self.render_message(), [self.user.email])
     
     def send_sms(self):
         # In production, integrate with SMS service like Twilio
         pass
     
     def __str__(self):
-        return f"Notification to {self.user.username}: {self.message[:30]}..."
+        return f"Notification to {self.user.username}: {self.render_message()[:30]}..."
+
+class NotificationCounter(models.Model):
+    """
+    Unread notifications per user, so the notification bell is a primary key lookup.
+    Kept in step by Notification.save and delete and the queryset's bulk_create, mark_read
+    and delete; the reconcile_notification_counts command repairs any drift, e.g. from raw SQL.
+    """
+    user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, primary_key=True,
+                                related_name='notification_counter')
+    unread = models.PositiveIntegerField(default=0)
+    
+    @classmethod
+    def add_unread(cls, counts):
+        """Add counts (user_id -> new unread notifications) with one upsert per user"""
+        for user_id, count in counts.items():
+            if count:
+                upsert(cls(user_id=user_id, unread=count), unique_fields=['user'], increment_fields=['unread'])
+    
+    @classmethod
+    def remove_unread(cls, counts):
+        """Take counts (user_id -> deleted unread notifications) off the counters"""
+        for user_id, count in counts.items():
+            cls.objects.filter(user_id=user_id).update(unread=Greatest(F('unread') - count, 0))
+    
+    @classmethod
+    def unread_for(cls, user):
+        return cls.objects.filter(user=user).values_list('unread', flat=True).first() or 0
+    
+    def __str__(self):
+        return f"{self.unread} unread notifications for user {self.user_id}"
+
+class NotificationPreference(models.Model):
+    """Per-user notification settings; users without a row get the defaults"""
+    user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, primary_key=True,
+                                related_name='notification_preference')
+    # Seconds during which notifications of a DIGEST_KINDS kind are merged into one; 0 turns digests off.
+    # Null uses NOTIFICATION_DIGEST_SECONDS.
+    digest_seconds = models.PositiveIntegerField(null=True, blank=True)
+    
+    @classmethod
+    def digest_windows(cls, user_ids):
+        """Digest window in seconds for each of user_ids"""
+        windows = dict.fromkeys(user_ids, settings.NOTIFICATION_DIGEST_SECONDS)
+        if windows:
+            windows.update(
+                cls.objects.filter(user_id__in=windows, digest_seconds__isnull=False)
+                .values_list('user_id', 'digest_seconds')
+            )
+        return windows
+    
+    def __str__(self):
+        return f"Notification preferences for user {self.user_id}"
+
+class StreamTicket(models.Model):
+    """
+    Single-use credential for opening the notification stream. EventSource cannot send an
+    Authorization header, and an access token in the URL would end up in server and proxy
+    logs, so clients trade their token for a ticket that works once and expires in seconds.
+    """
+    ticket = models.CharField(max_length=64, unique=True)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+')
+    expires_at = models.DateTimeField(db_index=True)
+    
+    @classmethod
+    def issue(cls, user):
+        return cls.objects.create(
+            ticket=secrets.token_urlsafe(32),
+            user=user,
+            expires_at=timezone.now() + timedelta(seconds=settings.NOTIFICATION_STREAM_TICKET_SECONDS)
+        )
+    
+    @classmethod
+    def redeem(cls, ticket):
+        """The user of a valid ticket, which is used up; None for an unknown, used or expired one"""
+        found = cls.objects.filter(ticket=ticket, expires_at__gt=timezone.now()).select_related('user').first()
+        if found is None:
+            return None
+        # Of two requests with the same ticket, only the one whose DELETE removes the row gets in
+        deleted, _ = cls.objects.filter(pk=found.pk).delete()
+        return found.user if deleted else None
+    
+    def __str__(self):
+        return f"Stream ticket for user {self.user_id}"
+
+class QueuedEmail(models.Model):
+    """
+    Outgoing email waiting for the send_queued_emails worker, so no request waits on
+    the mail server. Written in the caller's transaction, so it is only sent if that commits.
+    """
+    PENDING = 'PENDING'
+    SENT = 'SENT'
+    FAILED = 'FAILED'
+    STATUSES = (
+        (PENDING, 'Pending'),
+        (SENT, 'Sent'),
+        (FAILED, 'Failed'),
+    )
+    
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    from_email = models.CharField(max_length=254)
+    recipients = models.JSONField(default=list)
+    status = models.CharField(max_length=10, choices=STATUSES, default=PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    # Pending emails are sent from then on; a worker pushes it forward while it holds the email
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['next_attempt_at'], name='email_pending_due_idx', condition=Q(status='PENDING')),
+        ]
+    
+    @classmethod
+    def enqueue(cls, subject, body, recipients, from_email=None):
+        return cls.objects.create(
+            subject=subject,
+            body=body,
+            from_email=from_email or settings.DEFAULT_FROM_EMAIL,
+            recipients=list(recipients)
+        )
+    
+    def __str__(self):
+        return f"{self.status} email to {', '.join(self.recipients)}: {self.subject}"
 
 class SalesReport(models.Model):
     report_id = models.CharField(max_length=50, unique=True)
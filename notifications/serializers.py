@@ -1,11 +1,33 @@
 from rest_framework import serializers
-from .models import Notification, SalesReport
+from .models import Notification, NotificationPreference, SalesReport
 
 class NotificationSerializer(serializers.ModelSerializer):
+    message = serializers.CharField(source='render_message', read_only=True)
+    order_id = serializers.SerializerMethodField()
+    store_id = serializers.SerializerMethodField()
+    
     class Meta:
         model = Notification
-        fields = ['notification_id', 'user', 'message', 'is_read', 'created_at']
-        read_only_fields = ['notification_id', 'user', 'created_at']
+        fields = ['notification_id', 'user', 'kind', 'message', 'order_id', 'store_id', 'payload', 'count',
+                  'is_read', 'created_at', 'updated_at']
+        read_only_fields = ['notification_id', 'user', 'kind', 'payload', 'count', 'created_at', 'updated_at']
+    
+    def get_order_id(self, obj):
+        # From the payload, so notifications about archived orders keep their order id
+        return obj.payload.get('order_id')
+    
+    def get_store_id(self, obj):
+        return obj.store.store_id if obj.store_id else None
+
+class NotificationPreferenceSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = NotificationPreference
+        fields = ['digest_seconds']
+    
+    def validate_digest_seconds(self, value):
+        if value is not None and value > 24 * 60 * 60:
+            raise serializers.ValidationError("The digest window can be at most one day.")
+        return value
 
 class SalesReportSerializer(serializers.ModelSerializer):
     store = serializers.StringRelatedField()
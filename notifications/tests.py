@@ -0,0 +1,244 @@
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth.models import AnonymousUser
+from django.core import mail
+from django.core.mail.backends import locmem
+from django.core.management import call_command
+from django.test import RequestFactory, override_settings
+from django.utils import timezone
+from rest_framework.test import APITestCase
+
+from stores.models import Store
+from techshelf.ids import generate_id
+from users.models import User
+
+from .api_views import stream_cursor, stream_updates, stream_user
+from .models import Notification, NotificationCounter, NotificationPreference, QueuedEmail, StreamTicket
+
+
+class NotificationTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='buyer', email='buyer@example.com', password='pass')
+        self.client.force_authenticate(self.user)
+
+
+class MarkAllNotificationsReadTests(NotificationTestCase):
+    def test_marks_every_notification_read(self):
+        for _ in range(3):
+            Notification.objects.create(user=self.user, message='Hello')
+        response = self.client.post('/api/notifications/mark-all-read/', {}, format='json')
+        self.assertEqual(response.data, {'marked': 3, 'unread_count': 0})
+        self.assertEqual(NotificationCounter.unread_for(self.user), 0)
+
+    def test_invalid_before_is_a_bad_request(self):
+        for before in ('yesterday', '2024-13-45T00:00:00'):
+            with self.subTest(before=before):
+                response = self.client.post('/api/notifications/mark-all-read/', {'before': before}, format='json')
+                self.assertEqual(response.status_code, 400)
+
+
+class StreamTicketTests(NotificationTestCase):
+    def stream_request(self, **params):
+        request = RequestFactory().get('/api/notifications/stream/', params)
+        request.user = AnonymousUser()
+        return request
+
+    def test_ticket_opens_the_stream_once(self):
+        response = self.client.post('/api/notifications/stream/ticket/')
+        self.assertEqual(response.status_code, 201)
+        ticket = response.data['ticket']
+        self.assertEqual(stream_user(self.stream_request(ticket=ticket)), self.user)
+        self.assertIsNone(stream_user(self.stream_request(ticket=ticket)))
+
+    def test_expired_ticket_is_refused(self):
+        ticket = StreamTicket.issue(self.user)
+        StreamTicket.objects.filter(pk=ticket.pk).update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertIsNone(stream_user(self.stream_request(ticket=ticket.ticket)))
+
+    def test_access_token_in_the_url_is_refused(self):
+        self.assertIsNone(stream_user(self.stream_request(token='anything')))
+
+    def test_ticket_requires_authentication(self):
+        self.client.force_authenticate(None)
+        response = self.client.post('/api/notifications/stream/ticket/')
+        self.assertEqual(response.status_code, 401)
+
+
+@override_settings(NOTIFICATION_DIGEST_SECONDS=600)
+class DigestTests(NotificationTestCase):
+    def setUp(self):
+        super().setUp()
+        self.store = Store.objects.create(store_name='Gadgets', user=self.user)
+
+    def order_received(self, order_id):
+        Notification.objects.coalesce_create([Notification(
+            notification_id=generate_id('notif'), user=self.user, kind=Notification.ORDER_RECEIVED, store=self.store,
+            payload={'order_id': order_id, 'buyer': 'alice'}
+        )])
+
+    def listed(self):
+        data = self.client.get('/api/notifications/').data
+        return data['results'] if isinstance(data, dict) else data
+
+    def test_merges_into_the_open_digest(self):
+        self.order_received('ORD-1')
+        Notification.objects.create(user=self.user, message='Hello')
+        self.order_received('ORD-2')
+        self.order_received('ORD-3')
+        digest = Notification.objects.get(kind=Notification.ORDER_RECEIVED)
+        self.assertEqual(digest.count, 3)
+        self.assertEqual(digest.render_message(),
+                         '3 new orders received. Latest: #ORD-3 from alice. Please check your orders.')
+        self.assertEqual(NotificationCounter.unread_for(self.user), 2)
+        # The merges moved the digest above the newer message
+        self.assertEqual([row['notification_id'] for row in self.listed()][0], digest.notification_id)
+
+    def test_stream_sends_merged_digest_again(self):
+        self.order_received('ORD-1')
+        cursor = stream_cursor(self.user, None)
+        self.order_received('ORD-2')
+        sent = {}
+        messages, cursor, _ = stream_updates(self.user, cursor, NotificationCounter.unread_for(self.user), sent)
+        self.assertEqual(len(messages), 1)
+        self.assertIn('"count": 2', messages[0])
+        self.assertEqual(stream_updates(self.user, cursor, 1, sent)[0], [])
+
+    def test_read_or_closed_digest_is_not_merged_into(self):
+        self.order_received('ORD-1')
+        Notification.objects.mark_read(self.user)
+        self.order_received('ORD-2')
+        Notification.objects.update(digest_until=timezone.now() - timedelta(seconds=1))
+        self.order_received('ORD-3')
+        self.assertEqual(Notification.objects.count(), 3)
+
+    @override_settings(NOTIFICATION_DIGEST_SECONDS=0)
+    def test_window_setting_of_zero_turns_digests_off(self):
+        self.order_received('ORD-1')
+        self.order_received('ORD-2')
+        self.assertEqual(Notification.objects.count(), 2)
+        self.assertIsNone(Notification.objects.first().digest_until)
+
+    @override_settings(NOTIFICATION_DIGEST_SECONDS=0)
+    def test_preference_overrides_the_window_setting(self):
+        response = self.client.put('/api/notifications/preferences/', {'digest_seconds': 60}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(NotificationPreference.digest_windows([self.user.pk]), {self.user.pk: 60})
+        self.order_received('ORD-1')
+        self.order_received('ORD-2')
+        self.assertEqual(Notification.objects.get().count, 2)
+
+
+class NotificationStreamTests(NotificationTestCase):
+    def test_cursor_stays_behind_the_settle_window(self):
+        cursor = stream_cursor(self.user, None)
+        sent = {}
+        late = Notification.objects.create(user=self.user, message='Committed late')
+        recent = Notification.objects.create(user=self.user, message='Recent')
+        Notification.objects.filter(pk=late.pk).update(updated_at=late.updated_at - timedelta(seconds=1))
+        messages, cursor, unread = stream_updates(self.user, cursor, None, sent)
+        self.assertEqual([message.split('\n')[1] for message in messages],
+                         ['event: notification', 'event: notification', 'event: unread_count'])
+        # Neither row is settled yet, so a resuming client gets both again
+        self.assertEqual(stream_cursor(self.user, messages[-1].split('\n')[0][4:])[:2], cursor[:2])
+        self.assertLess(cursor[0], late.updated_at - timedelta(seconds=1))
+        self.assertEqual(stream_updates(self.user, cursor, unread, sent)[0], [])
+
+        with override_settings(ORDER_EVENT_SETTLE_SECONDS=0):
+            messages, cursor, unread = stream_updates(self.user, cursor, unread, sent)
+        self.assertEqual(messages, [])
+        self.assertEqual(cursor[:2], (recent.updated_at, recent.pk))
+        self.assertEqual(sent, {})
+
+
+@override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend', EMAIL_QUEUE_RETRY_SECONDS=60,
+                   EMAIL_QUEUE_MAX_ATTEMPTS=3)
+class QueuedEmailTests(NotificationTestCase):
+    def send_queued_emails(self):
+        stderr = StringIO()
+        call_command('send_queued_emails', '--rate', '0', stdout=StringIO(), stderr=stderr)
+        return stderr.getvalue()
+
+    def fail_sends(self):
+        return mock.patch.object(locmem.EmailBackend, 'send_messages', side_effect=OSError('recipient refused'))
+
+    def make_due(self):
+        QueuedEmail.objects.update(next_attempt_at=timezone.now())
+
+    def test_sends_queued_emails(self):
+        for number in range(3):
+            QueuedEmail.enqueue(f'Email {number}', 'Hello', [self.user.email])
+        self.send_queued_emails()
+        self.assertEqual(sorted(message.subject for message in mail.outbox), ['Email 0', 'Email 1', 'Email 2'])
+        self.assertFalse(QueuedEmail.objects.exclude(status=QueuedEmail.SENT).exists())
+
+    def test_failed_email_is_retried_with_backoff(self):
+        email = QueuedEmail.enqueue('Hello', 'Hello', [self.user.email])
+        for attempts, backoff in ((1, 60), (2, 120)):
+            started = timezone.now()
+            with self.fail_sends():
+                self.send_queued_emails()
+                # Not due again until the backoff has passed
+                self.send_queued_emails()
+            email.refresh_from_db()
+            self.assertEqual((email.status, email.attempts), (QueuedEmail.PENDING, attempts))
+            self.assertEqual(email.last_error, 'OSError: recipient refused')
+            self.assertGreaterEqual(email.next_attempt_at, started + timedelta(seconds=backoff))
+            self.assertLess(email.next_attempt_at, timezone.now() + timedelta(seconds=backoff))
+            self.make_due()
+
+        self.send_queued_emails()
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.last_error), (QueuedEmail.SENT, ''))
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_email_fails_after_max_attempts(self):
+        email = QueuedEmail.enqueue('Hello', 'Hello', [self.user.email])
+        with self.fail_sends():
+            for _ in range(3):
+                self.send_queued_emails()
+                self.make_due()
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts), (QueuedEmail.FAILED, 3))
+        self.send_queued_emails()
+        self.assertEqual(mail.outbox, [])
+
+    def test_unavailable_server_does_not_use_an_attempt(self):
+        email = QueuedEmail.enqueue('Hello', 'Hello', [self.user.email])
+        with mock.patch.object(locmem.EmailBackend, 'open', side_effect=ConnectionRefusedError('refused')):
+            self.assertIn('Mail server unavailable', self.send_queued_emails())
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts), (QueuedEmail.PENDING, 0))
+        self.assertGreater(email.next_attempt_at, timezone.now())
+
+
+class NotificationCounterTests(NotificationTestCase):
+    def test_counter_follows_creates_reads_and_deletes(self):
+        notifications = [Notification.objects.create(user=self.user, message='Hello') for _ in range(4)]
+        Notification.objects.create(user=self.user, message='Seen', is_read=True)
+        self.assertEqual(NotificationCounter.unread_for(self.user), 4)
+
+        Notification.objects.filter(pk=notifications[0].pk).mark_read(self.user)
+        self.assertEqual(NotificationCounter.unread_for(self.user), 3)
+        notifications[1].delete()
+        self.assertEqual(NotificationCounter.unread_for(self.user), 2)
+        # Read ones are not on the counter
+        Notification.objects.filter(is_read=True).delete()
+        self.assertEqual(NotificationCounter.unread_for(self.user), 2)
+        Notification.objects.all().delete()
+        self.assertEqual(NotificationCounter.unread_for(self.user), 0)
+
+    def test_reconcile_repairs_drifted_counters(self):
+        other = User.objects.create_user(username='other', email='other@example.com', password='pass')
+        for user in (self.user, self.user, other):
+            Notification.objects.create(user=user, message='Hello')
+        NotificationCounter.objects.filter(user=self.user).update(unread=7)
+        NotificationCounter.objects.filter(user=other).delete()
+
+        call_command('reconcile_notification_counts', '--dry-run', stdout=StringIO())
+        self.assertEqual(NotificationCounter.unread_for(self.user), 7)
+        out = StringIO()
+        call_command('reconcile_notification_counts', '--batch-size', '1', stdout=out)
+        self.assertIn('Repaired 2 counters off by 6 in total', out.getvalue())
+        self.assertEqual((NotificationCounter.unread_for(self.user), NotificationCounter.unread_for(other)), (2, 1))
@@ -5,6 +5,7 @@ app_name = 'notifications'
 
 urlpatterns = [
     path('', views.notification_list_view, name='list'),
+    path('mark-all-read/', views.mark_all_notifications_read_view, name='mark_all_read'),
     path('<str:notification_id>/mark-read/', views.mark_notification_read_view, name='mark_read'),
     path('reports/', views.sales_reports_view, name='reports'),
     path('reports/generate/', views.generate_report_view, name='generate_report'),
@@ -7,7 +7,7 @@ from datetime import datetime
 
 @login_required
 def notification_list_view(request):
-    notifications = Notification.objects.filter(user=request.user).order_by('-created_at')
+    notifications = Notification.objects.filter(user=request.user).order_by('-updated_at')
     return render(request, 'notifications/list.html', {'notifications': notifications})
 
 @login_required
@@ -15,12 +15,19 @@ def mark_notification_read_view(request, notification_id):
     notification = get_object_or_404(Notification, notification_id=notification_id, user=request.user)
     
     if request.method == 'POST':
-        notification.is_read = True
-        notification.save()
+        Notification.objects.filter(pk=notification.pk).mark_read(request.user)
         messages.success(request, 'Notification marked as read.')
     
     return redirect('notifications:list')
 
+@login_required
+def mark_all_notifications_read_view(request):
+    if request.method == 'POST':
+        marked = Notification.objects.all().mark_read(request.user)
+        messages.success(request, f'{marked} notifications marked as read.')
+    
+    return redirect('notifications:list')
+
 @login_required
 def sales_reports_view(request):
     # Check if user is a seller
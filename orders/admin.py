@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Cart, CartItem, ShippingInfo, Order, OrderItem, Payment, Promotion
+from .models import Cart, CartItem, ShippingInfo, Order, OrderItem, ArchivedOrder, ArchivedOrderItem, Payment, Promotion, PromotionCampaign, IdempotencyKey, OrderEvent, OrderEventCheckpoint
 
 class CartItemInline(admin.TabularInline):
     model = CartItem
@@ -26,6 +26,17 @@ class OrderAdmin(admin.ModelAdmin):
     inlines = [OrderItemInline]
     date_hierarchy = 'created_at'
 
+class ArchivedOrderItemInline(admin.TabularInline):
+    model = ArchivedOrderItem
+    extra = 0
+
+class ArchivedOrderAdmin(admin.ModelAdmin):
+    list_display = ('order_id', 'user', 'total_amount', 'payment_status', 'order_status', 'created_at', 'archived_at')
+    list_filter = ('payment_status', 'order_status')
+    search_fields = ('order_id', 'user__username')
+    inlines = [ArchivedOrderItemInline]
+    date_hierarchy = 'created_at'
+
 class PaymentAdmin(admin.ModelAdmin):
     list_display = ('payment_id', 'order', 'amount', 'payment_status', 'created_at')
     list_filter = ('payment_status',)
@@ -33,11 +44,38 @@ class PaymentAdmin(admin.ModelAdmin):
     date_hierarchy = 'created_at'
 
 class PromotionAdmin(admin.ModelAdmin):
-    list_display = ('promotion_id', 'discount_code', 'discount_percentage', 'expiry_date')
+    list_display = ('promotion_id', 'discount_code', 'discount_percentage', 'expiry_date', 'remaining_uses', 'campaign')
     search_fields = ('promotion_id', 'discount_code')
+    list_select_related = ('campaign',)
+    raw_id_fields = ('campaign',)
+
+class PromotionCampaignAdmin(admin.ModelAdmin):
+    list_display = ('campaign_id', 'name', 'code_prefix', 'discount_percentage', 'expiry_date', 'uses_per_code', 'created_at')
+    search_fields = ('campaign_id', 'name', 'code_prefix')
+    date_hierarchy = 'created_at'
+
+class IdempotencyKeyAdmin(admin.ModelAdmin):
+    list_display = ('key', 'user', 'response_status', 'created_at', 'expires_at')
+    search_fields = ('key', 'user__username')
+    date_hierarchy = 'created_at'
+
+class OrderEventAdmin(admin.ModelAdmin):
+    list_display = ('id', 'order_id', 'event_type', 'order_status', 'payment_status', 'created_at')
+    list_filter = ('event_type',)
+    search_fields = ('order_id',)
+    date_hierarchy = 'created_at'
+
+class OrderEventCheckpointAdmin(admin.ModelAdmin):
+    list_display = ('consumer', 'last_event_id', 'updated_at')
+    search_fields = ('consumer',)
 
 admin.site.register(Cart, CartAdmin)
 admin.site.register(ShippingInfo, ShippingInfoAdmin)
 admin.site.register(Order, OrderAdmin)
+admin.site.register(ArchivedOrder, ArchivedOrderAdmin)
 admin.site.register(Payment, PaymentAdmin)
 admin.site.register(Promotion, PromotionAdmin)
+admin.site.register(PromotionCampaign, PromotionCampaignAdmin)
+admin.site.register(IdempotencyKey, IdempotencyKeyAdmin)
+admin.site.register(OrderEvent, OrderEventAdmin)
+admin.site.register(OrderEventCheckpoint, OrderEventCheckpointAdmin)
\ No newline at end of file
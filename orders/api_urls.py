@@ -1,22 +1,26 @@
 from django.urls import path
 from .api_views import (
-    CartView, CartAddItemView, CartRemoveItemView, CartUpdateItemView,
-    CheckoutView, OrderListView, OrderDetailView, OrderCancelView,
+    CartView, CartSummaryView, CartAddItemView, CartRemoveItemView, CartUpdateItemView, CartBatchView,
+    CheckoutView, OrderListView, OrderDetailView, OrderCancelView, OrderReorderView,
     ApplyPromotionView, SellerOrderListView, SellerOrderDetailView,
-    SellerOrderUpdateStatusView
+    SellerOrderUpdateStatusView, SellerOrderBulkUpdateStatusView
 )
 
 urlpatterns = [
     path('cart/', CartView.as_view(), name='api_cart'),
+    path('cart/summary/', CartSummaryView.as_view(), name='api_cart_summary'),
     path('cart/add/', CartAddItemView.as_view(), name='api_cart_add'),
     path('cart/remove/<str:product_id>/', CartRemoveItemView.as_view(), name='api_cart_remove'),
     path('cart/update/<str:product_id>/', CartUpdateItemView.as_view(), name='api_cart_update'),
+    path('cart/batch/', CartBatchView.as_view(), name='api_cart_batch'),
     path('checkout/', CheckoutView.as_view(), name='api_checkout'),
     path('orders/', OrderListView.as_view(), name='api_order_list'),
     path('seller-orders/', SellerOrderListView.as_view(), name='api_seller_order_list'),
     path('orders/<str:order_id>/', OrderDetailView.as_view(), name='api_order_detail'),
     path('orders/<str:order_id>/cancel/', OrderCancelView.as_view(), name='api_order_cancel'),
+    path('orders/<str:order_id>/reorder/', OrderReorderView.as_view(), name='api_order_reorder'),
     path('promotions/apply/', ApplyPromotionView.as_view(), name='api_apply_promotion'),
+    path('seller-orders/bulk-update-status/', SellerOrderBulkUpdateStatusView.as_view(), name='api_seller_order_bulk_update_status'),
     path('seller-orders/<str:order_id>/', SellerOrderDetailView.as_view(), name='api_seller_order_detail'),
     path('seller-orders/<str:order_id>/update-status/', SellerOrderUpdateStatusView.as_view(), name='api_seller_order_update_status'),
 ]
\ No newline at end of file
@@ -1,51 +1,70 @@
 from rest_framework import generics, permissions, status
 from rest_framework.response import Response
 from rest_framework.views import APIView
+from django.db.models import Exists, OuterRef
+from django.http import Http404
 from django.shortcuts import get_object_or_404
-from .models import Cart, CartItem, ShippingInfo, Order, OrderItem, Promotion
+from django.db import transaction
+from .models import Cart, ShippingInfo, Order, OrderEvent, OrderItem, ArchivedOrder, ArchivedOrderItem, Promotion
 from products.models import Product
 from notifications.models import Notification
-from .serializers import CartSerializer, OrderSerializer, ShippingInfoSerializer, PromotionSerializer, OrderItemSerializer, CartItemSerializer
+from .serializers import CartSerializer, OrderSerializer, ArchivedOrderSerializer, ShippingInfoSerializer, PromotionSerializer, OrderItemSerializer, CartItemSerializer
+from .gateway import ChargeResult
+from .idempotency import idempotent, transient
+from .services import CartService, OrderService
+from .promotions import get_active_promotion, promotion_cache
+from .pricing import cart_summary, empty_cart_summary
+from techshelf.versioning import StaleObjectError, expected_version
 from decimal import Decimal
 
+def order_read_queryset():
+    """Orders with everything OrderSerializer touches loaded in a fixed number of queries"""
+    return Order.objects.select_related('user', 'shipping_info').prefetch_related('items')
+
+def archived_order_read_queryset():
+    return ArchivedOrder.objects.select_related('user', 'shipping_info').prefetch_related('items')
+
+class ArchiveFallbackMixin:
+    """
+    Retrieve views over orders that also serve orders moved to the archive tables.
+    Subclasses return the archived equivalent of get_queryset() from get_archive_queryset().
+    """
+    
+    def get_archive_queryset(self):
+        raise NotImplementedError
+    
+    def get_object(self):
+        try:
+            return super().get_object()
+        except Http404:
+            return get_object_or_404(self.get_archive_queryset(), order_id=self.kwargs[self.lookup_field])
+    
+    def retrieve(self, request, *args, **kwargs):
+        instance = self.get_object()
+        serializer_class = ArchivedOrderSerializer if isinstance(instance, ArchivedOrder) else self.get_serializer_class()
+        serializer = serializer_class(instance, context=self.get_serializer_context())
+        return Response(serializer.data)
+
 class CartView(generics.RetrieveAPIView):
     """View the current user's cart"""
     serializer_class = CartSerializer
     permission_classes = [permissions.IsAuthenticated]
     
     def get_object(self):
-        # Check if there are multiple carts for this user
-        user_carts = Cart.objects.filter(user=self.request.user)
-        
-        if user_carts.count() > 1:
-            # Multiple carts detected
-            main_cart = user_carts.first()  
-            
-            other_carts = user_carts.exclude(id=main_cart.id)
-            
-            # Transfer all items from other carts to the main cart
-            for other_cart in other_carts:
-                for item in other_cart.items.all():
-                    # Check if item already exists in main cart
-                    try:
-                        main_cart_item = main_cart.items.get(product_id=item.product_id)
-                        # If it exists, update the quantity
-                        main_cart_item.quantity += item.quantity
-                        main_cart_item.save()
-                    except CartItem.DoesNotExist:
-                        # If it doesn't exist, move it to the main cart
-                        item.cart = main_cart
-                        item.save()
-                
-                # Delete the other cart after moving all its items
-                other_cart.delete()
-            
-            return main_cart
-        
-        # Get or create a cart for the user (normal case)
+        # Cart.user is unique, so this is a single indexed lookup
         cart, _ = Cart.objects.get_or_create(user=self.request.user)
         return cart
 
+class CartSummaryView(APIView):
+    """Item count and totals of the current user's cart, for the header badge"""
+    permission_classes = [permissions.IsAuthenticated]
+    
+    def get(self, request):
+        cart = Cart.objects.filter(user=request.user).first()
+        if cart is None:
+            return Response(empty_cart_summary())
+        return Response(cart_summary(cart))
+
 class CartAddItemView(APIView):
     """Add a product to the cart"""
     permission_classes = [permissions.IsAuthenticated]
@@ -102,34 +121,74 @@ class CartUpdateItemView(APIView):
         # Get cart
         cart, _ = Cart.objects.get_or_create(user=request.user)
         
-        # Find the cart item
+        # Check if product has enough stock
         try:
-            cart_item = cart.items.get(product_id=product_id)
-            
-            # Check if product has enough stock
             product = Product.objects.get(product_id=product_id)
-            if quantity > product.stock:
-                return Response({'error': f'Only {product.stock} units available'}, status=status.HTTP_400_BAD_REQUEST)
-            
-            # Update quantity or remove if zero
-            if quantity > 0:
-                cart_item.quantity = quantity
-                cart_item.save()
-            else:
-                cart_item.delete()
-                
-            # Return updated cart
-            serializer = CartSerializer(cart)
-            return Response(serializer.data)
-        except CartItem.DoesNotExist:
-            return Response({'error': 'Item not found in cart'}, status=status.HTTP_404_NOT_FOUND)
         except Product.DoesNotExist:
             return Response({'error': 'Product not found'}, status=status.HTTP_404_NOT_FOUND)
+        if quantity > product.stock:
+            return Response({'error': f'Only {product.stock} units available'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        # Update quantity or remove if zero in one statement, so concurrent updates cannot interleave
+        if not cart.update_item(product_id, quantity):
+            return Response({'error': 'Item not found in cart'}, status=status.HTTP_404_NOT_FOUND)
+        
+        # Return updated cart
+        serializer = CartSerializer(cart)
+        return Response(serializer.data)
+
+class CartBatchView(APIView):
+    """Apply several add/set/remove operations to the cart in one request"""
+    permission_classes = [permissions.IsAuthenticated]
+    max_operations = 100
+    
+    def post(self, request):
+        operations = request.data.get('operations')
+        if not isinstance(operations, list) or not operations:
+            return Response({'error': 'operations must be a non-empty list'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(operations) > self.max_operations:
+            return Response({'error': f'At most {self.max_operations} operations per request'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        
+        # Validate every operation before touching the cart
+        parsed = []
+        for index, operation in enumerate(operations):
+            if not isinstance(operation, dict):
+                return Response({'error': 'Each operation must be an object', 'index': index},
+                                status=status.HTTP_400_BAD_REQUEST)
+            op = operation.get('op')
+            product_id = operation.get('product_id')
+            if op not in ('add', 'set', 'remove'):
+                return Response({'error': 'op must be add, set or remove', 'index': index},
+                                status=status.HTTP_400_BAD_REQUEST)
+            if not product_id:
+                return Response({'error': 'Product ID is required', 'index': index},
+                                status=status.HTTP_400_BAD_REQUEST)
+            try:
+                quantity = int(operation.get('quantity', 1 if op == 'add' else 0))
+            except (TypeError, ValueError):
+                return Response({'error': 'quantity must be an integer', 'index': index},
+                                status=status.HTTP_400_BAD_REQUEST)
+            if quantity < 0 or (op == 'add' and quantity == 0):
+                return Response({'error': 'quantity must be positive', 'index': index},
+                                status=status.HTTP_400_BAD_REQUEST)
+            parsed.append((op, str(product_id), quantity))
+        
+        cart, _ = Cart.objects.get_or_create(user=request.user)
+        try:
+            CartService.apply_operations(cart, parsed)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        # Return updated cart
+        serializer = CartSerializer(cart)
+        return Response(serializer.data)
 
 class CheckoutView(APIView):
     """Process checkout and create an order"""
     permission_classes = [permissions.IsAuthenticated]
     
+    @idempotent
     def post(self, request):
         cart, _ = Cart.objects.get_or_create(user=request.user)
         
@@ -137,6 +196,14 @@ class CheckoutView(APIView):
         if not cart.items.exists():
             return Response({'error': 'Your cart is empty'}, status=status.HTTP_400_BAD_REQUEST)
         
+        # Validate the discount code before anything is written
+        promotion = None
+        discount_code = request.data.get('discount_code')
+        if discount_code:
+            promotion, error = get_active_promotion(discount_code)
+            if error:
+                return Response({'error': error}, status=status.HTTP_400_BAD_REQUEST)
+        
         # Extract shipping info
         shipping_data = {
             'shipping_address': request.data.get('shipping_address', '123 Default St'),
@@ -150,27 +217,34 @@ class CheckoutView(APIView):
         if not shipping_serializer.is_valid():
             return Response(shipping_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
         
-        # Create shipping info
-        shipping_info = shipping_serializer.save()
+        try:
+            # Shipping info, order, pending payment, discount and notifications are written in one transaction
+            with transaction.atomic():
+                shipping_info = shipping_serializer.save()
+                order = cart.checkout(shipping_info=shipping_info, promotion=promotion)
+                
+                # Notify the buyer and every seller in the order
+                OrderService.notify_order_placed(order)
+        except ValueError as e:
+            # Stock or discount code problems found while placing the order
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except Exception as e:
+            import traceback
+            traceback.print_exc()
+            # Nothing was written, so a retry with the same key may try again
+            return transient(Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST))
+        
+        # The order exists from here on, so every outcome is stored against the idempotency key
+        payment_info = request.data.get('payment_info', {})
+        if not payment_info:
+            payment_info = {
+                'card_number': '4111111111111111',
+                'expiry_date': '12/2025',
+                'cvv': '123',
+                'name_on_card': 'Test User'
+            }
         
-        # Create order
         try:
-            order = cart.checkout()
-            
-            # Add shipping info to order
-            order.shipping_info = shipping_info
-            order.save()
-            
-            # Process payment
-            payment_info = request.data.get('payment_info', {})
-            if not payment_info:
-                payment_info = {
-                    'card_number': '4111111111111111',
-                    'expiry_date': '12/2025',
-                    'cvv': '123',
-                    'name_on_card': 'Test User'
-                }
-            
             if request.data.get('save_card'):
                 from users.models import BillingInfo
                 BillingInfo.objects.update_or_create(
@@ -184,36 +258,18 @@ class CheckoutView(APIView):
                 )
             
             order.process_payment(payment_info)
-            
-            # Create notification for buyer
-            Notification.objects.create(
-                user=request.user,
-                message=f"Your order #{order.order_id} has been placed successfully. Total amount: ${order.total_amount}."
-            )
-            
-            # Create notification for sellers
-            for item in order.items.all():
-                try:
-                    product = Product.objects.get(product_id=item.product_id)
-                    seller = product.store.user
-                    
-                    # Create notification for each unique seller
-                    Notification.objects.get_or_create(
-                        user=seller,
-                        message=f"New order #{order.order_id} received from {request.user.username}. Please check your orders.",
-                        defaults={'is_read': False}
-                    )
-                except Product.DoesNotExist:
-                    pass
-            
-            # Return created order
-            serializer = OrderSerializer(order)
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
-            
-        except Exception as e:
+        except Exception:
             import traceback
-            traceback.print_exc()  
-            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+            traceback.print_exc()
+            # Fail the payment, which cancels the order and releases its stock and discount code.
+            # A payment the gateway already settled is left as it is.
+            OrderService.settle_payment(order.payment.payment_id,
+                                        ChargeResult(False, error='Payment could not be processed'))
+            order.refresh_from_db()
+        
+        # Return created order
+        serializer = OrderSerializer(order)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
 
 class OrderListView(generics.ListAPIView):
     """List all orders for the authenticated user"""
@@ -221,55 +277,58 @@ class OrderListView(generics.ListAPIView):
     permission_classes = [permissions.IsAuthenticated]
     
     def get_queryset(self):
-        return Order.objects.filter(user=self.request.user).order_by('-created_at')
+        return order_read_queryset().filter(user=self.request.user).order_by('-created_at')
 
-class OrderDetailView(generics.RetrieveAPIView):
+class OrderDetailView(ArchiveFallbackMixin, generics.RetrieveAPIView):
     """Get details of a specific order"""
     serializer_class = OrderSerializer
     permission_classes = [permissions.IsAuthenticated]
     lookup_field = 'order_id'
     
     def get_queryset(self):
-        return Order.objects.filter(user=self.request.user)
+        return order_read_queryset().filter(user=self.request.user)
+    
+    def get_archive_queryset(self):
+        return archived_order_read_queryset().filter(user=self.request.user)
+
+class OrderReorderView(APIView):
+    """Add the items of a past order to the cart"""
+    permission_classes = [permissions.IsAuthenticated]
+    
+    def post(self, request, order_id):
+        order = Order.objects.prefetch_related('items').filter(order_id=order_id, user=request.user).first()
+        if order is None:
+            # Old orders can be reordered from the archive
+            order = get_object_or_404(
+                ArchivedOrder.objects.prefetch_related('items'), order_id=order_id, user=request.user
+            )
+        cart, _ = Cart.objects.get_or_create(user=request.user)
+        
+        added, unavailable, price_changes = CartService.reorder(cart, order)
+        
+        return Response({
+            'cart': CartSerializer(cart).data,
+            'added': added,
+            'unavailable': unavailable,
+            'price_changes': price_changes,
+        })
 
 class OrderCancelView(APIView):
     """Cancel an order and initiate a refund"""
     permission_classes = [permissions.IsAuthenticated]
     
+    @idempotent
     def post(self, request, order_id):
-        order = get_object_or_404(Order, order_id=order_id, user=request.user)
+        order = get_object_or_404(Order.objects.select_related('user'), order_id=order_id, user=request.user)
         
-        if order.payment_status == 'PAID' and order.order_status != 'DELIVERED' and order.order_status != 'CANCELLED':
-            # Refund payment
-            order.payment.refund_payment()
-            
-            # Create notification for the order cancellation
-            Notification.objects.create(
-                user=request.user,
-                message=f"Your order #{order.order_id} has been cancelled and payment refunded."
-            )
-            
-            # Notify sellers about the cancellation
-            for item in order.items.all():
-                try:
-                    product = Product.objects.get(product_id=item.product_id)
-                    seller = product.store.user
-                    Notification.objects.create(
-                        user=seller,
-                        message=f"Order #{order.order_id} from {order.user.username} has been cancelled."
-                    )
-                    
-                    # Restore stock
-                    product.stock += item.quantity
-                    product.save()
-                except Product.DoesNotExist:
-                    pass
-                    
-            # Return updated order
-            serializer = OrderSerializer(order)
-            return Response(serializer.data)
-        else:
-            return Response({'error': 'This order cannot be cancelled.'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            OrderService.cancel_order(order)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        # Return updated order
+        serializer = OrderSerializer(order)
+        return Response(serializer.data)
 
 class ApplyPromotionView(APIView):
     """Apply a promotion code to the current cart"""
@@ -280,11 +339,16 @@ class ApplyPromotionView(APIView):
         if not discount_code:
             return Response({'error': 'Discount code is required'}, status=status.HTTP_400_BAD_REQUEST)
         
-        try:
-            promotion = Promotion.objects.get(discount_code=discount_code)
-        except Promotion.DoesNotExist:
+        promotion = promotion_cache.lookup(discount_code)
+        if promotion is None:
             return Response({'error': 'Invalid discount code'}, status=status.HTTP_404_NOT_FOUND)
         
+        if not promotion.is_active():
+            return Response({'error': 'This discount code has expired'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        if promotion.is_exhausted:
+            return Response({'error': 'This discount code has been fully redeemed'}, status=status.HTTP_400_BAD_REQUEST)
+        
         # Return promotion details
         serializer = PromotionSerializer(promotion)
         return Response(serializer.data)
@@ -301,13 +365,13 @@ class SellerOrderListView(generics.ListAPIView):
                 
             store = self.request.user.store
             
-            store_product_ids = list(store.products.values_list('product_id', flat=True))
+            store_product_ids = store.products.values_list('product_id', flat=True)
             
             store_order_items = OrderItem.objects.filter(product_id__in=store_product_ids)
             
             order_ids = store_order_items.values_list('order', flat=True).distinct()
             
-            orders = Order.objects.filter(id__in=order_ids).order_by('-created_at')
+            orders = order_read_queryset().filter(id__in=order_ids).order_by('-created_at')
             
             status_filter = self.request.query_params.get('status')
             if status_filter and status_filter != 'ALL':
@@ -321,7 +385,7 @@ class SellerOrderListView(generics.ListAPIView):
             print(traceback.format_exc())
             return Order.objects.none() 
 
-class SellerOrderDetailView(generics.RetrieveAPIView):
+class SellerOrderDetailView(ArchiveFallbackMixin, generics.RetrieveAPIView):
     """Get details of a specific order for a seller - only if it contains their products"""
     serializer_class = OrderSerializer
     permission_classes = [permissions.IsAuthenticated]
@@ -348,7 +412,7 @@ class SellerOrderDetailView(generics.RetrieveAPIView):
             )
             
             # Return orders that contain these items
-            return Order.objects.filter(
+            return order_read_queryset().filter(
                 Exists(order_item_subquery)
             )
                 
@@ -357,11 +421,22 @@ class SellerOrderDetailView(generics.RetrieveAPIView):
             print(f"Error in SellerOrderDetailView.get_queryset: {str(e)}")
             print(traceback.format_exc())
             return Order.objects.none()
+    
+    def get_archive_queryset(self):
+        if self.request.user.role != 'SELLER' or not hasattr(self.request.user, 'store'):
+            return ArchivedOrder.objects.none()
+        
+        seller_items = ArchivedOrderItem.objects.filter(
+            order=OuterRef('pk'),
+            product_id__in=self.request.user.store.products.values('product_id')
+        )
+        return archived_order_read_queryset().filter(Exists(seller_items))
 
 class SellerOrderUpdateStatusView(APIView):
     """Update order status for seller - only if it contains their products"""
     permission_classes = [permissions.IsAuthenticated]
     
+    @idempotent
     def put(self, request, order_id):
         try:
             # Check if user is a seller and has a store
@@ -374,7 +449,7 @@ class SellerOrderUpdateStatusView(APIView):
             store_product_ids = list(store.products.values_list('product_id', flat=True))
             
             # Find the order
-            order = get_object_or_404(Order, order_id=order_id)
+            order = get_object_or_404(Order.objects.select_related('user'), order_id=order_id)
             
             # Check if order contains products from this seller
             order_contains_seller_products = OrderItem.objects.filter(
@@ -388,19 +463,48 @@ class SellerOrderUpdateStatusView(APIView):
             
             # Get new status and validate
             new_status = request.data.get('status')
-            valid_statuses = [status_option for status_option, _ in Order.ORDER_STATUS]
+            source_statuses = Order.source_statuses_for(new_status) if new_status else []
             
-            if not new_status or new_status not in valid_statuses:
+            if not source_statuses and new_status != 'CANCELLED':
                 return Response({'error': 'Invalid status'}, status=status.HTTP_400_BAD_REQUEST)
-                
-            # Update order status
+            
+            # A client that sends the version it last saw is refused if the order moved on since
+            try:
+                version = expected_version(request.data)
+            except ValueError as e:
+                return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+            if version is not None and version != order.version:
+                return Response({'error': 'This order was changed by someone else. Reload it and try again.'},
+                                status=status.HTTP_409_CONFLICT)
+            
+            if new_status == 'CANCELLED':
+                # Cancelling refunds the payment and puts the stock back, as when the buyer cancels
+                try:
+                    OrderService.cancel_order(order)
+                except ValueError as e:
+                    return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+                return Response(OrderSerializer(order).data)
+            
+            if order.order_status not in source_statuses:
+                return Response({'error': f'Cannot change status from {order.order_status} to {new_status}'},
+                                status=status.HTTP_400_BAD_REQUEST)
+            
+            # Update order status; a concurrent refund or status change makes this a conflict
+            previous_status = order.order_status
             order.order_status = new_status
-            order.save()
+            try:
+                with transaction.atomic():
+                    order.save(update_fields=['order_status', 'updated_at'])
+                    OrderEvent.record(order, OrderEvent.STATUS_CHANGED, **{'from': previous_status, 'to': new_status})
+            except StaleObjectError as e:
+                return Response({'error': str(e)}, status=status.HTTP_409_CONFLICT)
             
             # Create notification for buyer
             Notification.objects.create(
                 user=order.user,
-                message=f"Your order #{order.order_id} status has been updated to {new_status}."
+                kind=Notification.ORDER_STATUS_CHANGED,
+                order=order,
+                payload={'order_id': order.order_id, 'status': new_status}
             )
             
             # Return updated order
@@ -412,3 +516,36 @@ class SellerOrderUpdateStatusView(APIView):
             print(f"Error in SellerOrderUpdateStatusView: {str(e)}")
             print(traceback.format_exc())
             return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+class SellerOrderBulkUpdateStatusView(APIView):
+    """Update the status of many orders at once for seller - only orders containing their products"""
+    permission_classes = [permissions.IsAuthenticated]
+    max_orders = 500
+    
+    @idempotent
+    def post(self, request):
+        if request.user.role != 'SELLER' or not hasattr(request.user, 'store'):
+            return Response({'error': 'Only sellers can update order status'}, status=status.HTTP_403_FORBIDDEN)
+        
+        order_ids = request.data.get('order_ids')
+        new_status = request.data.get('status')
+        
+        if not isinstance(order_ids, list) or not order_ids or not all(isinstance(order_id, str) for order_id in order_ids):
+            return Response({'error': 'order_ids must be a non-empty list of order IDs'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        if len(order_ids) > self.max_orders:
+            return Response({'error': f'At most {self.max_orders} orders can be updated at once'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        
+        if not new_status or not Order.source_statuses_for(new_status):
+            return Response({'error': 'Invalid status'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        # Preserve request order while dropping duplicates
+        order_ids = list(dict.fromkeys(order_ids))
+        updated, rejected = OrderService.bulk_update_status(request.user.store, order_ids, new_status)
+        
+        return Response({
+            'status': new_status,
+            'updated': updated,
+            'rejected': [{'order_id': order_id, 'error': error} for order_id, error in rejected.items()],
+        })
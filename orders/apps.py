@@ -3,3 +3,8 @@ from django.apps import AppConfig
 class OrdersConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'orders'
+    
+    def ready(self):
+        from django.contrib.auth.signals import user_logged_in
+        from .guest_cart import merge_guest_cart
+        user_logged_in.connect(merge_guest_cart, dispatch_uid='orders.merge_guest_cart')
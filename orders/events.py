@@ -0,0 +1,55 @@
+"""
+Incremental reading of the OrderEvent log.
+
+Each consumer (a report, a stats job, a webhook sender) keeps a checkpoint
+with the id of the last event it processed. consume() hands it the events
+after that id in batches and advances the checkpoint in the same transaction
+as the handler call, so a batch is only skipped once its handler returned.
+
+Event ids are assigned at insert but become visible at commit, so a slow
+transaction can commit an id lower than one a consumer has already passed.
+Events younger than ORDER_EVENT_SETTLE_SECONDS are therefore left for the
+next run.
+"""
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import OrderEvent, OrderEventCheckpoint
+
+
+def events_after(last_event_id, limit):
+    """Settled events after last_event_id, oldest first"""
+    settled_before = timezone.now() - timedelta(seconds=settings.ORDER_EVENT_SETTLE_SECONDS)
+    return list(
+        OrderEvent.objects.filter(pk__gt=last_event_id, created_at__lte=settled_before).order_by('pk')[:limit]
+    )
+
+
+def consume(consumer, handler, batch_size=500):
+    """
+    Call handler(events) with every batch of events the consumer has not processed yet.
+    An exception from handler leaves the checkpoint where it was. Returns the number of events processed.
+    """
+    processed = 0
+    while True:
+        with transaction.atomic():
+            # The row lock keeps two runs of the same consumer from processing a batch twice
+            checkpoint, _ = OrderEventCheckpoint.objects.select_for_update().get_or_create(consumer=consumer)
+            events = events_after(checkpoint.last_event_id, batch_size)
+            if not events:
+                return processed
+            handler(events)
+            checkpoint.last_event_id = events[-1].pk
+            checkpoint.save(update_fields=['last_event_id', 'updated_at'])
+        processed += len(events)
+        if len(events) < batch_size:
+            return processed
+
+
+def reset(consumer, last_event_id=0):
+    """Move a consumer's checkpoint, e.g. back to 0 to replay the whole log"""
+    OrderEventCheckpoint.objects.update_or_create(consumer=consumer, defaults={'last_event_id': last_event_id})
@@ -0,0 +1,233 @@
+"""
+Payment gateway adapters.
+
+Checkout creates a PENDING Payment and hands it to the PaymentClient, which
+charges the configured gateway on a bounded thread pool and settles the
+payment once the gateway answers. Request workers therefore never wait on the
+gateway's network round trip, unless PAYMENT_GATEWAY_ASYNC is turned off.
+A charge whose outcome is unknown, e.g. after a timeout, leaves the payment
+PENDING rather than failing an order whose card may have been charged. So does
+a worker that dies before the gateway answers; the reconcile_payments command
+settles such payments later from the gateway's record of their charge.
+
+The gateway class is configured with PAYMENT_GATEWAY (a dotted path) and
+PAYMENT_GATEWAY_OPTIONS. SimulatedGateway stands in for a real provider
+with configurable latency, declines and timeouts.
+"""
+
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils.module_loading import import_string
+
+from techshelf.ids import generate_id
+
+logger = logging.getLogger(__name__)
+
+
+class GatewayError(Exception):
+    """The gateway could not be reached or did not answer in time"""
+
+
+class GatewayTimeout(GatewayError):
+    pass
+
+
+class GatewayBusy(GatewayError):
+    """Too many charges are already in flight in this process"""
+
+
+class ChargeResult:
+    def __init__(self, succeeded, transaction_id=None, error=None):
+        self.succeeded = succeeded
+        self.transaction_id = transaction_id
+        self.error = error
+
+    def __repr__(self):
+        return f"ChargeResult(succeeded={self.succeeded}, transaction_id={self.transaction_id}, error={self.error})"
+
+
+class PaymentGateway:
+    """
+    Interface of a payment provider. charge() is called from several threads at once
+    and must honour connect_timeout and read_timeout (seconds).
+    """
+
+    def __init__(self, connect_timeout, read_timeout):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+
+    def charge(self, payment_id, amount, payment_info):
+        """
+        Charge amount to the card in payment_info, using payment_id as the idempotency key.
+        Returns a ChargeResult, or raises GatewayError when the outcome is unknown.
+        """
+        raise NotImplementedError
+
+    def lookup(self, payment_id):
+        """
+        The outcome of an earlier charge with payment_id: its ChargeResult, or None if the
+        gateway never received it. Raises GatewayError when the gateway cannot be asked.
+        """
+        raise NotImplementedError
+
+
+class SimulatedGateway(PaymentGateway):
+    """
+    Local gateway for development, tests and load testing. Never talks to the network.
+    Charges are remembered by the instance, so lookup() in another process finds none of them.
+    """
+
+    def __init__(self, connect_timeout, read_timeout, connect_latency=0.0, latency=0.0, jitter=0.0,
+                 decline_rate=0.0, seed=None):
+        super().__init__(connect_timeout, read_timeout)
+        self.connect_latency = connect_latency
+        self.latency = latency
+        self.jitter = jitter
+        self.decline_rate = decline_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._charges = {}
+
+    def charge(self, payment_id, amount, payment_info):
+        with self._lock:
+            delay = max(self.latency + self._random.uniform(-self.jitter, self.jitter), 0.0)
+            declined = self._random.random() < self.decline_rate
+
+        if self.connect_latency > self.connect_timeout:
+            time.sleep(self.connect_timeout)
+            raise GatewayTimeout(f"Connecting to the gateway timed out after {self.connect_timeout}s")
+        time.sleep(self.connect_latency)
+
+        # Once connected the charge is made, even if its answer is then lost to the read timeout
+        with self._lock:
+            if payment_id not in self._charges:
+                self._charges[payment_id] = (
+                    ChargeResult(False, error='Card declined') if declined
+                    else ChargeResult(True, transaction_id=generate_id('txn'))
+                )
+            result = self._charges[payment_id]
+
+        if delay > self.read_timeout:
+            time.sleep(self.read_timeout)
+            raise GatewayTimeout(f"The gateway did not answer within {self.read_timeout}s")
+        time.sleep(delay)
+        return result
+
+    def lookup(self, payment_id):
+        with self._lock:
+            return self._charges.get(payment_id)
+
+
+class PaymentClient:
+    """
+    Runs gateway charges on a bounded thread pool. At most max_pending charges may be
+    queued or running; submit() raises GatewayBusy beyond that instead of queueing forever.
+    """
+
+    def __init__(self, gateway, max_workers, max_pending):
+        self.gateway = gateway
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='payment-gateway')
+        self._slots = threading.BoundedSemaphore(max_pending)
+
+    def charge(self, payment_id, amount, payment_info):
+        """
+        Charge synchronously. Returns None when the outcome is unknown: the card may have been
+        charged, so the payment must stay pending until the gateway is asked again.
+        """
+        try:
+            return self.gateway.charge(payment_id, amount, payment_info)
+        except GatewayError as e:
+            logger.warning("Outcome of payment %s is unknown: %s", payment_id, e)
+            return None
+
+    def lookup(self, payment_id):
+        """
+        The outcome of payment_id's charge as the gateway recorded it; a failed result if the
+        gateway never received the charge, or None if it cannot be asked now.
+        """
+        try:
+            result = self.gateway.lookup(payment_id)
+        except GatewayError as e:
+            logger.warning("Could not look up payment %s: %s", payment_id, e)
+            return None
+        # Never received, so the card was not charged
+        return result or ChargeResult(False, error='The payment was not completed')
+
+    def submit(self, payment_id, amount, payment_info, on_result):
+        """Charge on the pool and call on_result(payment_id, result) from the pool thread"""
+        if not self._slots.acquire(blocking=False):
+            raise GatewayBusy("Too many payments are being processed, please retry")
+        try:
+            return self._executor.submit(self._run, payment_id, amount, payment_info, on_result)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def _run(self, payment_id, amount, payment_info, on_result):
+        try:
+            result = self.charge(payment_id, amount, payment_info)
+            if result is not None:
+                on_result(payment_id, result)
+        except Exception:
+            logger.exception("Settling payment %s failed", payment_id)
+        finally:
+            self._slots.release()
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+
+def build_payment_client():
+    gateway_class = import_string(settings.PAYMENT_GATEWAY)
+    gateway = gateway_class(
+        connect_timeout=settings.PAYMENT_GATEWAY_CONNECT_TIMEOUT,
+        read_timeout=settings.PAYMENT_GATEWAY_READ_TIMEOUT,
+        **settings.PAYMENT_GATEWAY_OPTIONS
+    )
+    return PaymentClient(
+        gateway,
+        max_workers=settings.PAYMENT_GATEWAY_MAX_WORKERS,
+        max_pending=settings.PAYMENT_GATEWAY_MAX_PENDING
+    )
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_payment_client():
+    """The process-wide PaymentClient, created on first use"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = build_payment_client()
+    return _client
+
+
+def _reset_after_fork():
+    # Pool threads do not survive a fork, so each worker process builds its own client
+    global _client, _client_lock
+    _client = None
+    _client_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def settle_in_worker(payment_id, result):
+    """on_result callback for pool threads, which manage their own database connections"""
+    from .services import OrderService
+    close_old_connections()
+    try:
+        OrderService.settle_payment(payment_id, result)
+    finally:
+        close_old_connections()
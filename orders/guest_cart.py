@@ -0,0 +1,153 @@
+"""
+Carts for anonymous visitors, kept in a signed cookie instead of the database.
+
+A guest cart is only written to the database when its owner logs in, at which
+point its lines are merged into the user's cart. GuestCartMiddleware writes
+the cookie back whenever a view changed the cart.
+"""
+
+from django.conf import settings
+from django.core import signing
+
+from .models import Cart, CartItem
+
+SALT = 'orders.guest_cart'
+
+
+class GuestCartItems:
+    """The subset of the Cart.items manager used by the views and pricing"""
+
+    def __init__(self, cart):
+        self.cart = cart
+
+    def all(self):
+        # Unsaved CartItems so templates and price_items treat them like stored lines
+        return [CartItem(product_id=product_id, quantity=quantity)
+                for product_id, quantity in self.cart.quantities.items()]
+
+    def exists(self):
+        return bool(self.cart.quantities)
+
+    def count(self):
+        return len(self.cart.quantities)
+
+
+class GuestCart:
+    """Anonymous visitor's cart: product_id -> quantity, stored in a signed cookie"""
+    cart_id = None
+    user = None
+
+    def __init__(self, quantities=None):
+        self.quantities = dict(quantities or {})
+        self.modified = False
+
+    @classmethod
+    def from_request(cls, request):
+        """The guest cart of the request, loaded from its cookie once per request"""
+        cart = getattr(request, '_guest_cart', None)
+        if cart is None:
+            cart = cls(cls.load(request.COOKIES.get(settings.GUEST_CART_COOKIE_NAME)))
+            request._guest_cart = cart
+        return cart
+
+    @staticmethod
+    def load(value):
+        if not value:
+            return {}
+        try:
+            data = signing.loads(value, salt=SALT, max_age=settings.GUEST_CART_COOKIE_AGE)
+        except signing.BadSignature:
+            return {}
+        if not isinstance(data, dict):
+            return {}
+        # Only keep well-formed lines, and never more than the cap
+        quantities = {
+            product_id: quantity for product_id, quantity in data.items()
+            if isinstance(product_id, str) and isinstance(quantity, int) and quantity > 0
+        }
+        return dict(list(quantities.items())[:settings.GUEST_CART_MAX_LINES])
+
+    @property
+    def items(self):
+        return GuestCartItems(self)
+
+    def add_item(self, product, quantity):
+        product_id = product.product_id
+        if product_id not in self.quantities and len(self.quantities) >= settings.GUEST_CART_MAX_LINES:
+            raise ValueError(
+                f"Your cart can hold at most {settings.GUEST_CART_MAX_LINES} different products. "
+                f"Log in to add more."
+            )
+        self.quantities[product_id] = self.quantities.get(product_id, 0) + quantity
+        self.modified = True
+        return CartItem(product_id=product_id, quantity=self.quantities[product_id])
+
+    def remove_item(self, product_id):
+        if self.quantities.pop(product_id, None) is not None:
+            self.modified = True
+
+    def update_item(self, product_id, quantity):
+        if product_id not in self.quantities:
+            return False
+        if quantity > 0:
+            self.quantities[product_id] = quantity
+        else:
+            del self.quantities[product_id]
+        self.modified = True
+        return True
+
+    def clear(self):
+        if self.quantities:
+            self.quantities = {}
+            self.modified = True
+
+    def invalidate_summary(self):
+        # Guest carts are never cached
+        pass
+
+    def save(self, response):
+        """Write the cart back to its cookie, or delete the cookie once it is empty"""
+        if not self.modified:
+            return
+        if self.quantities:
+            response.set_cookie(
+                settings.GUEST_CART_COOKIE_NAME,
+                signing.dumps(self.quantities, salt=SALT, compress=True),
+                max_age=settings.GUEST_CART_COOKIE_AGE,
+                secure=settings.SESSION_COOKIE_SECURE,
+                httponly=True,
+                samesite='Lax'
+            )
+        else:
+            response.delete_cookie(settings.GUEST_CART_COOKIE_NAME, samesite='Lax')
+
+    def __str__(self):
+        return 'Cart - Guest'
+
+
+def merge_guest_cart(sender, request, user, **kwargs):
+    """user_logged_in receiver: persist the visitor's guest cart into their own cart"""
+    if request is None:
+        return
+    guest_cart = GuestCart.from_request(request)
+    if not guest_cart.quantities:
+        return
+
+    from .services import CartService
+    cart, _ = Cart.objects.get_or_create(user=user)
+    CartService.merge_items(cart, guest_cart.quantities)
+    guest_cart.clear()
+
+
+class GuestCartMiddleware:
+    """Save the guest cart cookie of requests whose view changed it"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        guest_cart = getattr(request, '_guest_cart', None)
+        if guest_cart is not None:
+            guest_cart.save(response)
+        return response
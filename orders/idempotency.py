@@ -0,0 +1,147 @@
+import functools
+import hashlib
+import json
+import time
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+from .models import IdempotencyKey
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+
+
+def transient(response):
+    """
+    Mark an error response as not to be stored for the key, e.g. one built from an unexpected
+    exception (a lock timeout, a gateway error), so a retry with the same key runs again
+    """
+    response.idempotent_transient = True
+    return response
+
+
+def request_fingerprint(request):
+    """Hash the parts of a request that must match when a key is reused"""
+    body = json.dumps(request.data, sort_keys=True, default=str)
+    raw = f"{request.method}:{request.path}:{body}"
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def claim_key(user, key, fingerprint):
+    """
+    Reserve (user, key) for the current request, taking over a same-request key whose lease ran out.
+    Returns (record, created); created is False when another request owns the key.
+    """
+    now = timezone.now()
+    # An expired key is free to be reused
+    IdempotencyKey.objects.filter(user=user, key=key, expires_at__lte=now).delete()
+
+    for _ in range(2):
+        try:
+            with transaction.atomic():
+                record = IdempotencyKey.objects.create(
+                    user=user,
+                    key=key,
+                    request_fingerprint=fingerprint,
+                    locked_until=now + settings.IDEMPOTENCY_LOCK_TIMEOUT,
+                    expires_at=now + settings.IDEMPOTENCY_KEY_TTL
+                )
+            return record, True
+        except IntegrityError:
+            record = IdempotencyKey.objects.filter(user=user, key=key).first()
+            if record is not None:
+                return record, record.request_fingerprint == fingerprint and take_over(record)
+            # The owner failed and released the key between our insert and read
+
+    raise IntegrityError(f"Could not claim idempotency key {key}")
+
+
+def take_over(record):
+    """Renew the lease of an abandoned key for the current request. Returns whether it won the key."""
+    if not record.is_abandoned:
+        return False
+    locked_until = timezone.now() + settings.IDEMPOTENCY_LOCK_TIMEOUT
+    # Conditional on the lease read, so of several retries only one takes the key over
+    if not IdempotencyKey.objects.filter(
+        pk=record.pk, response_status__isnull=True, locked_until=record.locked_until
+    ).update(locked_until=locked_until):
+        return False
+    record.locked_until = locked_until
+    return True
+
+
+def wait_for_result(record):
+    """Poll an in-flight key until its owner stores a response, gives the key up or loses its lease"""
+    deadline = time.monotonic() + settings.IDEMPOTENCY_WAIT_TIMEOUT
+    while time.monotonic() < deadline:
+        time.sleep(settings.IDEMPOTENCY_POLL_INTERVAL)
+        record = IdempotencyKey.objects.filter(pk=record.pk).first()
+        if record is None or record.is_complete or record.is_abandoned:
+            return record
+    return record
+
+
+def replay_response(record):
+    return Response(
+        record.response_body,
+        status=record.response_status,
+        headers={'Idempotent-Replayed': 'true'}
+    )
+
+
+def idempotent(view_method):
+    """
+    Make an APIView handler safe to retry with an Idempotency-Key header.
+    The first response per (user, key) is stored and replayed to duplicates;
+    concurrent duplicates wait for the first request to finish. Server errors and
+    responses marked transient() are not stored, so the key can be retried.
+    """
+    @functools.wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if not key:
+            return view_method(self, request, *args, **kwargs)
+
+        if len(key) > MAX_KEY_LENGTH:
+            return Response({'error': f'{IDEMPOTENCY_HEADER} must be at most {MAX_KEY_LENGTH} characters'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        fingerprint = request_fingerprint(request)
+        record, created = claim_key(request.user, key, fingerprint)
+
+        if not created and record.request_fingerprint == fingerprint and not record.is_complete:
+            record = wait_for_result(record)
+            if record is None or record.is_abandoned:
+                # The first request gave the key up or died holding it; this one runs instead
+                record, created = claim_key(request.user, key, fingerprint)
+
+        if not created:
+            if record.request_fingerprint != fingerprint:
+                return Response({'error': f'{IDEMPOTENCY_HEADER} was already used for a different request'},
+                                status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+            if not record.is_complete:
+                return Response({'error': 'A request with this key is still being processed'},
+                                status=status.HTTP_409_CONFLICT)
+            return replay_response(record)
+
+        try:
+            response = view_method(self, request, *args, **kwargs)
+        except Exception:
+            record.delete()
+            raise
+
+        # Server errors and transient failures are not cached so the client can retry with the same key
+        if response.status_code >= 500 or getattr(response, 'idempotent_transient', False):
+            record.delete()
+            return response
+
+        record.response_status = response.status_code
+        record.response_body = response.data
+        record.save(update_fields=['response_status', 'response_body'])
+        return response
+
+    return wrapper
@@ -0,0 +1,50 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from orders.models import Order
+from orders.services import OrderService
+
+
+class Command(BaseCommand):
+    help = 'Move delivered and cancelled orders older than a threshold into the archive tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=180,
+                            help='Archive orders last updated more than this many days ago')
+        parser.add_argument('--batch-size', type=int, default=500, help='Orders moved per transaction')
+        parser.add_argument('--sleep', type=float, default=0.1, help='Seconds to pause between batches')
+        parser.add_argument('--dry-run', action='store_true', help='Only count the orders that would be archived')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        candidates = Order.objects.filter(
+            order_status__in=Order.ARCHIVABLE_STATUSES,
+            updated_at__lt=cutoff
+        )
+
+        if options['dry_run']:
+            self.stdout.write(f"Would archive {candidates.count()} orders")
+            return
+
+        archived = 0
+        started = time.perf_counter()
+        last_pk = 0
+        while True:
+            # Walk the candidates in primary key order so each batch is a short range scan
+            batch = list(
+                candidates.filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[:options['batch_size']]
+            )
+            if not batch:
+                break
+            archived += OrderService.archive_orders(batch)
+            last_pk = batch[-1]
+            self.stdout.write(f"Archived {archived} orders")
+            if options['sleep']:
+                time.sleep(options['sleep'])
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Archived {archived} orders in {time.perf_counter() - started:.2f}s"
+        ))
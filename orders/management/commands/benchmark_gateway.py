@@ -0,0 +1,106 @@
+import statistics
+import threading
+import time
+from collections import Counter
+
+from django.core.management.base import BaseCommand
+
+from orders.gateway import GatewayBusy, PaymentClient, SimulatedGateway
+
+
+class Command(BaseCommand):
+    help = 'Measure checkout throughput against a slow simulated gateway: inline charges versus the gateway pool'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--request-workers', type=int, default=8,
+                            help='Concurrent request workers, e.g. gunicorn workers x threads')
+        parser.add_argument('--requests', type=int, default=400, help='Checkouts to simulate')
+        parser.add_argument('--checkout-ms', type=float, default=15,
+                            help='Time a checkout spends outside the gateway (cart, order, notifications)')
+        parser.add_argument('--latency', type=float, default=0.5, help='Gateway latency in seconds')
+        parser.add_argument('--jitter', type=float, default=0.2, help='Gateway latency jitter in seconds')
+        parser.add_argument('--decline-rate', type=float, default=0.05)
+        parser.add_argument('--read-timeout', type=float, default=2.0)
+        parser.add_argument('--pool-size', type=int, default=16, help='Gateway pool threads')
+        parser.add_argument('--max-pending', type=int, default=500, help='Charges queued or running before shedding')
+
+    def handle(self, *args, **options):
+        self.stdout.write(
+            f"{options['requests']} checkouts, {options['request_workers']} request workers, "
+            f"gateway latency {options['latency']}s ± {options['jitter']}s"
+        )
+        self.stdout.write(
+            f"{'mode':<8} {'checkouts/s':>12} {'p50 ms':>8} {'p99 ms':>8} {'settled/s':>10} "
+            f"{'paid':>6} {'failed':>7} {'shed':>6}"
+        )
+        for mode in ('inline', 'pool'):
+            result = self.run(mode, options)
+            self.stdout.write(
+                f"{mode:<8} {result['checkouts_per_second']:>12,.1f} {result['p50']:>8.0f} {result['p99']:>8.0f} "
+                f"{result['settled_per_second']:>10,.1f} {result['outcomes']['paid']:>6} "
+                f"{result['outcomes']['failed']:>7} {result['outcomes']['shed']:>6}"
+            )
+
+    def run(self, mode, options):
+        gateway = SimulatedGateway(
+            connect_timeout=1.0,
+            read_timeout=options['read_timeout'],
+            latency=options['latency'],
+            jitter=options['jitter'],
+            decline_rate=options['decline_rate'],
+            seed=42
+        )
+        client = PaymentClient(gateway, max_workers=options['pool_size'], max_pending=options['max_pending'])
+        outcomes = Counter()
+        lock = threading.Lock()
+        durations = []
+        futures = []
+        next_request = iter(range(options['requests']))
+
+        def record(payment_id, result):
+            with lock:
+                outcomes['paid' if result.succeeded else 'failed'] += 1
+
+        def request_worker():
+            while True:
+                with lock:
+                    index = next(next_request, None)
+                if index is None:
+                    return
+                started = time.perf_counter()
+                # Stands in for the cart, order and notification queries of a checkout
+                time.sleep(options['checkout_ms'] / 1000)
+                payment_id = f'bench_{index}'
+                if mode == 'inline':
+                    record(payment_id, client.charge(payment_id, 10, {}))
+                else:
+                    try:
+                        future = client.submit(payment_id, 10, {}, record)
+                        with lock:
+                            futures.append(future)
+                    except GatewayBusy:
+                        with lock:
+                            outcomes['shed'] += 1
+                with lock:
+                    durations.append(time.perf_counter() - started)
+
+        workers = [threading.Thread(target=request_worker) for _ in range(options['request_workers'])]
+        started = time.perf_counter()
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        served = time.perf_counter() - started
+        for future in futures:
+            future.result()
+        settled = time.perf_counter() - started
+        client.shutdown()
+
+        durations.sort()
+        return {
+            'checkouts_per_second': options['requests'] / served,
+            'settled_per_second': (outcomes['paid'] + outcomes['failed']) / settled,
+            'p50': statistics.median(durations) * 1000,
+            'p99': durations[int(len(durations) * 0.99) - 1] * 1000,
+            'outcomes': outcomes,
+        }
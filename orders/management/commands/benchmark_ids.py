@@ -0,0 +1,64 @@
+import os
+import sqlite3
+import tempfile
+import time
+import uuid
+
+from django.core.management.base import BaseCommand
+
+from techshelf.ids import generate_id
+
+
+def legacy_id(prefix):
+    return f"{prefix}_{uuid.uuid4().hex[:8]}"
+
+
+class Command(BaseCommand):
+    help = 'Compare insert throughput and unique index size for random and time-ordered ids'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=200000, help='Rows to insert per run')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rows per transaction')
+
+    def handle(self, *args, **options):
+        rows = options['rows']
+        batch_size = options['batch_size']
+
+        self.stdout.write(f"Inserting {rows} rows in batches of {batch_size}")
+        self.stdout.write(
+            f"{'generator':<12} {'rows/s':>12} {'index KiB':>12} {'table KiB':>12} {'collisions':>12}"
+        )
+
+        for name, generator in (('uuid4[:8]', legacy_id), ('ulid', generate_id)):
+            throughput, index_size, table_size, collisions = self.run(generator, rows, batch_size)
+            self.stdout.write(
+                f"{name:<12} {throughput:>12,.0f} {index_size / 1024:>12,.0f} "
+                f"{table_size / 1024:>12,.0f} {collisions:>12}"
+            )
+
+    def run(self, generator, rows, batch_size):
+        # A throwaway SQLite file keeps the comparison independent of the project database
+        fd, path = tempfile.mkstemp(suffix='.sqlite3')
+        os.close(fd)
+        try:
+            connection = sqlite3.connect(path)
+            connection.execute(
+                'CREATE TABLE bench_order (id INTEGER PRIMARY KEY, order_id VARCHAR(50) NOT NULL UNIQUE)'
+            )
+
+            started = time.perf_counter()
+            for offset in range(0, rows, batch_size):
+                batch = [(generator('order'),) for _ in range(min(batch_size, rows - offset))]
+                with connection:
+                    # Duplicate ids are skipped and counted instead of aborting the run
+                    connection.executemany('INSERT OR IGNORE INTO bench_order (order_id) VALUES (?)', batch)
+            elapsed = time.perf_counter() - started
+
+            inserted = connection.execute('SELECT COUNT(*) FROM bench_order').fetchone()[0]
+            sizes = dict(connection.execute('SELECT name, SUM(pgsize) FROM dbstat GROUP BY name'))
+            connection.close()
+        finally:
+            os.remove(path)
+
+        index_size = sum(size for name, size in sizes.items() if name.startswith('sqlite_autoindex_bench_order'))
+        return rows / elapsed, index_size, sizes.get('bench_order', 0), rows - inserted
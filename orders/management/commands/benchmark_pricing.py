@@ -0,0 +1,138 @@
+import random
+import time
+from collections import namedtuple
+from decimal import Decimal
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from orders.models import Cart, CartItem
+from orders.pricing import price_cart, price_items
+from products.models import Product
+from stores.models import Store
+
+Line = namedtuple('Line', ['product_id', 'quantity'])
+
+
+class Rollback(Exception):
+    pass
+
+
+def decimal_total(items, products):
+    """The per-line Decimal arithmetic the views used before orders.pricing"""
+    subtotal = Decimal('0.00')
+    for item in items:
+        product = products.get(item.product_id)
+        if product is None:
+            continue
+        subtotal += product.price * item.quantity
+    shipping = settings.ORDER_SHIPPING_COST if subtotal > 0 else Decimal('0.00')
+    tax = (subtotal * settings.ORDER_TAX_RATE / 100).quantize(Decimal('0.01'))
+    return subtotal + shipping + tax
+
+
+def per_item_query_total(cart):
+    """The per-item Product.objects.get loop cart_view and checkout_view used before orders.pricing"""
+    products = {}
+    for item in cart.items.all():
+        try:
+            products[item.product_id] = Product.objects.get(product_id=item.product_id)
+        except Product.DoesNotExist:
+            continue
+    return decimal_total(cart.items.all(), products)
+
+
+class Command(BaseCommand):
+    help = 'Micro-benchmark of cart pricing: integer-cent engine versus Decimal arithmetic'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='1,10,50,200', help='Comma separated cart sizes (lines)')
+        parser.add_argument('--repeat', type=int, default=2000, help='Carts priced per size')
+        parser.add_argument('--with-db', action='store_true',
+                            help='Also price carts stored in the database (rows are rolled back)')
+
+    def handle(self, *args, **options):
+        sizes = [int(size) for size in options['sizes'].split(',')]
+        repeat = options['repeat']
+        rng = random.Random(42)
+
+        self.stdout.write('In-memory arithmetic (no queries)')
+        self.stdout.write(f"{'lines':>6} {'decimal us':>12} {'engine us':>12} {'speedup':>9}")
+        for size in sizes:
+            # Unsaved products keep the benchmark free of database round trips
+            products = {
+                f'prod_{i}': Product(product_id=f'prod_{i}', price=Decimal(rng.randint(100, 99999)) / 100)
+                for i in range(size)
+            }
+            items = [Line(product_id, rng.randint(1, 5)) for product_id in products]
+
+            started = time.perf_counter()
+            for _ in range(repeat):
+                expected = decimal_total(items, products)
+            decimal_us = (time.perf_counter() - started) / repeat * 1e6
+
+            started = time.perf_counter()
+            for _ in range(repeat):
+                pricing = price_items(items, products=products)
+            engine_us = (time.perf_counter() - started) / repeat * 1e6
+
+            if abs(pricing.total - expected) > Decimal('0.01'):
+                self.stderr.write(f'Totals differ for {size} lines: {pricing.total} != {expected}')
+
+            self.stdout.write(f"{size:>6} {decimal_us:>12.1f} {engine_us:>12.1f} {decimal_us / engine_us:>8.2f}x")
+
+        if options['with_db']:
+            self.stdout.write('')
+            self.stdout.write('End to end against the database')
+            try:
+                with transaction.atomic():
+                    self.benchmark_db(sizes, max(repeat // 20, 1), rng)
+                    raise Rollback
+            except Rollback:
+                pass
+
+    def benchmark_db(self, sizes, repeat, rng):
+        user = get_user_model().objects.create_user(
+            username='pricing_benchmark', email='pricing_benchmark@example.com', password=None
+        )
+        store = Store.objects.create(store_name='Pricing Benchmark', user=user)
+        cart = Cart.objects.create(user=user)
+
+        self.stdout.write(
+            f"{'lines':>6} {'loop ms':>9} {'queries':>8} {'engine ms':>10} {'queries':>8} {'speedup':>9}"
+        )
+        for size in sizes:
+            cart.items.all().delete()
+            products = Product.objects.bulk_create([
+                Product(product_id=f'bench_{size}_{i}', name=f'Benchmark {i}', category='benchmark',
+                        price=Decimal(rng.randint(100, 99999)) / 100, stock=100, store=store)
+                for i in range(size)
+            ])
+            CartItem.objects.bulk_create([
+                CartItem(cart=cart, product_id=product.product_id, quantity=rng.randint(1, 5))
+                for product in products
+            ])
+
+            # Count queries for a single pass, then time without query logging
+            with CaptureQueriesContext(connection) as loop_queries:
+                per_item_query_total(cart)
+            with CaptureQueriesContext(connection) as engine_queries:
+                price_cart(cart)
+
+            started = time.perf_counter()
+            for _ in range(repeat):
+                per_item_query_total(cart)
+            loop_ms = (time.perf_counter() - started) / repeat * 1e3
+
+            started = time.perf_counter()
+            for _ in range(repeat):
+                price_cart(cart)
+            engine_ms = (time.perf_counter() - started) / repeat * 1e3
+
+            self.stdout.write(
+                f"{size:>6} {loop_ms:>9.2f} {len(loop_queries):>8} "
+                f"{engine_ms:>10.2f} {len(engine_queries):>8} {loop_ms / engine_ms:>8.1f}x"
+            )
@@ -0,0 +1,165 @@
+import threading
+import time
+from collections import Counter
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from orders.models import Cart, CartItem
+from products.models import Product, ProductLike
+from stores.models import Rating, Store
+from techshelf.db import upsert
+from techshelf.ids import generate_ulid
+
+
+def legacy_add_item(cart, product, quantity):
+    """Cart.add_item before upserts: get_or_create then a read-modify-write save"""
+    cart_item, created = CartItem.objects.get_or_create(
+        cart=cart,
+        product_id=product.product_id,
+        defaults={'quantity': quantity}
+    )
+    if not created:
+        cart_item.quantity += quantity
+        cart_item.save()
+
+
+def upsert_add_item(cart, product, quantity):
+    cart.add_item(product, quantity)
+
+
+def legacy_like(user, product):
+    ProductLike.objects.get_or_create(user=user, product=product)
+
+
+def upsert_like(user, product):
+    upsert(ProductLike(like_id=f"like_{product.product_id}_{user.id}", user=user, product=product),
+           unique_fields=['user', 'product'])
+
+
+def legacy_rate(user, store, score):
+    """StoreRatingCreateView before upserts: filter().first() then save or insert"""
+    existing = Rating.objects.filter(user=user, store=store).first()
+    if existing:
+        existing.score = score
+        existing.save()
+    else:
+        Rating.objects.create(rating_id=f"rating_{user.id}_{store.store_id}", user=user, store=store, score=score)
+
+
+def upsert_rate(user, store, score):
+    upsert(Rating(rating_id=f"rating_{user.id}_{store.store_id}", user=user, store=store, score=score),
+           unique_fields=['user', 'store'], update_fields=['score'])
+
+
+class Command(BaseCommand):
+    help = 'Benchmark cart, like and rating writes under concurrency: read-then-write versus upserts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8, help='Concurrent writers')
+        parser.add_argument('--ops', type=int, default=200, help='Writes per thread')
+        parser.add_argument('--users', type=int, default=4, help='Users sharing the like and rating rows')
+
+    def handle(self, *args, **options):
+        threads = options['threads']
+        ops = options['ops']
+        # Rows are written from several connections, so they are committed and removed afterwards
+        fixtures = self.create_fixtures(options['users'])
+        try:
+            self.stdout.write(f"{threads} threads x {ops} writes against {connection.vendor}")
+            self.stdout.write(
+                f"{'write':<8} {'path':<8} {'ops/s':>10} {'stmts/op':>9} {'errors':>7} {'lost':>6}"
+            )
+            for name, path, write in (
+                ('cart', 'legacy', legacy_add_item), ('cart', 'upsert', upsert_add_item),
+                ('like', 'legacy', legacy_like), ('like', 'upsert', upsert_like),
+                ('rating', 'legacy', legacy_rate), ('rating', 'upsert', upsert_rate),
+            ):
+                self.reset(fixtures)
+                result = self.run(name, write, fixtures, threads, ops)
+                self.stdout.write(
+                    f"{name:<8} {path:<8} {result['ops_per_second']:>10,.0f} "
+                    f"{result['statements_per_op']:>9.2f} {result['errors']:>7} {result['lost']:>6}"
+                )
+                for error, count in result['error_types'].items():
+                    self.stdout.write(f"{'':<17} {count} x {error}")
+        finally:
+            fixtures['seller'].delete()
+            get_user_model().objects.filter(pk__in=[user.pk for user in fixtures['users']]).delete()
+
+    def create_fixtures(self, user_count):
+        tag = generate_ulid()
+        User = get_user_model()
+        seller = User.objects.create_user(username=f'bench_seller_{tag}', email=f'bench_seller_{tag}@example.com',
+                                          password=None, role='SELLER')
+        store = Store.objects.create(store_name=f'Benchmark {tag}', user=seller)
+        product = Product.objects.create(product_id=f'bench_{tag}', name='Benchmark', category='benchmark',
+                                         price=Decimal('10.00'), stock=100, store=store)
+        users = [
+            User.objects.create_user(username=f'bench_{i}_{tag}', email=f'bench_{i}_{tag}@example.com', password=None)
+            for i in range(user_count)
+        ]
+        cart = Cart.objects.create(user=users[0])
+        return {'seller': seller, 'store': store, 'product': product, 'users': users, 'cart': cart}
+
+    def reset(self, fixtures):
+        fixtures['cart'].items.all().delete()
+        ProductLike.objects.filter(product=fixtures['product']).delete()
+        Rating.objects.filter(store=fixtures['store']).delete()
+
+    def run(self, name, write, fixtures, threads, ops):
+        statements = Counter()
+        errors = Counter()
+        barrier = threading.Barrier(threads)
+
+        def count_statements(execute, sql, params, many, context):
+            statements[threading.get_ident()] += 1
+            return execute(sql, params, many, context)
+
+        def worker(index):
+            users = fixtures['users']
+            try:
+                with connection.execute_wrapper(count_statements):
+                    barrier.wait()
+                    for op in range(ops):
+                        user = users[(index + op) % len(users)]
+                        try:
+                            if name == 'cart':
+                                write(fixtures['cart'], fixtures['product'], 1)
+                            elif name == 'like':
+                                # Alternate likes and unlikes so inserts keep racing
+                                if op % 2:
+                                    ProductLike.objects.filter(user=user, product=fixtures['product']).delete()
+                                else:
+                                    write(user, fixtures['product'])
+                            else:
+                                write(user, fixtures['store'], op % 5 + 1)
+                        except Exception as e:
+                            errors[f'{type(e).__name__}: {e}'] += 1
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=worker, args=(index,)) for index in range(threads)]
+        started = time.perf_counter()
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        total_ops = threads * ops
+        lost = 0
+        if name == 'cart':
+            # Every successful write adds one unit; anything missing was overwritten by a racing save
+            stored = CartItem.objects.filter(cart=fixtures['cart']).values_list('quantity', flat=True).first() or 0
+            lost = total_ops - sum(errors.values()) - stored
+
+        return {
+            'ops_per_second': total_ops / elapsed,
+            'statements_per_op': sum(statements.values()) / total_ops,
+            'errors': sum(errors.values()),
+            'error_types': errors,
+            'lost': lost,
+        }
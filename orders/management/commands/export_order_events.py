@@ -0,0 +1,36 @@
+import json
+
+from django.core.management.base import BaseCommand
+from django.core.serializers.json import DjangoJSONEncoder
+
+from orders import events
+
+
+class Command(BaseCommand):
+    help = "Write the order events a consumer has not seen yet as JSON lines and advance its checkpoint"
+
+    def add_arguments(self, parser):
+        parser.add_argument('consumer', help='Name of the downstream job, e.g. daily-sales-report')
+        parser.add_argument('--batch-size', type=int, default=500, help='Events read per transaction')
+        parser.add_argument('--replay', action='store_true', help='Start again from the first event')
+
+    def handle(self, *args, **options):
+        consumer = options['consumer']
+        if options['replay']:
+            events.reset(consumer)
+
+        def write(batch):
+            for event in batch:
+                self.stdout.write(json.dumps({
+                    'id': event.pk,
+                    'order_id': event.order_id,
+                    'user_id': event.user_id,
+                    'event_type': event.event_type,
+                    'order_status': event.order_status,
+                    'payment_status': event.payment_status,
+                    'data': event.data,
+                    'created_at': event.created_at,
+                }, cls=DjangoJSONEncoder))
+
+        processed = events.consume(consumer, write, batch_size=options['batch_size'])
+        self.stderr.write(self.style.SUCCESS(f"Exported {processed} events for {consumer}"))
@@ -0,0 +1,94 @@
+import time
+from collections import Counter
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+
+from notifications.models import Notification, QueuedEmail, StreamTicket
+from orders.models import ArchivedOrder, Cart, CartItem, IdempotencyKey, Order, ShippingInfo
+
+
+class Command(BaseCommand):
+    help = ('Delete stale carts, orphaned shipping info, old read notifications, old sent emails '
+            'and expired idempotency keys and stream tickets')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--cart-days', type=int, default=30,
+                            help='Delete guest carts and empty carts not updated for this many days')
+        parser.add_argument('--notification-days', type=int, default=30,
+                            help='Delete read notifications and sent emails older than this many days')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Rows deleted per transaction')
+        parser.add_argument('--sleep', type=float, default=0.1, help='Seconds to pause between chunks')
+        parser.add_argument('--dry-run', action='store_true', help='Only count the rows that would be deleted')
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        cart_cutoff = now - timedelta(days=options['cart_days'])
+
+        targets = [
+            # Carts of anonymous visitors from before guest carts moved to cookies, and abandoned empty carts
+            ('stale carts', Cart.objects.filter(
+                Q(user__isnull=True) | ~Exists(CartItem.objects.filter(cart=OuterRef('pk'))),
+                updated_at__lt=cart_cutoff
+            )),
+            ('orphaned shipping info', ShippingInfo.objects.filter(
+                ~Exists(Order.objects.filter(shipping_info=OuterRef('pk'))),
+                ~Exists(ArchivedOrder.objects.filter(shipping_info=OuterRef('pk')))
+            )),
+            ('read notifications', Notification.objects.filter(
+                is_read=True,
+                created_at__lt=now - timedelta(days=options['notification_days'])
+            )),
+            ('sent emails', QueuedEmail.objects.filter(
+                status=QueuedEmail.SENT,
+                sent_at__lt=now - timedelta(days=options['notification_days'])
+            )),
+            ('expired idempotency keys', IdempotencyKey.objects.filter(expires_at__lt=now)),
+            ('expired stream tickets', StreamTicket.objects.filter(expires_at__lt=now)),
+        ]
+
+        total = Counter()
+        started = time.perf_counter()
+        for label, queryset in targets:
+            target_started = time.perf_counter()
+            if options['dry_run']:
+                removed = Counter({queryset.model._meta.label: queryset.count()})
+            else:
+                removed = self.purge(queryset, options['chunk_size'], options['sleep'])
+            elapsed = time.perf_counter() - target_started
+
+            details = ', '.join(f"{count} {model}" for model, count in sorted(removed.items()) if count)
+            self.stdout.write(f"{label}: {sum(removed.values())} rows in {elapsed:.2f}s"
+                              + (f" ({details})" if details else ''))
+            total.update(removed)
+
+        verb = 'Would remove' if options['dry_run'] else 'Removed'
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {sum(total.values())} rows in {time.perf_counter() - started:.2f}s"
+        ))
+
+    def purge(self, queryset, chunk_size, pause):
+        """
+        Delete queryset in primary key ranges of at most chunk_size matching rows,
+        one short transaction per range. Returns rows removed per model, cascades included.
+        """
+        removed = Counter()
+        lower = None
+        while True:
+            remaining = queryset if lower is None else queryset.filter(pk__gt=lower)
+            # The chunk_size-th matching key closes the range; without one this is the last range
+            boundary = list(remaining.order_by('pk').values_list('pk', flat=True)[chunk_size - 1:chunk_size])
+            chunk = remaining.filter(pk__lte=boundary[0]) if boundary else remaining
+
+            with transaction.atomic():
+                _, per_model = chunk.delete()
+            removed.update(per_model)
+
+            if not boundary:
+                return removed
+            lower = boundary[0]
+            if pause:
+                time.sleep(pause)
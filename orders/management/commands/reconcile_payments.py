@@ -0,0 +1,41 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from orders.gateway import get_payment_client
+from orders.models import Payment
+from orders.services import OrderService
+
+
+class Command(BaseCommand):
+    help = ('Settle payments left pending by a lost gateway answer or a dead worker from the '
+            "gateway's record of their charge")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than', type=int, default=None,
+                            help='Seconds a payment must have been pending (default PAYMENT_RECONCILE_AFTER_SECONDS)')
+
+    def handle(self, *args, **options):
+        older_than = options['older_than']
+        if older_than is None:
+            older_than = settings.PAYMENT_RECONCILE_AFTER_SECONDS
+        cutoff = timezone.now() - timedelta(seconds=older_than)
+        pending = Payment.objects.filter(payment_status='PENDING', created_at__lt=cutoff).order_by('created_at')
+
+        client = get_payment_client()
+        settled = unknown = 0
+        started = time.perf_counter()
+        for payment_id in pending.values_list('payment_id', flat=True).iterator():
+            result = client.lookup(payment_id)
+            if result is None:
+                # Left pending for the next run
+                unknown += 1
+            elif OrderService.settle_payment(payment_id, result):
+                settled += 1
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Settled {settled} pending payments, {unknown} still unknown ({time.perf_counter() - started:.2f}s)"
+        ))
@@ -0,0 +1,42 @@
+# Generated by Django 5.1.7 on 2026-10-19 02:34
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0003_order_discount_amount'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PromotionCampaign',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('campaign_id', models.CharField(max_length=50, unique=True)),
+                ('name', models.CharField(max_length=255)),
+                ('code_prefix', models.CharField(blank=True, max_length=20)),
+                ('discount_percentage', models.DecimalField(decimal_places=2, max_digits=5)),
+                ('expiry_date', models.DateField()),
+                ('uses_per_code', models.PositiveIntegerField(blank=True, default=1, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='promotion',
+            name='max_uses',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='promotion',
+            name='remaining_uses',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='promotion',
+            name='campaign',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='codes', to='orders.promotioncampaign'),
+        ),
+    ]
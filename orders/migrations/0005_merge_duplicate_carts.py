@@ -0,0 +1,52 @@
+from django.db import migrations
+from django.db.models import Case, Count, IntegerField, Min, OuterRef, Subquery, Sum, Value, When
+
+
+def merge_duplicate_carts(apps, schema_editor):
+    """Keep the oldest cart of each user and fold the others into it"""
+    Cart = apps.get_model('orders', 'Cart')
+    CartItem = apps.get_model('orders', 'CartItem')
+
+    duplicated = (
+        Cart.objects.filter(user__isnull=False)
+        .values('user')
+        .annotate(carts=Count('id'), keep=Min('id'))
+        .filter(carts__gt=1)
+    )
+    keep_by_user = {row['user']: row['keep'] for row in duplicated}
+    if not keep_by_user:
+        return
+
+    moves = {
+        cart_id: keep_by_user[user_id]
+        for cart_id, user_id in Cart.objects.filter(user__in=keep_by_user).values_list('id', 'user')
+        if cart_id != keep_by_user[user_id]
+    }
+    keep_ids = list(keep_by_user.values())
+
+    # Re-point every item of a duplicate cart at its user's kept cart
+    CartItem.objects.filter(cart_id__in=moves).update(cart_id=Case(
+        *[When(cart_id=cart_id, then=Value(target)) for cart_id, target in moves.items()],
+        output_field=IntegerField()
+    ))
+
+    # Fold lines for the same product into the oldest one
+    same_line = CartItem.objects.filter(cart_id=OuterRef('cart_id'), product_id=OuterRef('product_id'))
+    line_total = same_line.values('cart_id', 'product_id').annotate(total=Sum('quantity')).values('total')
+    first_id = same_line.values('cart_id', 'product_id').annotate(first=Min('id')).values('first')
+    items = CartItem.objects.filter(cart_id__in=keep_ids)
+    items.update(quantity=Subquery(line_total))
+    items.filter(id__gt=Subquery(first_id)).delete()
+
+    Cart.objects.filter(pk__in=moves).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0004_promotion_campaigns'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_carts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,35 @@
+from django.db import migrations
+from django.db.models import Count, Min, OuterRef, Subquery, Sum
+
+
+def collapse_duplicate_lines(apps, schema_editor):
+    """Fold cart items that share a product into the oldest line of each cart"""
+    CartItem = apps.get_model('orders', 'CartItem')
+
+    cart_ids = list(
+        CartItem.objects.values('cart_id', 'product_id')
+        .annotate(lines=Count('id'))
+        .filter(lines__gt=1)
+        .values_list('cart_id', flat=True)
+        .distinct()
+    )
+    if not cart_ids:
+        return
+
+    same_line = CartItem.objects.filter(cart_id=OuterRef('cart_id'), product_id=OuterRef('product_id'))
+    line_total = same_line.values('cart_id', 'product_id').annotate(total=Sum('quantity')).values('total')
+    first_id = same_line.values('cart_id', 'product_id').annotate(first=Min('id')).values('first')
+    items = CartItem.objects.filter(cart_id__in=cart_ids)
+    items.update(quantity=Subquery(line_total))
+    items.filter(id__gt=Subquery(first_id)).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0006_cart_user_unique'),
+    ]
+
+    operations = [
+        migrations.RunPython(collapse_duplicate_lines, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.1.7 on 2026-10-19 02:44
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0007_collapse_duplicate_cart_lines'),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='cartitem',
+            unique_together={('cart', 'product_id')},
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.1.7 on 2026-10-19 03:39
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0011_order_events'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='idempotencykey',
+            name='locked_until',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
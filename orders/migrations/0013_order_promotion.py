@@ -0,0 +1,19 @@
+# Generated by Django 5.1.7 on 2026-10-19 03:41
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0012_idempotency_key_lease'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='promotion',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='orders', to='orders.promotion'),
+        ),
+    ]
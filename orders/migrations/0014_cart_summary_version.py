@@ -0,0 +1,18 @@
+# Generated by Django 5.1.7 on 2026-10-19 03:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0013_order_promotion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cart',
+            name='summary_version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
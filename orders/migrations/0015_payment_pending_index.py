@@ -0,0 +1,17 @@
+# Generated by Django 5.1.7 on 2026-10-19 04:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0014_cart_summary_version'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(condition=models.Q(('payment_status', 'PENDING')), fields=['created_at'], name='payment_pending_idx'),
+        ),
+    ]
@@ -1,38 +1,69 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F
 from django.conf import settings
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
 from products.models import Product
-import uuid
+import secrets
+from techshelf.db import upsert
+from techshelf.ids import generate_id
+from techshelf.versioning import VersionedModel
+from notifications.broker import publish_on_commit
 
 class Cart(models.Model):
     cart_id = models.CharField(max_length=50, unique=True)
-    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, null=True, blank=True)
+    # One cart per user; guest carts have no user
+    user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, null=True, blank=True)
+    # Bumped by every change to the cart's items. It is part of the summary cache key, so a
+    # change invalidates the cached summary in every worker process, not only the one that wrote.
+    summary_version = models.PositiveIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
     def save(self, *args, **kwargs):
         if not self.cart_id:
-            # Generate a unique ID in production
-            self.cart_id = f"cart_{uuid.uuid4().hex[:8]}"
+            self.cart_id = generate_id('cart')
         super().save(*args, **kwargs)
     
+    @property
+    def summary_cache_key(self):
+        return f"cart_summary:{self.cart_id}:{self.summary_version}"
+    
+    def invalidate_summary(self):
+        # Call after any change to the cart's items. Entries for older versions are left to expire.
+        Cart.objects.filter(pk=self.pk).update(summary_version=models.F('summary_version') + 1, updated_at=timezone.now())
+        self.summary_version += 1
+    
     def add_item(self, product, quantity):
-        cart_item, created = CartItem.objects.get_or_create(
-            cart=self,
-            product_id=product.product_id,
-            defaults={'quantity': quantity}
+        # Insert the line or add to its quantity in a single statement
+        cart_item = upsert(
+            CartItem(cart=self, product_id=product.product_id, quantity=quantity),
+            unique_fields=['cart', 'product_id'],
+            increment_fields=['quantity']
         )
-        if not created:
-            cart_item.quantity += quantity
-            cart_item.save()
+        self.invalidate_summary()
         return cart_item
     
     def remove_item(self, product_id):
         CartItem.objects.filter(cart=self, product_id=product_id).delete()
+        self.invalidate_summary()
     
-    def checkout(self):
+    def update_item(self, product_id, quantity):
+        """Set a line's quantity, removing it at zero. Returns False if the product is not in the cart"""
+        lines = CartItem.objects.filter(cart=self, product_id=product_id)
+        if quantity > 0:
+            found = lines.update(quantity=quantity)
+        else:
+            found, _ = lines.delete()
+        if found:
+            self.invalidate_summary()
+        return bool(found)
+    
+    def checkout(self, shipping_info=None, promotion=None):
         # Create an order from the cart
         from orders.services import OrderService
-        return OrderService.create_order_from_cart(self)
+        return OrderService.create_order_from_cart(self, shipping_info=shipping_info, promotion=promotion)
     
     def __str__(self):
         return f"Cart {self.cart_id} - {'Authenticated' if self.user else 'Guest'}"
@@ -42,6 +73,9 @@ class CartItem(models.Model):
     product_id = models.CharField(max_length=50)
     quantity = models.PositiveIntegerField(default=1)
     
+    class Meta:
+        unique_together = ('cart', 'product_id')
+    
     @property
     def product(self):
         try:
@@ -67,7 +101,7 @@ class ShippingInfo(models.Model):
     def __str__(self):
         return f"{self.shipping_address}, {self.city}, {self.country}"
 
-class Order(models.Model):
+class Order(VersionedModel):
     PAYMENT_STATUS = (
         ('PENDING', 'Pending'),
         ('PAID', 'Paid'),
@@ -83,36 +117,50 @@ class Order(models.Model):
         ('CANCELLED', 'Cancelled'),
     )
     
+    # Statuses a seller can move an order to from its current status.
+    # Cancellation is not listed because it goes through the refund flow.
+    STATUS_TRANSITIONS = {
+        'CREATED': ('PROCESSING', 'SHIPPED'),
+        'PROCESSING': ('SHIPPED', 'DELIVERED'),
+        'SHIPPED': ('DELIVERED',),
+        'DELIVERED': (),
+        'CANCELLED': (),
+    }
+    
+    # Orders in these statuses never change again and can be moved to ArchivedOrder
+    ARCHIVABLE_STATUSES = ('DELIVERED', 'CANCELLED')
+    
     order_id = models.CharField(max_length=50, unique=True)
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='orders')
     total_amount = models.DecimalField(max_digits=10, decimal_places=2)
     tax_rate = models.DecimalField(max_digits=5, decimal_places=2, default=0.0)
     shipping_cost = models.DecimalField(max_digits=8, decimal_places=2, default=0.0)
+    discount_amount = models.DecimalField(max_digits=10, decimal_places=2, default=0.0)
     payment_status = models.CharField(max_length=20, choices=PAYMENT_STATUS, default='PENDING')
     order_status = models.CharField(max_length=20, choices=ORDER_STATUS, default='CREATED')
     shipping_info = models.ForeignKey(ShippingInfo, on_delete=models.SET_NULL, null=True)
+    # The discount code redeemed for this order, whose use is given back if the order is cancelled
+    promotion = models.ForeignKey('Promotion', on_delete=models.SET_NULL, null=True, blank=True, related_name='orders')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
     def save(self, *args, **kwargs):
         if not self.order_id:
-            # Generate a unique ID in production
-            self.order_id = f"order_{uuid.uuid4().hex[:8]}"
+            self.order_id = generate_id('order')
         super().save(*args, **kwargs)
     
+    @classmethod
+    def source_statuses_for(cls, new_status):
+        """Return the statuses an order may be in to move to new_status"""
+        return [current for current, targets in cls.STATUS_TRANSITIONS.items() if new_status in targets]
+    
     def process_payment(self, payment_info):
-        # In production, integrate with Stripe or another payment processor
-        payment = Payment.objects.create(
-            order=self,
-            amount=self.total_amount,
-            payment_status='PENDING'
-        )
-        return payment.process_payment(payment_info)
+        # The pending payment was created with the order
+        return self.payment.process_payment(payment_info)
     
     def calculate_total(self):
-        subtotal = sum(item.price * item.quantity for item in self.items.all())
-        tax = subtotal * (self.tax_rate / 100)
-        return subtotal + tax + self.shipping_cost
+        from orders.pricing import price_order
+        return price_order(self).total
     
     def __str__(self):
         return f"Order {self.order_id} by {self.user.username}"
@@ -126,6 +174,39 @@ class OrderItem(models.Model):
     def __str__(self):
         return f"{self.quantity} of {self.product_id} in order {self.order.order_id}"
 
+class ArchivedOrder(models.Model):
+    """
+    A delivered or cancelled order moved out of the hot Order table by the
+    archive_orders command. Fields mirror Order, plus a snapshot of its payment.
+    """
+    order_id = models.CharField(max_length=50, unique=True)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='archived_orders')
+    total_amount = models.DecimalField(max_digits=10, decimal_places=2)
+    tax_rate = models.DecimalField(max_digits=5, decimal_places=2, default=0.0)
+    shipping_cost = models.DecimalField(max_digits=8, decimal_places=2, default=0.0)
+    discount_amount = models.DecimalField(max_digits=10, decimal_places=2, default=0.0)
+    payment_status = models.CharField(max_length=20, choices=Order.PAYMENT_STATUS)
+    order_status = models.CharField(max_length=20, choices=Order.ORDER_STATUS)
+    version = models.PositiveIntegerField(default=1)
+    shipping_info = models.ForeignKey(ShippingInfo, on_delete=models.SET_NULL, null=True)
+    payment_id = models.CharField(max_length=50, null=True, blank=True)
+    transaction_id = models.CharField(max_length=100, null=True, blank=True)
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+    
+    def __str__(self):
+        return f"Archived order {self.order_id} by {self.user.username}"
+
+class ArchivedOrderItem(models.Model):
+    order = models.ForeignKey(ArchivedOrder, on_delete=models.CASCADE, related_name='items')
+    product_id = models.CharField(max_length=50)
+    quantity = models.PositiveIntegerField()
+    price = models.DecimalField(max_digits=10, decimal_places=2)
+    
+    def __str__(self):
+        return f"{self.quantity} of {self.product_id} in archived order {self.order.order_id}"
+
 class Payment(models.Model):
     PAYMENT_STATUS = (
         ('PENDING', 'Pending'),
@@ -142,59 +223,264 @@ class Payment(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    class Meta:
+        indexes = [
+            # reconcile_payments looks for payments left pending
+            models.Index(fields=['created_at'], name='payment_pending_idx',
+                         condition=models.Q(payment_status='PENDING')),
+        ]
+    
     def save(self, *args, **kwargs):
         if not self.payment_id:
-            # Generate a unique ID in production
-            self.payment_id = f"payment_{uuid.uuid4().hex[:8]}"
+            self.payment_id = generate_id('payment')
         super().save(*args, **kwargs)
     
     def process_payment(self, payment_info):
-        # In production, integrate with Stripe or another payment processor
-        # Simulating payment success
-        self.payment_status = 'COMPLETED'
-        self.transaction_id = f"txn_{uuid.uuid4().hex[:12]}"
-        self.save()
+        """
+        Charge the configured payment gateway. With PAYMENT_GATEWAY_ASYNC the charge runs on
+        the gateway pool once the current transaction commits and the payment stays PENDING
+        until the gateway answers; otherwise this waits for the gateway.
+        Returns the payment status as far as this process knows it.
+        """
+        from orders.gateway import ChargeResult, GatewayBusy, get_payment_client, settle_in_worker
+        from orders.services import OrderService
         
-        # Update order status
-        self.order.payment_status = 'PAID'
-        self.order.order_status = 'PROCESSING'
-        self.order.save()
-        return True
-    
-    def refund_payment(self):
-        # In production, integrate with Stripe or another payment processor for refunds
-        self.payment_status = 'REFUNDED'
-        self.save()
+        client = get_payment_client()
+        if settings.PAYMENT_GATEWAY_ASYNC:
+            def submit():
+                try:
+                    client.submit(self.payment_id, self.amount, payment_info, settle_in_worker)
+                except GatewayBusy as e:
+                    # Shed the charge rather than leave a payment nobody will settle
+                    OrderService.settle_payment(self.payment_id, ChargeResult(False, error=str(e)))
+            
+            # The pool thread must be able to read the committed payment
+            transaction.on_commit(submit)
+        else:
+            result = client.charge(self.payment_id, self.amount, payment_info)
+            if result is not None:
+                OrderService.settle_payment(self.payment_id, result)
         
-        # Update order status
-        self.order.payment_status = 'REFUNDED'
-        self.order.order_status = 'CANCELLED'
-        self.order.save()
-        return True
+        self.refresh_from_db(fields=['payment_status', 'transaction_id', 'updated_at'])
+        self.order.refresh_from_db(fields=['payment_status', 'order_status', 'updated_at'])
+        return self.payment_status
     
     def __str__(self):
         return f"Payment {self.payment_id} for order {self.order.order_id}"
 
+class PromotionCampaign(models.Model):
+    # Unambiguous characters only, so printed codes survive being typed back in
+    CODE_ALPHABET = 'ABCDEFGHJKMNPQRSTUVWXYZ23456789'
+    CODE_LENGTH = 10
+    
+    campaign_id = models.CharField(max_length=50, unique=True)
+    name = models.CharField(max_length=255)
+    code_prefix = models.CharField(max_length=20, blank=True)
+    discount_percentage = models.DecimalField(max_digits=5, decimal_places=2)
+    expiry_date = models.DateField()
+    uses_per_code = models.PositiveIntegerField(null=True, blank=True, default=1)  # None means unlimited
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    def save(self, *args, **kwargs):
+        if not self.campaign_id:
+            self.campaign_id = generate_id('campaign')
+        super().save(*args, **kwargs)
+    
+    def new_code(self):
+        code = ''.join(secrets.choice(self.CODE_ALPHABET) for _ in range(self.CODE_LENGTH))
+        return f"{self.code_prefix}-{code}" if self.code_prefix else code
+    
+    def generate_codes(self, count, batch_size=1000):
+        """
+        Create `count` unique discount codes for this campaign with bulk inserts.
+        Codes that collide with existing ones are skipped by the database and
+        regenerated in the next batch. Returns the number of codes created.
+        """
+        created = 0
+        while created < count:
+            size = min(batch_size, count - created)
+            codes = set()
+            while len(codes) < size:
+                codes.add(self.new_code())
+            
+            batch = [
+                Promotion(
+                    promotion_id=generate_id('promo'),
+                    discount_code=code,
+                    discount_percentage=self.discount_percentage,
+                    expiry_date=self.expiry_date,
+                    campaign=self,
+                    max_uses=self.uses_per_code,
+                    remaining_uses=self.uses_per_code,
+                )
+                for code in codes
+            ]
+            Promotion.objects.bulk_create(batch, ignore_conflicts=True)
+            # Promotion ids are unique per row, so this counts exactly what was inserted
+            created += Promotion.objects.filter(
+                promotion_id__in=[promotion.promotion_id for promotion in batch]
+            ).count()
+        
+        # bulk_create bypasses Promotion.save, and misses for these codes may be cached
+        from orders.promotions import promotion_cache
+        promotion_cache.clear()
+        return created
+    
+    def __str__(self):
+        return self.name
+
 class Promotion(models.Model):
     promotion_id = models.CharField(max_length=50, unique=True)
     discount_code = models.CharField(max_length=50, unique=True)
     discount_percentage = models.DecimalField(max_digits=5, decimal_places=2)
     expiry_date = models.DateField()
+    campaign = models.ForeignKey(PromotionCampaign, on_delete=models.CASCADE, null=True, blank=True, related_name='codes')
+    max_uses = models.PositiveIntegerField(null=True, blank=True)  # None means unlimited
+    remaining_uses = models.PositiveIntegerField(null=True, blank=True)
     
     def save(self, *args, **kwargs):
         if not self.promotion_id:
-            # Generate a unique ID in production
-            self.promotion_id = f"promo_{uuid.uuid4().hex[:8]}"
+            self.promotion_id = generate_id('promo')
+        if self._state.adding and self.remaining_uses is None:
+            self.remaining_uses = self.max_uses
         super().save(*args, **kwargs)
+        
+        from orders.promotions import promotion_cache
+        promotion_cache.clear()
+    
+    def delete(self, *args, **kwargs):
+        result = super().delete(*args, **kwargs)
+        
+        from orders.promotions import promotion_cache
+        promotion_cache.clear()
+        return result
     
-    def apply_discount(self, order):
+    def is_active(self, on_date=None):
         from django.utils import timezone
-        if timezone.now().date() <= self.expiry_date:
-            discount_amount = order.total_amount * (self.discount_percentage / 100)
-            order.total_amount -= discount_amount
-            order.save()
+        return (on_date or timezone.now().date()) <= self.expiry_date
+    
+    @property
+    def is_exhausted(self):
+        return self.max_uses is not None and self.remaining_uses == 0
+    
+    def redeem(self):
+        """
+        Consume one use of this code with a conditional UPDATE.
+        Returns False when no uses are left, so parallel checkouts cannot over-redeem.
+        """
+        if self.max_uses is None:
             return True
-        return False
+        return Promotion.objects.filter(
+            pk=self.pk,
+            remaining_uses__gt=0
+        ).update(remaining_uses=models.F('remaining_uses') - 1) == 1
+    
+    @staticmethod
+    def release(promotion_pk):
+        """Give back a use taken by redeem(), e.g. when the order it paid for is cancelled"""
+        Promotion.objects.filter(
+            pk=promotion_pk,
+            remaining_uses__lt=models.F('max_uses')
+        ).update(remaining_uses=models.F('remaining_uses') + 1)
     
     def __str__(self):
         return f"{self.discount_code} - {self.discount_percentage}% off"
+
+
+class IdempotencyKey(models.Model):
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='idempotency_keys')
+    key = models.CharField(max_length=255)
+    request_fingerprint = models.CharField(max_length=64)
+    response_status = models.PositiveSmallIntegerField(null=True, blank=True)
+    response_body = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    # The request holding the key until then; after it another request with the key may take over
+    locked_until = models.DateTimeField(default=timezone.now)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+    
+    class Meta:
+        unique_together = ('user', 'key')
+    
+    @property
+    def is_complete(self):
+        return self.response_status is not None
+    
+    @property
+    def is_abandoned(self):
+        """Incomplete and past its lease, e.g. because the worker handling it died"""
+        return not self.is_complete and self.locked_until <= timezone.now()
+    
+    def __str__(self):
+        return f"Idempotency key {self.key} for {self.user.username}"
+
+class OrderEventQuerySet(models.QuerySet):
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = super().bulk_create(objs, *args, **kwargs)
+        publish_on_commit(obj.user_id for obj in objs)
+        return objs
+
+class OrderEvent(models.Model):
+    """
+    Append-only log of order transitions, written in the same transaction as
+    the change itself. The auto-increment id is the sequence consumers read by
+    (see orders.events). Events refer to orders by order_id rather than a
+    foreign key, so archiving an order leaves its history untouched.
+    """
+    CREATED = 'created'
+    PAID = 'paid'
+    STATUS_CHANGED = 'status_changed'
+    CANCELLED = 'cancelled'
+    REFUNDED = 'refunded'
+    EVENT_TYPES = (
+        (CREATED, 'Created'),
+        (PAID, 'Paid'),
+        (STATUS_CHANGED, 'Status changed'),
+        (CANCELLED, 'Cancelled'),
+        (REFUNDED, 'Refunded'),
+    )
+    
+    order_id = models.CharField(max_length=50, db_index=True)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, related_name='+')
+    event_type = models.CharField(max_length=20, choices=EVENT_TYPES)
+    # The order's statuses right after the event
+    order_status = models.CharField(max_length=20, choices=Order.ORDER_STATUS)
+    payment_status = models.CharField(max_length=20, choices=Order.PAYMENT_STATUS)
+    data = models.JSONField(default=dict, blank=True, encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    objects = OrderEventQuerySet.as_manager()
+    
+    def save(self, *args, **kwargs):
+        # Events are never updated, so every save is a new event for the order's live stream
+        super().save(*args, **kwargs)
+        publish_on_commit([self.user_id])
+    
+    @classmethod
+    def for_order(cls, order, event_type, **data):
+        """An unsaved event for order in its current state, for bulk_create"""
+        return cls(
+            order_id=order.order_id,
+            user_id=order.user_id,
+            event_type=event_type,
+            order_status=order.order_status,
+            payment_status=order.payment_status,
+            data=data
+        )
+    
+    @classmethod
+    def record(cls, order, event_type, **data):
+        event = cls.for_order(order, event_type, **data)
+        event.save()
+        return event
+    
+    def __str__(self):
+        return f"{self.event_type} event {self.pk} for order {self.order_id}"
+
+class OrderEventCheckpoint(models.Model):
+    """How far a consumer of the OrderEvent log has read"""
+    consumer = models.CharField(max_length=100, unique=True)
+    last_event_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"{self.consumer} at event {self.last_event_id}"
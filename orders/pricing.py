@@ -0,0 +1,169 @@
+"""
+Server-side pricing shared by the cart, checkout and order views.
+
+Prices are converted to integer cents once per product and everything in the
+per-line loop is integer arithmetic. Decimals only appear at the edges, through
+the properties on PriceBreakdown.
+"""
+
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.conf import settings
+from django.core.cache import cache
+
+from products.models import Product
+
+
+ONE = Decimal('1')
+
+
+def to_cents(amount):
+    if not isinstance(amount, Decimal):
+        amount = Decimal(amount)
+    cents = amount.scaleb(2)
+    # Prices are stored with two decimal places, so rounding is rarely needed
+    if cents == cents.to_integral_value():
+        return int(cents)
+    return int(cents.quantize(ONE, rounding=ROUND_HALF_UP))
+
+
+def from_cents(cents):
+    return Decimal(cents).scaleb(-2)
+
+
+def percent_of(cents, percentage):
+    """Return percentage (e.g. Decimal('8.00')) of an amount in cents, rounded half up"""
+    basis_points = to_cents(percentage)
+    return (cents * basis_points + 5000) // 10000
+
+
+class PriceBreakdown:
+    """Subtotal, discount, tax, shipping and total of a cart or order, in cents"""
+
+    def __init__(self, subtotal_cents, discount_cents, tax_rate, shipping_cents):
+        self.subtotal_cents = subtotal_cents
+        self.discount_cents = discount_cents
+        self.tax_rate = Decimal(tax_rate)
+        self.shipping_cents = shipping_cents
+        # Discounts reduce the taxable amount
+        taxable_cents = subtotal_cents - discount_cents
+        self.tax_cents = percent_of(taxable_cents, self.tax_rate)
+        self.total_cents = taxable_cents + self.tax_cents + shipping_cents
+
+    @property
+    def subtotal(self):
+        return from_cents(self.subtotal_cents)
+
+    @property
+    def discount(self):
+        return from_cents(self.discount_cents)
+
+    @property
+    def tax(self):
+        return from_cents(self.tax_cents)
+
+    @property
+    def shipping(self):
+        return from_cents(self.shipping_cents)
+
+    @property
+    def total(self):
+        return from_cents(self.total_cents)
+
+
+class CartPricing(PriceBreakdown):
+    """A priced cart, keeping the products it was priced with for stock checks and display"""
+
+    def __init__(self, items, products, unit_prices, missing, item_count, subtotal_cents,
+                 discount_cents, tax_rate, shipping_cents):
+        super().__init__(subtotal_cents, discount_cents, tax_rate, shipping_cents)
+        self.items = items
+        self.products = products
+        self.unit_prices = unit_prices
+        self.missing = missing
+        self.item_count = item_count
+
+    def unit_price(self, product_id):
+        cents = self.unit_prices.get(product_id)
+        return from_cents(cents) if cents is not None else None
+
+    def line_total(self, item):
+        return from_cents(self.unit_prices.get(item.product_id, 0) * item.quantity)
+
+
+def price_items(items, promotion=None, products=None):
+    """
+    Price cart-like items (anything with product_id and quantity).
+    Products are fetched in a single query unless a product_id -> Product map is given.
+    Items whose product no longer exists are listed in `missing` and priced at zero.
+    """
+    items = list(items)
+    if products is None:
+        products = Product.objects.in_bulk({item.product_id for item in items}, field_name='product_id')
+
+    unit_prices = {product_id: to_cents(product.price) for product_id, product in products.items()}
+
+    subtotal_cents = 0
+    item_count = 0
+    missing = []
+    for item in items:
+        unit_cents = unit_prices.get(item.product_id)
+        if unit_cents is None:
+            missing.append(item.product_id)
+            continue
+        subtotal_cents += unit_cents * item.quantity
+        item_count += item.quantity
+
+    discount_cents = percent_of(subtotal_cents, promotion.discount_percentage) if promotion else 0
+    shipping_cents = to_cents(settings.ORDER_SHIPPING_COST) if subtotal_cents > 0 else 0
+
+    return CartPricing(
+        items, products, unit_prices, missing, item_count,
+        subtotal_cents, discount_cents, settings.ORDER_TAX_RATE, shipping_cents
+    )
+
+
+def price_cart(cart, promotion=None):
+    return price_items(cart.items.all(), promotion=promotion)
+
+
+def cart_summary(cart):
+    """Item count and totals for the cart badge, cached until the cart changes"""
+    summary = cache.get(cart.summary_cache_key)
+    if summary is None:
+        pricing = price_cart(cart)
+        summary = {
+            'cart_id': cart.cart_id,
+            'item_count': pricing.item_count,
+            'line_count': len(pricing.items),
+            'subtotal': pricing.subtotal,
+            'tax': pricing.tax,
+            'shipping': pricing.shipping,
+            'total': pricing.total,
+        }
+        # Product price changes do not invalidate the entry, so it also expires
+        cache.set(cart.summary_cache_key, summary, settings.CART_SUMMARY_CACHE_TTL)
+    return summary
+
+
+def empty_cart_summary():
+    return {
+        'cart_id': None,
+        'item_count': 0,
+        'line_count': 0,
+        'subtotal': from_cents(0),
+        'tax': from_cents(0),
+        'shipping': from_cents(0),
+        'total': from_cents(0),
+    }
+
+
+def price_order(order):
+    """Recompute an order's totals from the prices stored on its items"""
+    subtotal_cents = sum(to_cents(item.price) * item.quantity for item in order.items.all())
+    return PriceBreakdown(
+        subtotal_cents,
+        to_cents(order.discount_amount),
+        order.tax_rate,
+        to_cents(order.shipping_cost)
+    )
@@ -0,0 +1,85 @@
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import Promotion
+
+
+class PromotionCache:
+    """
+    Per-worker cache of promotion lookups keyed by discount code.
+
+    Unknown codes are cached as well so bursts of mistyped codes do not reach
+    the database. An entry lives for at most `ttl` seconds and never past the
+    end of its promotion's expiry date. Promotion.save and delete clear the
+    cache of the current worker; other workers pick changes up within `ttl`.
+    """
+
+    def __init__(self, ttl, max_entries):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def lookup(self, discount_code):
+        """Return the Promotion for discount_code, or None if it does not exist"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(discount_code)
+            if entry is not None:
+                deadline, promotion = entry
+                if deadline > now:
+                    self._entries.move_to_end(discount_code)
+                    return promotion
+                del self._entries[discount_code]
+
+        promotion = Promotion.objects.filter(discount_code=discount_code).first()
+
+        with self._lock:
+            self._entries[discount_code] = (now + self._lifetime(promotion), promotion)
+            self._entries.move_to_end(discount_code)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return promotion
+
+    def _lifetime(self, promotion):
+        if promotion is None or not promotion.is_active():
+            return self.ttl
+        # Stop serving the entry once the promotion's last valid day is over
+        expires_at = timezone.make_aware(
+            datetime.combine(promotion.expiry_date + timedelta(days=1), datetime.min.time())
+        )
+        return min(self.ttl, max((expires_at - timezone.now()).total_seconds(), 0))
+
+
+promotion_cache = PromotionCache(
+    ttl=settings.PROMOTION_CACHE_TTL,
+    max_entries=settings.PROMOTION_CACHE_MAX_ENTRIES,
+)
+
+
+def get_active_promotion(discount_code):
+    """
+    Return (promotion, error) for a discount code.
+    error is None when the code exists and has not expired.
+    """
+    if not discount_code:
+        return None, 'Discount code is required'
+
+    promotion = promotion_cache.lookup(discount_code)
+    if promotion is None:
+        return None, 'Invalid discount code'
+    if not promotion.is_active():
+        return None, 'This discount code has expired'
+    if promotion.is_exhausted:
+        # Best effort only: the cached copy may be stale, checkout redeems atomically
+        return None, 'This discount code has been fully redeemed'
+    return promotion, None
@@ -1,28 +1,62 @@
 from rest_framework import serializers
-from .models import Cart, CartItem, ShippingInfo, Order, OrderItem, Payment, Promotion
+from .models import Cart, CartItem, ShippingInfo, Order, OrderItem, ArchivedOrder, Payment, Promotion
+from .pricing import price_cart
 
 class CartItemSerializer(serializers.ModelSerializer):
     product_name = serializers.SerializerMethodField()
-    total_price = serializers.DecimalField(max_digits=10, decimal_places=2, read_only=True)
+    total_price = serializers.SerializerMethodField()
     
     class Meta:
         model = CartItem
         fields = ['product_id', 'product_name', 'quantity', 'total_price']
     
     def get_product_name(self, obj):
-        return obj.product.name if obj.product else f"Unknown Product ({obj.product_id})"
+        # Use the products already loaded by the cart pricing when available
+        pricing = self.context.get('pricing')
+        product = pricing.products.get(obj.product_id) if pricing else obj.product
+        return product.name if product else f"Unknown Product ({obj.product_id})"
+    
+    def get_total_price(self, obj):
+        pricing = self.context.get('pricing')
+        total = pricing.line_total(obj) if pricing else obj.total_price
+        return f"{total:.2f}"
 
 class CartSerializer(serializers.ModelSerializer):
-    items = CartItemSerializer(many=True, read_only=True)
+    items = serializers.SerializerMethodField()
+    item_count = serializers.SerializerMethodField()
+    subtotal = serializers.SerializerMethodField()
+    tax = serializers.SerializerMethodField()
+    shipping = serializers.SerializerMethodField()
     total = serializers.SerializerMethodField()
     
     class Meta:
         model = Cart
-        fields = ['cart_id', 'user', 'items', 'total', 'created_at', 'updated_at']
+        fields = ['cart_id', 'user', 'items', 'item_count', 'subtotal', 'tax', 'shipping', 'total', 'created_at', 'updated_at']
         read_only_fields = ['cart_id', 'user', 'created_at', 'updated_at']
     
+    def to_representation(self, instance):
+        # Price the cart once; every total and line below reads from it
+        self._pricing = price_cart(instance)
+        return super().to_representation(instance)
+    
+    def get_items(self, obj):
+        context = {**self.context, 'pricing': self._pricing}
+        return CartItemSerializer(self._pricing.items, many=True, context=context).data
+    
+    def get_item_count(self, obj):
+        return self._pricing.item_count
+    
+    def get_subtotal(self, obj):
+        return self._pricing.subtotal
+    
+    def get_tax(self, obj):
+        return self._pricing.tax
+    
+    def get_shipping(self, obj):
+        return self._pricing.shipping
+    
     def get_total(self, obj):
-        return sum(item.total_price for item in obj.items.all())
+        return self._pricing.total
 
 class ShippingInfoSerializer(serializers.ModelSerializer):
     class Meta:
@@ -42,10 +76,10 @@ class OrderSerializer(serializers.ModelSerializer):
     
     class Meta:
         model = Order
-        fields = ['order_id', 'user', 'username', 'customer_name', 'total_amount', 'tax_rate', 'shipping_cost', 
+        fields = ['order_id', 'user', 'username', 'customer_name', 'total_amount', 'tax_rate', 'shipping_cost', 'discount_amount',
                  'payment_status', 'order_status', 'shipping_info', 'items', 
-                 'created_at', 'updated_at']
-        read_only_fields = ['order_id', 'user', 'created_at', 'updated_at']
+                 'version', 'created_at', 'updated_at']
+        read_only_fields = ['order_id', 'user', 'version', 'created_at', 'updated_at']
     
     def get_username(self, obj):
         """Return the username of the order's user"""
@@ -66,6 +100,12 @@ class OrderSerializer(serializers.ModelSerializer):
         # Fall back to username if no name available
         return obj.user.username
 
+class ArchivedOrderSerializer(OrderSerializer):
+    """Same representation as OrderSerializer, for orders read from the archive"""
+    
+    class Meta(OrderSerializer.Meta):
+        model = ArchivedOrder
+
 class PaymentSerializer(serializers.ModelSerializer):
     class Meta:
         model = Payment
@@ -76,5 +116,5 @@ class PaymentSerializer(serializers.ModelSerializer):
 class PromotionSerializer(serializers.ModelSerializer):
     class Meta:
         model = Promotion
-        fields = ['promotion_id', 'discount_code', 'discount_percentage', 'expiry_date']
-        read_only_fields = ['promotion_id']
+        fields = ['promotion_id', 'discount_code', 'discount_percentage', 'expiry_date', 'max_uses', 'remaining_uses']
+        read_only_fields = ['promotion_id', 'remaining_uses']
@@ -1,54 +1,466 @@
-from .models import Order, OrderItem
+from django.db import transaction
+from django.db.models import Case, Exists, F, IntegerField, OuterRef, Value, When
+from django.utils import timezone
+from .models import ArchivedOrder, ArchivedOrderItem, Cart, CartItem, Order, OrderEvent, OrderItem, Payment, Promotion
+from .pricing import price_cart
 from products.models import Product
+from notifications.models import Notification
+from techshelf.ids import generate_id
 
 class OrderService:
     @staticmethod
-    def create_order_from_cart(cart):
+    @transaction.atomic
+    def create_order_from_cart(cart, shipping_info=None, promotion=None):
         if not cart.user:
             raise ValueError("Cannot create order for guest cart")
         
-        # Calculate totals
-        total_amount = 0
-        items = []
+        # Price the whole cart from a single product fetch
+        pricing = price_cart(cart, promotion=promotion)
         
-        for cart_item in cart.items.all():
-            try:
-                product = Product.objects.get(product_id=cart_item.product_id)
-                if product.stock < cart_item.quantity:
-                    raise ValueError(f"Not enough stock for product: {product.name}")
-                
-                item_total = product.price * cart_item.quantity
-                total_amount += item_total
-                
-                items.append({
-                    'product': product,
-                    'quantity': cart_item.quantity,
-                    'price': product.price
-                })
-            except Product.DoesNotExist:
-                raise ValueError(f"Product with ID {cart_item.product_id} does not exist")
+        if pricing.missing:
+            raise ValueError(f"Product with ID {pricing.missing[0]} does not exist")
+        
+        quantities = {}
+        for cart_item in pricing.items:
+            quantities[cart_item.product_id] = quantities.get(cart_item.product_id, 0) + cart_item.quantity
+        
+        for product_id, quantity in quantities.items():
+            product = pricing.products[product_id]
+            if product.stock < quantity:
+                raise ValueError(f"Not enough stock for product: {product.name}")
+        
+        # Redeem before the order is written; the discount itself is part of the pricing
+        if promotion and not promotion.redeem():
+            raise ValueError(f"Discount code {promotion.discount_code} has been fully redeemed")
         
         # Create order
         order = Order.objects.create(
             user=cart.user,
-            total_amount=total_amount,
-            tax_rate=0.0,  # Set appropriate tax rate in production
-            shipping_cost=0.0  # Calculate shipping cost in production
+            total_amount=pricing.total,
+            discount_amount=pricing.discount,
+            promotion=promotion,
+            shipping_info=shipping_info,
+            tax_rate=pricing.tax_rate,
+            shipping_cost=pricing.shipping
         )
+        # The payment is pending from the start, so an order never exists without one to settle
+        Payment.objects.create(order=order, amount=order.total_amount)
         
         # Create order items
-        for item in items:
-            OrderItem.objects.create(
+        OrderItem.objects.bulk_create([
+            OrderItem(
                 order=order,
-                product_id=item['product'].product_id,
-                quantity=item['quantity'],
-                price=item['price']
+                product_id=product_id,
+                quantity=quantity,
+                price=pricing.unit_price(product_id)
             )
-            
-            # Decrement stock
-            item['product'].decrement_stock(item['quantity'])
+            for product_id, quantity in quantities.items()
+        ])
+        
+        # Decrement stock with conditional updates so concurrent checkouts cannot oversell
+        now = timezone.now()
+        for product_id, quantity in quantities.items():
+            updated = Product.objects.filter(
+                product_id=product_id,
+                stock__gte=quantity
+            ).update(stock=F('stock') - quantity, version=F('version') + 1, updated_at=now)
+            if not updated:
+                raise ValueError(f"Not enough stock for product: {pricing.products[product_id].name}")
+        
+        OrderEvent.record(order, OrderEvent.CREATED, total_amount=order.total_amount, items=len(quantities))
         
         # Clear cart
         cart.items.all().delete()
+        cart.invalidate_summary()
         
         return order
+    
+    @staticmethod
+    def bulk_update_status(store, order_ids, new_status):
+        """
+        Move every order in order_ids that contains products from store to new_status.
+        Returns (updated_order_ids, rejected) where rejected maps order ids to a reason.
+        """
+        source_statuses = Order.source_statuses_for(new_status)
+        seller_items = OrderItem.objects.filter(
+            order=OuterRef('pk'),
+            product_id__in=store.products.values('product_id')
+        )
+        
+        with transaction.atomic():
+            # Ownership and current status for the whole batch in one query
+            candidates = list(
+                Order.objects.select_for_update()
+                .filter(order_id__in=order_ids)
+                .filter(Exists(seller_items))
+                .values_list('id', 'order_id', 'user_id', 'order_status', 'payment_status')
+            )
+            
+            found = {order_id for _, order_id, _, _, _ in candidates}
+            rejected = {
+                order_id: 'Order not found'
+                for order_id in order_ids if order_id not in found
+            }
+            
+            movable = []
+            events = []
+            for pk, order_id, user_id, current_status, payment_status in candidates:
+                if current_status in source_statuses:
+                    movable.append((pk, order_id, user_id))
+                    events.append(OrderEvent(
+                        order_id=order_id,
+                        user_id=user_id,
+                        event_type=OrderEvent.STATUS_CHANGED,
+                        order_status=new_status,
+                        payment_status=payment_status,
+                        data={'from': current_status, 'to': new_status}
+                    ))
+                else:
+                    rejected[order_id] = f'Cannot change status from {current_status} to {new_status}'
+            
+            if movable:
+                Order.objects.filter(
+                    id__in=[pk for pk, _, _ in movable],
+                    order_status__in=source_statuses
+                ).update(order_status=new_status, version=F('version') + 1, updated_at=timezone.now())
+                
+                # bulk_create skips Notification.save, so ids are assigned here
+                Notification.objects.bulk_create([
+                    Notification(
+                        notification_id=generate_id('notif'),
+                        user_id=user_id,
+                        kind=Notification.ORDER_STATUS_CHANGED,
+                        order_id=pk,
+                        payload={'order_id': order_id, 'status': new_status}
+                    )
+                    for pk, order_id, user_id in movable
+                ])
+                OrderEvent.objects.bulk_create(events)
+        
+        return [order_id for _, order_id, _ in movable], rejected
+    
+    @staticmethod
+    @transaction.atomic
+    def cancel_order(order):
+        """
+        Cancel a paid order that has not been delivered: refund the payment, put the
+        stock back and notify the buyer and each seller once.
+        Raises ValueError if the order cannot be cancelled.
+        """
+        now = timezone.now()
+        
+        # Claiming the cancellation with a conditional UPDATE makes a concurrent duplicate a no-op
+        cancelled = Order.objects.filter(pk=order.pk, payment_status='PAID').exclude(
+            order_status__in=['DELIVERED', 'CANCELLED']
+        ).update(order_status='CANCELLED', payment_status='REFUNDED', version=F('version') + 1, updated_at=now)
+        if not cancelled:
+            raise ValueError("This order cannot be cancelled.")
+        order.order_status = 'CANCELLED'
+        order.payment_status = 'REFUNDED'
+        order.version += 1
+        order.updated_at = now
+        
+        # Refund payment
+        Payment.objects.filter(order=order).update(payment_status='REFUNDED', updated_at=now)
+        OrderEvent.objects.bulk_create([
+            OrderEvent.for_order(order, OrderEvent.CANCELLED),
+            OrderEvent.for_order(order, OrderEvent.REFUNDED, amount=order.total_amount),
+        ])
+        
+        restocked = OrderService.restock(order, now)
+        if order.promotion_id:
+            Promotion.release(order.promotion_id)
+        
+        # One notification for the buyer and one per seller, however many of their products were ordered
+        sellers = set(restocked.values_list('store_id', 'store__user_id'))
+        Notification.objects.coalesce_create(
+            [Notification(
+                notification_id=generate_id('notif'),
+                user_id=order.user_id,
+                kind=Notification.ORDER_CANCELLED,
+                order=order,
+                payload={'order_id': order.order_id}
+            )] + [
+                Notification(
+                    notification_id=generate_id('notif'),
+                    user_id=seller_id,
+                    kind=Notification.SELLER_ORDER_CANCELLED,
+                    order=order,
+                    store_id=store_id,
+                    payload={'order_id': order.order_id, 'buyer': order.user.username}
+                )
+                for store_id, seller_id in sellers
+            ]
+        )
+        return order
+    
+    @staticmethod
+    def notify_order_placed(order):
+        """Tell the buyer their order was placed and each seller in it, once, that they have a new order"""
+        sellers = set(
+            Product.objects.filter(product_id__in=order.items.values('product_id'))
+            .values_list('store_id', 'store__user_id')
+        )
+        Notification.objects.coalesce_create(
+            [Notification(
+                notification_id=generate_id('notif'),
+                user_id=order.user_id,
+                kind=Notification.ORDER_PLACED,
+                order=order,
+                payload={'order_id': order.order_id, 'total_amount': order.total_amount}
+            )] + [
+                Notification(
+                    notification_id=generate_id('notif'),
+                    user_id=seller_id,
+                    kind=Notification.ORDER_RECEIVED,
+                    order=order,
+                    store_id=store_id,
+                    payload={'order_id': order.order_id, 'buyer': order.user.username}
+                )
+                for store_id, seller_id in sellers
+            ]
+        )
+    
+    @staticmethod
+    def restock(order, now):
+        """Put the stock of every product in the order back with one UPDATE. Returns the products."""
+        quantities = {}
+        for product_id, quantity in order.items.values_list('product_id', 'quantity'):
+            quantities[product_id] = quantities.get(product_id, 0) + quantity
+        restocked = Product.objects.filter(product_id__in=quantities)
+        if quantities:
+            restocked.update(
+                stock=F('stock') + Case(
+                    *[When(product_id=product_id, then=Value(quantity)) for product_id, quantity in quantities.items()],
+                    output_field=IntegerField()
+                ),
+                version=F('version') + 1,
+                updated_at=now
+            )
+        return restocked
+    
+    @staticmethod
+    @transaction.atomic
+    def settle_payment(payment_id, result):
+        """
+        Record the gateway's answer for a pending payment. A completed charge moves the
+        order to PAID/PROCESSING; a failed one cancels the order and releases its stock.
+        Returns False if the payment had already been settled.
+        """
+        now = timezone.now()
+        payment_status = 'COMPLETED' if result.succeeded else 'FAILED'
+        
+        # Only the first answer counts, so a retried or duplicate settlement is a no-op
+        settled = Payment.objects.filter(payment_id=payment_id, payment_status='PENDING').update(
+            payment_status=payment_status,
+            transaction_id=result.transaction_id,
+            updated_at=now
+        )
+        if not settled:
+            return False
+        
+        order = Order.objects.get(payment__payment_id=payment_id)
+        if result.succeeded:
+            paid = Order.objects.filter(pk=order.pk, payment_status='PENDING').update(
+                payment_status='PAID', order_status='PROCESSING', version=F('version') + 1, updated_at=now
+            )
+            if paid:
+                order.payment_status = 'PAID'
+                order.order_status = 'PROCESSING'
+                OrderEvent.record(order, OrderEvent.PAID, transaction_id=result.transaction_id)
+            return True
+        
+        failed = Order.objects.filter(pk=order.pk, payment_status='PENDING').exclude(
+            order_status='CANCELLED'
+        ).update(
+            payment_status='FAILED', order_status='CANCELLED', version=F('version') + 1, updated_at=now
+        )
+        if failed:
+            order.payment_status = 'FAILED'
+            order.order_status = 'CANCELLED'
+            OrderEvent.record(order, OrderEvent.CANCELLED, reason=result.error)
+            OrderService.restock(order, now)
+            if order.promotion_id:
+                Promotion.release(order.promotion_id)
+            Notification.objects.create(
+                notification_id=generate_id('notif'),
+                user_id=order.user_id,
+                kind=Notification.PAYMENT_FAILED,
+                order=order,
+                payload={'order_id': order.order_id, 'reason': result.error}
+            )
+        return True
+    
+    @staticmethod
+    @transaction.atomic
+    def archive_orders(order_pks):
+        """
+        Move delivered or cancelled orders (by primary key) with their items and a
+        snapshot of their payment into the archive tables. Returns the number archived.
+        """
+        orders = list(
+            Order.objects.select_for_update(of=('self',))
+            .select_related('payment')
+            .filter(pk__in=order_pks, order_status__in=Order.ARCHIVABLE_STATUSES)
+        )
+        if not orders:
+            return 0
+        
+        copies = []
+        for order in orders:
+            # Orders that never reached payment have no Payment row
+            payment = getattr(order, 'payment', None)
+            copies.append(ArchivedOrder(
+                order_id=order.order_id,
+                user_id=order.user_id,
+                total_amount=order.total_amount,
+                tax_rate=order.tax_rate,
+                shipping_cost=order.shipping_cost,
+                discount_amount=order.discount_amount,
+                payment_status=order.payment_status,
+                order_status=order.order_status,
+                version=order.version,
+                shipping_info_id=order.shipping_info_id,
+                payment_id=payment.payment_id if payment else None,
+                transaction_id=payment.transaction_id if payment else None,
+                created_at=order.created_at,
+                updated_at=order.updated_at
+            ))
+        archived = ArchivedOrder.objects.bulk_create(copies)
+        archived_pks = {order.pk: archived_order.pk for order, archived_order in zip(orders, archived)}
+        
+        ArchivedOrderItem.objects.bulk_create([
+            ArchivedOrderItem(
+                order_id=archived_pks[item.order_id],
+                product_id=item.product_id,
+                quantity=item.quantity,
+                price=item.price
+            )
+            for item in OrderItem.objects.filter(order_id__in=archived_pks)
+        ])
+        
+        # Items and payments go with the orders
+        Order.objects.filter(pk__in=archived_pks).delete()
+        return len(orders)
+
+
+class CartService:
+    @staticmethod
+    def save_lines(cart, quantities):
+        """Insert or overwrite cart lines (product_id -> final quantity) with one upsert"""
+        if not quantities:
+            return
+        CartItem.objects.bulk_create(
+            [CartItem(cart=cart, product_id=product_id, quantity=quantity) for product_id, quantity in quantities.items()],
+            update_conflicts=True,
+            unique_fields=['cart', 'product_id'],
+            update_fields=['quantity']
+        )
+
+    @staticmethod
+    @transaction.atomic
+    def merge_items(cart, quantities):
+        """
+        Add quantities (product_id -> quantity) to cart with a single upsert.
+        Lines already in the cart are locked and incremented, others are inserted.
+        """
+        if not quantities:
+            return cart
+
+        existing = dict(
+            cart.items.select_for_update()
+            .filter(product_id__in=quantities)
+            .values_list('product_id', 'quantity')
+        )
+        CartService.save_lines(cart, {
+            product_id: existing.get(product_id, 0) + quantity
+            for product_id, quantity in quantities.items()
+        })
+        cart.invalidate_summary()
+        return cart
+
+    @staticmethod
+    @transaction.atomic
+    def apply_operations(cart, operations):
+        """
+        Apply a list of (op, product_id, quantity) cart operations in order, where op is
+        'add', 'set' or 'remove'. Products are fetched once and stock is checked against
+        the final quantities, so the batch either applies completely or not at all.
+        """
+        quantities = dict(cart.items.select_for_update().values_list('product_id', 'quantity'))
+        touched = set()
+        for op, product_id, quantity in operations:
+            if op == 'add':
+                quantities[product_id] = quantities.get(product_id, 0) + quantity
+            elif op == 'set':
+                quantities[product_id] = quantity
+            else:
+                quantities[product_id] = 0
+            touched.add(product_id)
+
+        kept = {product_id: quantities[product_id] for product_id in touched if quantities[product_id] > 0}
+        products = Product.objects.in_bulk(kept, field_name='product_id')
+        for product_id, quantity in kept.items():
+            product = products.get(product_id)
+            if product is None:
+                raise ValueError(f"Product not found: {product_id}")
+            if quantity > product.stock:
+                raise ValueError(f"Only {product.stock} units of {product.name} available")
+
+        CartService.save_lines(cart, kept)
+        removed = touched - kept.keys()
+        if removed:
+            cart.items.filter(product_id__in=removed).delete()
+        cart.invalidate_summary()
+        return cart
+
+    @staticmethod
+    @transaction.atomic
+    def reorder(cart, order):
+        """
+        Add the items of a past order to cart, capped by current stock.
+        Returns (added, unavailable, price_changes): added maps product ids to the quantity
+        put in the cart, the lists describe items that could not be (fully) added and items
+        whose price changed since the order.
+        """
+        ordered = {}
+        ordered_prices = {}
+        for item in order.items.all():
+            ordered[item.product_id] = ordered.get(item.product_id, 0) + item.quantity
+            ordered_prices[item.product_id] = item.price
+
+        existing = dict(
+            cart.items.select_for_update()
+            .filter(product_id__in=ordered)
+            .values_list('product_id', 'quantity')
+        )
+        # Current price and stock of every ordered product in one query
+        products = Product.objects.in_bulk(ordered, field_name='product_id')
+
+        added = {}
+        unavailable = []
+        price_changes = []
+        for product_id, quantity in ordered.items():
+            product = products.get(product_id)
+            if product is None:
+                unavailable.append({'product_id': product_id, 'requested': quantity, 'added': 0,
+                                    'reason': 'Product is no longer available'})
+                continue
+
+            in_cart = existing.get(product_id, 0)
+            quantity_to_add = min(quantity, max(product.stock - in_cart, 0))
+            if quantity_to_add:
+                added[product_id] = quantity_to_add
+            if quantity_to_add < quantity:
+                unavailable.append({'product_id': product_id, 'requested': quantity, 'added': quantity_to_add,
+                                    'reason': f'Only {product.stock} units available'})
+            if product.price != ordered_prices[product_id]:
+                price_changes.append({'product_id': product_id, 'ordered_price': ordered_prices[product_id],
+                                      'current_price': product.price})
+
+        CartService.save_lines(cart, {
+            product_id: existing.get(product_id, 0) + quantity
+            for product_id, quantity in added.items()
+        })
+        cart.invalidate_summary()
+        return added, unavailable, price_changes
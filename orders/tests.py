@@ -0,0 +1,627 @@
+from datetime import date, timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import transaction
+from django.test import override_settings
+from django.utils import timezone
+from rest_framework.test import APITestCase, APITransactionTestCase
+
+from notifications.models import Notification
+from products.models import Product
+from stores.models import Store
+from techshelf.versioning import StaleObjectError
+from users.models import User
+
+from . import gateway
+from .gateway import PaymentClient, SimulatedGateway
+from .models import (
+    ArchivedOrder, ArchivedOrderItem, Cart, IdempotencyKey, Order, OrderEvent, OrderItem, Payment, Promotion,
+    ShippingInfo
+)
+from .services import OrderService
+
+
+class OrderFixtures:
+    """A seller with five products in stock and a logged-in buyer"""
+
+    def setUp(self):
+        self.seller = User.objects.create_user(username='seller', email='seller@example.com', password='pass',
+                                               role='SELLER')
+        self.store = Store.objects.create(store_name='Gadgets', user=self.seller)
+        self.buyer = User.objects.create_user(username='buyer', email='buyer@example.com', password='pass')
+        self.products = [
+            Product.objects.create(name=f'Product {i}', price=Decimal('10.00') + i, stock=100, category='Phones',
+                                   store=self.store)
+            for i in range(5)
+        ]
+        self.client.force_authenticate(self.buyer)
+
+    def add_to_cart(self, product, quantity=1):
+        response = self.client.post('/api/orders/cart/add/', {'product_id': product.product_id, 'quantity': quantity},
+                                    format='json')
+        self.assertLess(response.status_code, 300, response.content)
+
+    def cart_quantities(self):
+        return dict(Cart.objects.get(user=self.buyer).items.values_list('product_id', 'quantity'))
+
+    def checkout(self, data=None, **headers):
+        return self.client.post('/api/orders/checkout/', data or {'city': 'Springfield'}, format='json', **headers)
+
+    def place_order(self, product=None, quantity=1):
+        self.add_to_cart(product or self.products[0], quantity)
+        response = self.checkout()
+        self.assertEqual(response.status_code, 201, response.content)
+        return Order.objects.get(order_id=response.data['order_id'])
+
+
+@override_settings(PAYMENT_GATEWAY_ASYNC=False)
+class OrderTestCase(OrderFixtures, APITestCase):
+    pass
+
+
+class IdempotentCheckoutTests(OrderTestCase):
+    def test_retry_replays_the_first_response(self):
+        self.add_to_cart(self.products[0], 2)
+        first = self.checkout(HTTP_IDEMPOTENCY_KEY='checkout-1')
+        self.assertEqual(first.status_code, 201, first.content)
+
+        self.add_to_cart(self.products[0])
+        retry = self.checkout(HTTP_IDEMPOTENCY_KEY='checkout-1')
+        self.assertEqual(retry.status_code, 201)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(retry.data['order_id'], first.data['order_id'])
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_key_reused_for_a_different_request_is_refused(self):
+        self.add_to_cart(self.products[0])
+        self.assertEqual(self.checkout(HTTP_IDEMPOTENCY_KEY='checkout-1').status_code, 201)
+        response = self.checkout({'city': 'Shelbyville'}, HTTP_IDEMPOTENCY_KEY='checkout-1')
+        self.assertEqual(response.status_code, 422)
+
+    def test_validation_error_is_replayed(self):
+        self.assertEqual(self.checkout(HTTP_IDEMPOTENCY_KEY='checkout-1').status_code, 400)
+        self.add_to_cart(self.products[0])
+        response = self.checkout(HTTP_IDEMPOTENCY_KEY='checkout-1')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response['Idempotent-Replayed'], 'true')
+
+    def test_failure_before_the_order_is_written_is_not_stored(self):
+        self.add_to_cart(self.products[0])
+        with mock.patch('orders.models.Cart.checkout', side_effect=RuntimeError('database is locked')):
+            failed = self.checkout(HTTP_IDEMPOTENCY_KEY='checkout-1')
+        self.assertEqual(failed.status_code, 400)
+        self.assertFalse(IdempotencyKey.objects.exists())
+        self.assertFalse(Order.objects.exists())
+
+        retry = self.checkout(HTTP_IDEMPOTENCY_KEY='checkout-1')
+        self.assertEqual(retry.status_code, 201, retry.content)
+        self.assertNotIn('Idempotent-Replayed', retry)
+
+    def test_failure_after_the_order_is_written_is_stored_against_it(self):
+        self.add_to_cart(self.products[0], 2)
+        with mock.patch('orders.models.Order.process_payment', side_effect=RuntimeError('database is locked')):
+            failed = self.checkout(HTTP_IDEMPOTENCY_KEY='checkout-1')
+        self.assertEqual(failed.status_code, 201, failed.content)
+        self.assertEqual((failed.data['order_status'], failed.data['payment_status']), ('CANCELLED', 'FAILED'))
+        self.products[0].refresh_from_db()
+        self.assertEqual(self.products[0].stock, 100)
+
+        self.add_to_cart(self.products[1])
+        retry = self.checkout(HTTP_IDEMPOTENCY_KEY='checkout-1')
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(retry.data['order_id'], failed.data['order_id'])
+        self.assertEqual(Order.objects.count(), 1)
+
+    @override_settings(IDEMPOTENCY_WAIT_TIMEOUT=0.3, IDEMPOTENCY_POLL_INTERVAL=0.05)
+    def test_key_of_a_dead_request_is_taken_over_after_its_lease(self):
+        self.add_to_cart(self.products[0])
+        first = self.checkout(HTTP_IDEMPOTENCY_KEY='checkout-1')
+        # As if the worker had died before storing its response
+        IdempotencyKey.objects.filter(key='checkout-1').update(
+            response_status=None, response_body=None, locked_until=timezone.now() + timedelta(minutes=1)
+        )
+        self.add_to_cart(self.products[0])
+        self.assertEqual(self.checkout(HTTP_IDEMPOTENCY_KEY='checkout-1').status_code, 409)
+
+        IdempotencyKey.objects.filter(key='checkout-1').update(locked_until=timezone.now())
+        response = self.checkout(HTTP_IDEMPOTENCY_KEY='checkout-1')
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertNotEqual(response.data['order_id'], first.data['order_id'])
+        self.assertEqual(IdempotencyKey.objects.get(key='checkout-1').response_status, 201)
+
+
+class OrderListQueryTests(OrderTestCase):
+    """Listing orders takes the same queries whatever the number of orders and items"""
+    # The page count, the page of orders with their shipping info, and their items
+    query_budget = 3
+
+    def create_orders(self, count):
+        Order.objects.all().delete()
+        for _ in range(count):
+            shipping_info = ShippingInfo.objects.create(shipping_address='1 Main St', city='Springfield',
+                                                        country='US', postal_code='12345')
+            order = Order.objects.create(user=self.buyer, total_amount=Decimal('33.00'), shipping_info=shipping_info)
+            OrderItem.objects.bulk_create([
+                OrderItem(order=order, product_id=product.product_id, quantity=1, price=product.price)
+                for product in self.products[:3]
+            ])
+
+    def assert_list_queries(self, user, url):
+        self.client.force_authenticate(user)
+        for count in (1, 5, 25):
+            with self.subTest(orders=count):
+                self.create_orders(count)
+                with self.assertNumQueries(self.query_budget):
+                    response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.data['count'], count)
+                self.assertEqual(len(response.data['results'][0]['items']), 3)
+
+    def test_buyer_order_list(self):
+        self.assert_list_queries(self.buyer, '/api/orders/orders/')
+
+    def test_seller_order_list(self):
+        self.assert_list_queries(self.seller, '/api/orders/seller-orders/')
+
+
+class PromotionRedemptionTests(OrderTestCase):
+    def setUp(self):
+        super().setUp()
+        self.promotion = Promotion.objects.create(discount_code='SPRING', discount_percentage=Decimal('10.00'),
+                                                  expiry_date=date.today() + timedelta(days=7), max_uses=2)
+
+    def checkout_with_code(self):
+        self.add_to_cart(self.products[0])
+        return self.checkout({'city': 'Springfield', 'discount_code': 'SPRING'})
+
+    def remaining_uses(self):
+        return Promotion.objects.get(pk=self.promotion.pk).remaining_uses
+
+    def test_code_is_not_redeemed_more_than_max_uses(self):
+        self.assertEqual(self.checkout_with_code().status_code, 201)
+        self.assertEqual(self.checkout_with_code().status_code, 201)
+        response = self.checkout_with_code()
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('fully redeemed', response.data['error'])
+        self.assertEqual(Order.objects.filter(promotion=self.promotion).count(), 2)
+        self.assertEqual(self.remaining_uses(), 0)
+        # The in-memory count is stale; the conditional UPDATE still refuses
+        self.assertFalse(self.promotion.redeem())
+        self.assertEqual(self.remaining_uses(), 0)
+
+    def test_cancelling_the_order_gives_the_use_back(self):
+        response = self.checkout_with_code()
+        self.assertEqual(self.remaining_uses(), 1)
+        self.assertEqual(self.client.post(f"/api/orders/orders/{response.data['order_id']}/cancel/").status_code, 200)
+        self.assertEqual(self.remaining_uses(), 2)
+        # A repeated cancellation does not give it back twice
+        self.client.post(f"/api/orders/orders/{response.data['order_id']}/cancel/")
+        self.assertEqual(self.remaining_uses(), 2)
+
+    def test_declined_payment_gives_the_use_back(self):
+        declining = PaymentClient(SimulatedGateway(1, 1, decline_rate=1.0), max_workers=1, max_pending=10)
+        with mock.patch.object(gateway, '_client', declining):
+            response = self.checkout_with_code()
+        declining.shutdown()
+        self.assertEqual(response.data['payment_status'], 'FAILED')
+        self.assertEqual(self.remaining_uses(), 2)
+
+
+class PaymentGatewayTests(OrderTestCase):
+    def use_gateway(self, simulated_gateway):
+        client = PaymentClient(simulated_gateway, max_workers=1, max_pending=10)
+        self.addCleanup(client.shutdown)
+        return mock.patch.object(gateway, '_client', client)
+
+    def test_completed_charge_pays_the_order(self):
+        with self.use_gateway(SimulatedGateway(1, 1)):
+            order = self.place_order(quantity=2)
+        self.assertEqual((order.order_status, order.payment_status), ('PROCESSING', 'PAID'))
+        self.assertEqual(order.payment.payment_status, 'COMPLETED')
+
+    def test_timeout_leaves_the_payment_pending(self):
+        # The card may have been charged, so the order is neither paid nor cancelled
+        with self.use_gateway(SimulatedGateway(1, 0.01, latency=0.05)):
+            order = self.place_order(quantity=2)
+        self.assertEqual((order.order_status, order.payment_status), ('CREATED', 'PENDING'))
+        self.assertEqual(order.payment.payment_status, 'PENDING')
+        self.products[0].refresh_from_db()
+        self.assertEqual(self.products[0].stock, 98)
+
+    def reconcile_payments(self, *args):
+        call_command('reconcile_payments', *args, stdout=StringIO())
+
+    def test_reconcile_settles_a_charge_whose_answer_was_lost(self):
+        with self.use_gateway(SimulatedGateway(1, 0.01, latency=0.05)):
+            order = self.place_order()
+            self.reconcile_payments('--older-than', '0')
+        order.refresh_from_db()
+        self.assertEqual((order.order_status, order.payment_status), ('PROCESSING', 'PAID'))
+
+    def test_reconcile_fails_a_charge_the_gateway_never_received(self):
+        with self.use_gateway(SimulatedGateway(0.01, 1, connect_latency=0.05)):
+            order = self.place_order(quantity=2)
+            self.reconcile_payments('--older-than', '0')
+        order.refresh_from_db()
+        self.assertEqual((order.order_status, order.payment_status), ('CANCELLED', 'FAILED'))
+        self.products[0].refresh_from_db()
+        self.assertEqual(self.products[0].stock, 100)
+
+    def test_reconcile_leaves_recent_payments_to_their_worker(self):
+        with self.use_gateway(SimulatedGateway(0.01, 1, connect_latency=0.05)):
+            order = self.place_order()
+            self.reconcile_payments()
+        order.refresh_from_db()
+        self.assertEqual(order.payment_status, 'PENDING')
+
+    @override_settings(PAYMENT_GATEWAY_ASYNC=True)
+    def test_busy_gateway_sheds_the_charge(self):
+        client = PaymentClient(SimulatedGateway(1, 1), max_workers=1, max_pending=1)
+        self.addCleanup(client.shutdown)
+        client._slots.acquire()
+        with mock.patch.object(gateway, '_client', client), self.captureOnCommitCallbacks(execute=True):
+            order = self.place_order(quantity=2)
+        order.refresh_from_db()
+        self.assertEqual((order.order_status, order.payment_status), ('CANCELLED', 'FAILED'))
+        self.products[0].refresh_from_db()
+        self.assertEqual(self.products[0].stock, 100)
+
+
+@override_settings(PAYMENT_GATEWAY_ASYNC=True)
+class AsyncPaymentTests(OrderFixtures, APITransactionTestCase):
+    """The gateway pool reads and settles the payment on its own connection, so the order must be committed"""
+
+    def test_pool_settles_the_payment_after_checkout(self):
+        client = PaymentClient(SimulatedGateway(1, 1, latency=0.5), max_workers=1, max_pending=10)
+        with mock.patch.object(gateway, '_client', client):
+            order = self.place_order(quantity=2)
+            self.assertEqual((order.order_status, order.payment_status), ('CREATED', 'PENDING'))
+            # Waits for the charge to be settled
+            client.shutdown()
+        order.refresh_from_db()
+        self.assertEqual((order.order_status, order.payment_status), ('PROCESSING', 'PAID'))
+        self.assertEqual(order.payment.payment_status, 'COMPLETED')
+
+
+class CartUpdateItemTests(OrderTestCase):
+    def update_item(self, product, quantity):
+        return self.client.put(f'/api/orders/cart/update/{product.product_id}/', {'quantity': quantity}, format='json')
+
+    def test_sets_and_removes_the_quantity(self):
+        self.add_to_cart(self.products[0], 2)
+        self.assertEqual(self.update_item(self.products[0], 5).status_code, 200)
+        self.assertEqual(self.cart_quantities(), {self.products[0].product_id: 5})
+        self.assertEqual(self.update_item(self.products[0], 0).status_code, 200)
+        self.assertEqual(self.cart_quantities(), {})
+
+    def test_refuses_more_than_the_stock_and_items_not_in_the_cart(self):
+        self.add_to_cart(self.products[0])
+        self.assertEqual(self.update_item(self.products[0], 101).status_code, 400)
+        self.assertEqual(self.update_item(self.products[1], 1).status_code, 404)
+        self.assertEqual(self.cart_quantities(), {self.products[0].product_id: 1})
+
+
+class CartBatchTests(OrderTestCase):
+    def batch(self, *operations):
+        return self.client.post('/api/orders/cart/batch/', {'operations': list(operations)}, format='json')
+
+    def op(self, op, product, quantity=None):
+        operation = {'op': op, 'product_id': product.product_id}
+        if quantity is not None:
+            operation['quantity'] = quantity
+        return operation
+
+    def test_operations_are_applied_in_order(self):
+        first, second, third = self.products[:3]
+        self.add_to_cart(first, 2)
+        self.add_to_cart(second)
+        response = self.batch(self.op('add', first, 3), self.op('set', second, 4), self.op('add', third),
+                              self.op('remove', third))
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(self.cart_quantities(), {first.product_id: 5, second.product_id: 4})
+        self.assertEqual(len(response.data['items']), 2)
+
+        self.assertEqual(self.batch(self.op('set', second, 0)).status_code, 200)
+        self.assertEqual(self.cart_quantities(), {first.product_id: 5})
+
+    def test_stock_is_checked_against_the_final_quantity(self):
+        first, second = self.products[:2]
+        self.add_to_cart(first, 60)
+        response = self.batch(self.op('set', second, 2), self.op('add', first, 50))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['error'], 'Only 100 units of Product 0 available')
+        # Nothing is applied when one operation fails
+        self.assertEqual(self.cart_quantities(), {first.product_id: 60})
+
+        # Going over the stock along the way is fine
+        self.assertEqual(self.batch(self.op('add', first, 50), self.op('set', first, 10)).status_code, 200)
+        self.assertEqual(self.cart_quantities(), {first.product_id: 10})
+
+    def test_unknown_product_fails_the_batch(self):
+        self.add_to_cart(self.products[0])
+        response = self.batch(self.op('add', self.products[1]), {'op': 'add', 'product_id': 'prod_missing'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['error'], 'Product not found: prod_missing')
+        self.assertEqual(self.cart_quantities(), {self.products[0].product_id: 1})
+
+    def test_invalid_operations_are_refused_with_their_index(self):
+        product = self.products[0]
+        for operations, index in (([{'op': 'move', 'product_id': product.product_id}], 0),
+                                  ([self.op('add', product), {'op': 'add'}], 1),
+                                  ([self.op('add', product, 0)], 0),
+                                  ([self.op('set', product, -1)], 0),
+                                  ([self.op('set', product, 'many')], 0)):
+            with self.subTest(operations=operations):
+                response = self.batch(*operations)
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.data['index'], index)
+        self.assertEqual(self.batch().status_code, 400)
+        # Operations are validated before the cart is touched
+        self.assertFalse(Cart.objects.filter(user=self.buyer).exists())
+
+
+class ReorderTests(OrderTestCase):
+    def setUp(self):
+        super().setUp()
+        self.add_to_cart(self.products[1], 2)
+        self.order = self.place_order(self.products[0], 3)
+
+    def reorder(self, order_id=None):
+        return self.client.post(f'/api/orders/orders/{order_id or self.order.order_id}/reorder/')
+
+    def test_items_of_the_order_are_added_to_the_cart(self):
+        first, second = self.products[:2]
+        self.add_to_cart(first)
+        response = self.reorder()
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(response.data['added'], {first.product_id: 3, second.product_id: 2})
+        self.assertEqual((response.data['unavailable'], response.data['price_changes']), ([], []))
+        self.assertEqual(self.cart_quantities(), {first.product_id: 4, second.product_id: 2})
+
+    def test_stock_caps_and_missing_products_are_reported(self):
+        first, second = self.products[:2]
+        self.add_to_cart(first)
+        Product.objects.filter(pk=first.pk).update(stock=2, price=Decimal('12.50'))
+        second.delete()
+
+        response = self.reorder()
+        self.assertEqual(response.status_code, 200, response.content)
+        # One unit is already in the cart, so only one more fits
+        self.assertEqual(response.data['added'], {first.product_id: 1})
+        self.assertEqual({item['product_id']: item for item in response.data['unavailable']}, {
+            first.product_id: {'product_id': first.product_id, 'requested': 3, 'added': 1,
+                               'reason': 'Only 2 units available'},
+            second.product_id: {'product_id': second.product_id, 'requested': 2, 'added': 0,
+                                'reason': 'Product is no longer available'},
+        })
+        self.assertEqual(response.data['price_changes'], [
+            {'product_id': first.product_id, 'ordered_price': first.price, 'current_price': Decimal('12.50')}
+        ])
+        self.assertEqual(self.cart_quantities(), {first.product_id: 2})
+
+    def test_archived_order_can_be_reordered(self):
+        Order.objects.filter(pk=self.order.pk).update(order_status='DELIVERED')
+        OrderService.archive_orders([self.order.pk])
+        response = self.reorder()
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(response.data['added'], {self.products[0].product_id: 3, self.products[1].product_id: 2})
+
+    def test_other_users_orders_cannot_be_reordered(self):
+        stranger = User.objects.create_user(username='stranger', email='stranger@example.com', password='pass')
+        self.client.force_authenticate(stranger)
+        self.assertEqual(self.reorder().status_code, 404)
+        self.assertEqual(self.reorder('order_missing').status_code, 404)
+
+
+class CartSummaryCacheTests(OrderTestCase):
+    def summary(self):
+        response = self.client.get('/api/orders/cart/summary/')
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_change_to_the_cart_invalidates_the_summary_without_deleting_it(self):
+        self.add_to_cart(self.products[0], 2)
+        self.assertEqual(self.summary()['item_count'], 2)
+        cached_key = Cart.objects.get(user=self.buyer).summary_cache_key
+        with self.assertNumQueries(1):
+            self.assertEqual(self.summary()['item_count'], 2)
+
+        self.add_to_cart(self.products[1])
+        # Another worker's cache would still hold the old entry; it is simply no longer looked up
+        self.assertIsNotNone(cache.get(cached_key))
+        self.assertEqual(self.summary()['item_count'], 3)
+
+
+class OrderVersionTests(OrderTestCase):
+    def update_status(self, order, new_status, version=None):
+        self.client.force_authenticate(self.seller)
+        data = {'status': new_status}
+        if version is not None:
+            data['version'] = version
+        return self.client.put(f'/api/orders/seller-orders/{order.order_id}/update-status/', data, format='json')
+
+    def test_update_with_a_stale_version_is_a_conflict(self):
+        order = self.place_order()
+        read_version = order.version
+        self.assertEqual(self.update_status(order, 'SHIPPED', read_version).status_code, 200)
+
+        response = self.update_status(order, 'DELIVERED', read_version)
+        self.assertEqual(response.status_code, 409)
+        order.refresh_from_db()
+        self.assertEqual((order.order_status, order.version), ('SHIPPED', read_version + 1))
+
+        self.assertEqual(self.update_status(order, 'DELIVERED', order.version).status_code, 200)
+
+    def test_save_of_a_stale_instance_raises(self):
+        order = self.place_order()
+        first, second = Order.objects.get(pk=order.pk), Order.objects.get(pk=order.pk)
+        first.order_status = 'SHIPPED'
+        first.save(update_fields=['order_status'])
+
+        second.order_status = 'CANCELLED'
+        # Callers save versioned rows in a transaction of their own, as a failed save marks it for rollback
+        with self.assertRaises(StaleObjectError), transaction.atomic():
+            second.save(update_fields=['order_status'])
+        self.assertEqual(Order.objects.get(pk=order.pk).order_status, 'SHIPPED')
+
+
+class SellerStatusUpdateTests(OrderTestCase):
+    def setUp(self):
+        super().setUp()
+        self.orders = [self.place_order(product) for product in self.products[:3]]
+        other_seller = User.objects.create_user(username='other', email='other@example.com', password='pass',
+                                                role='SELLER')
+        other_store = Store.objects.create(store_name='Gizmos', user=other_seller)
+        self.other_product = Product.objects.create(name='Gizmo', price=Decimal('5.00'), stock=10,
+                                                    category='Phones', store=other_store)
+        self.client.force_authenticate(self.seller)
+
+    def update_status(self, order, new_status):
+        return self.client.put(f'/api/orders/seller-orders/{order.order_id}/update-status/', {'status': new_status},
+                               format='json')
+
+    def bulk_update_status(self, order_ids, new_status):
+        return self.client.post('/api/orders/seller-orders/bulk-update-status/',
+                                {'order_ids': order_ids, 'status': new_status}, format='json')
+
+    def test_status_can_only_move_forward(self):
+        order = self.orders[0]
+        self.assertEqual(self.update_status(order, 'SHIPPED').status_code, 200)
+        for new_status in ('CREATED', 'PROCESSING', 'LOST'):
+            with self.subTest(status=new_status):
+                self.assertEqual(self.update_status(order, new_status).status_code, 400)
+        order.refresh_from_db()
+        self.assertEqual(order.order_status, 'SHIPPED')
+
+    def test_cancelling_refunds_and_restocks(self):
+        order = self.orders[0]
+        response = self.update_status(order, 'CANCELLED')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual((response.data['order_status'], response.data['payment_status']), ('CANCELLED', 'REFUNDED'))
+        order.refresh_from_db()
+        self.assertEqual(order.payment.payment_status, 'REFUNDED')
+        self.products[0].refresh_from_db()
+        self.assertEqual(self.products[0].stock, 100)
+        # A delivered order cannot be cancelled any more
+        self.assertEqual(self.update_status(self.orders[1], 'DELIVERED').status_code, 200)
+        self.assertEqual(self.update_status(self.orders[1], 'CANCELLED').status_code, 400)
+
+    def test_bulk_update_moves_the_orders_it_can_and_reports_the_rest(self):
+        self.client.force_authenticate(self.buyer)
+        foreign = self.place_order(self.other_product)
+        self.client.force_authenticate(self.seller)
+        shipped, delivered, movable = self.orders
+        self.update_status(shipped, 'SHIPPED')
+        self.update_status(delivered, 'DELIVERED')
+        versions = {order.pk: Order.objects.get(pk=order.pk).version for order in self.orders}
+
+        response = self.bulk_update_status(
+            [movable.order_id, shipped.order_id, delivered.order_id, foreign.order_id, 'order_missing'], 'SHIPPED'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['updated'], [movable.order_id])
+        self.assertEqual({rejected['order_id']: rejected['error'] for rejected in response.data['rejected']}, {
+            shipped.order_id: 'Cannot change status from SHIPPED to SHIPPED',
+            delivered.order_id: 'Cannot change status from DELIVERED to SHIPPED',
+            foreign.order_id: 'Order not found',
+            'order_missing': 'Order not found',
+        })
+
+        movable.refresh_from_db()
+        self.assertEqual((movable.order_status, movable.version), ('SHIPPED', versions[movable.pk] + 1))
+        self.assertEqual(Order.objects.get(pk=shipped.pk).version, versions[shipped.pk])
+        self.assertEqual(
+            list(Notification.objects.filter(kind=Notification.ORDER_STATUS_CHANGED, order=movable)
+                 .values_list('user_id', 'payload')),
+            [(self.buyer.pk, {'order_id': movable.order_id, 'status': 'SHIPPED'})]
+        )
+        event = OrderEvent.objects.filter(order_id=movable.order_id, event_type=OrderEvent.STATUS_CHANGED).get()
+        self.assertEqual((event.order_status, event.data), ('SHIPPED', {'from': 'PROCESSING', 'to': 'SHIPPED'}))
+
+    def test_bulk_update_refuses_invalid_requests(self):
+        order_id = self.orders[0].order_id
+        for order_ids, new_status in (([], 'SHIPPED'), ('not a list', 'SHIPPED'), ([order_id], 'CANCELLED'),
+                                      ([order_id], 'CREATED')):
+            with self.subTest(order_ids=order_ids, status=new_status):
+                self.assertEqual(self.bulk_update_status(order_ids, new_status).status_code, 400)
+        self.client.force_authenticate(self.buyer)
+        self.assertEqual(self.bulk_update_status([order_id], 'SHIPPED').status_code, 403)
+
+
+class ArchiveTests(OrderTestCase):
+    def setUp(self):
+        super().setUp()
+        self.delivered = self.place_order(self.products[0], 2)
+        self.cancelled = self.place_order(self.products[1])
+        self.client.post(f'/api/orders/orders/{self.cancelled.order_id}/cancel/')
+        self.recent = self.place_order(self.products[2])
+        self.open = self.place_order(self.products[3])
+        Order.objects.filter(pk__in=[self.delivered.pk, self.recent.pk]).update(order_status='DELIVERED')
+        Order.objects.exclude(pk=self.recent.pk).update(updated_at=timezone.now() - timedelta(days=200))
+
+    def archive_orders(self, *args):
+        out = StringIO()
+        call_command('archive_orders', '--sleep', '0', *args, stdout=out)
+        return out.getvalue()
+
+    def test_dry_run_only_counts(self):
+        self.assertIn('Would archive 2 orders', self.archive_orders('--dry-run'))
+        self.assertEqual(Order.objects.count(), 4)
+        self.assertFalse(ArchivedOrder.objects.exists())
+
+    def test_old_delivered_and_cancelled_orders_are_moved(self):
+        payment = Payment.objects.get(order=self.delivered)
+        notifications = set(Notification.objects.filter(order__in=[self.delivered, self.cancelled])
+                            .values_list('pk', flat=True))
+        self.assertIn('Archived 2 orders', self.archive_orders('--batch-size', '1'))
+
+        self.assertEqual(set(Order.objects.values_list('pk', flat=True)), {self.recent.pk, self.open.pk})
+        self.assertFalse(OrderItem.objects.filter(order_id__in=[self.delivered.pk, self.cancelled.pk]).exists())
+        self.assertFalse(Payment.objects.filter(order_id__in=[self.delivered.pk, self.cancelled.pk]).exists())
+        # Notifications outlive their order
+        self.assertTrue(notifications)
+        self.assertEqual(set(Notification.objects.filter(pk__in=notifications, order__isnull=True)
+                             .values_list('pk', flat=True)), notifications)
+
+        archived = ArchivedOrder.objects.get(order_id=self.delivered.order_id)
+        self.assertEqual(
+            (archived.user, archived.order_status, archived.payment_status, archived.total_amount),
+            (self.buyer, 'DELIVERED', 'PAID', self.delivered.total_amount)
+        )
+        self.assertEqual((archived.payment_id, archived.transaction_id), (payment.payment_id, payment.transaction_id))
+        self.assertEqual(archived.created_at, self.delivered.created_at)
+        self.assertEqual(
+            list(ArchivedOrderItem.objects.filter(order=archived).values_list('product_id', 'quantity', 'price')),
+            [(self.products[0].product_id, 2, self.products[0].price)]
+        )
+        self.assertEqual(ArchivedOrder.objects.get(order_id=self.cancelled.order_id).order_status, 'CANCELLED')
+
+    def test_detail_views_fall_back_to_the_archive(self):
+        self.archive_orders()
+        response = self.client.get(f'/api/orders/orders/{self.delivered.order_id}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data['order_id'], response.data['order_status']),
+                         (self.delivered.order_id, 'DELIVERED'))
+        self.assertEqual(len(response.data['items']), 1)
+        self.assertEqual(self.client.get(f'/api/orders/orders/{self.recent.order_id}/').status_code, 200)
+
+        self.client.force_authenticate(self.seller)
+        response = self.client.get(f'/api/orders/seller-orders/{self.delivered.order_id}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['order_id'], self.delivered.order_id)
+
+    def test_archived_orders_stay_private(self):
+        self.archive_orders()
+        stranger = User.objects.create_user(username='stranger', email='stranger@example.com', password='pass')
+        self.client.force_authenticate(stranger)
+        self.assertEqual(self.client.get(f'/api/orders/orders/{self.delivered.order_id}/').status_code, 404)
+
+        other_seller = User.objects.create_user(username='other', email='other@example.com', password='pass',
+                                                role='SELLER')
+        Store.objects.create(store_name='Gizmos', user=other_seller)
+        self.client.force_authenticate(other_seller)
+        self.assertEqual(self.client.get(f'/api/orders/seller-orders/{self.delivered.order_id}/').status_code, 404)
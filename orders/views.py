@@ -2,56 +2,39 @@ from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.http import JsonResponse
-from .models import Cart, CartItem, ShippingInfo, Order, Promotion
+from django.db import transaction
+from .models import Cart, ShippingInfo, Order, ArchivedOrder, Promotion
+from .guest_cart import GuestCart
+from .promotions import get_active_promotion
+from .pricing import price_cart, price_order
+from .services import OrderService
 from products.models import Product
-from notifications.models import Notification
-from decimal import Decimal
 
 def get_or_create_cart(request):
+    """The user's cart, or the visitor's cookie-backed guest cart (never stored for anonymous visitors)"""
     if request.user.is_authenticated:
         cart, created = Cart.objects.get_or_create(user=request.user)
     else:
-        cart_id = request.session.get('cart_id')
-        if cart_id:
-            try:
-                cart = Cart.objects.get(cart_id=cart_id)
-            except Cart.DoesNotExist:
-                cart = Cart.objects.create()
-                request.session['cart_id'] = cart.cart_id
-        else:
-            cart = Cart.objects.create()
-            request.session['cart_id'] = cart.cart_id
+        cart = GuestCart.from_request(request)
     return cart
 
-def cart_view(request):
-    cart = get_or_create_cart(request)
-    
-    # Calculate subtotal
-    subtotal = Decimal('0.00')
-    for item in cart.items.all():
-        try:
-            product = Product.objects.get(product_id=item.product_id)
-            subtotal += product.price * item.quantity
-        except Product.DoesNotExist:
-            continue
-    
-    # Apply fixed shipping cost for demo
-    shipping = Decimal('5.00') if subtotal > 0 else Decimal('0.00')
-    
-    # Apply tax
-    tax = subtotal * Decimal('0.08')  # 8% tax
-    
-    # Total
-    total = subtotal + shipping + tax
-    
-    context = {
+def pricing_context(request, cart):
+    """Template context with the cart totals, including any discount code in the session"""
+    promotion, _ = get_active_promotion(request.session.get('discount_code'))
+    pricing = price_cart(cart, promotion=promotion)
+    return {
         'cart': cart,
-        'subtotal': subtotal,
-        'shipping': shipping,
-        'tax': tax,
-        'total': total,
+        'products': pricing.products,
+        'subtotal': pricing.subtotal,
+        'discount': pricing.discount,
+        'shipping': pricing.shipping,
+        'tax': pricing.tax,
+        'total': pricing.total,
     }
-    return render(request, 'orders/cart.html', context)
+
+def cart_view(request):
+    cart = get_or_create_cart(request)
+    return render(request, 'orders/cart.html', pricing_context(request, cart))
 
 def add_to_cart_view(request, product_id):
     product = get_object_or_404(Product, product_id=product_id)
@@ -66,7 +49,11 @@ def add_to_cart_view(request, product_id):
     cart = get_or_create_cart(request)
     
     # Add item to cart
-    cart.add_item(product, quantity)
+    try:
+        cart.add_item(product, quantity)
+    except ValueError as e:
+        messages.error(request, str(e))
+        return redirect('orders:cart')
     
     messages.success(request, f'{quantity} x {product.name} added to your cart.')
     return redirect('orders:cart')
@@ -82,27 +69,19 @@ def update_cart_quantity_view(request, product_id):
         cart = get_or_create_cart(request)
         quantity = int(request.GET.get('quantity', 1))
         
-        # Find the cart item
+        # Check if product has enough stock
         try:
-            cart_item = cart.items.get(product_id=product_id)
-            
-            # Check if product has enough stock
             product = Product.objects.get(product_id=product_id)
-            if quantity > product.stock:
-                return JsonResponse({'error': f'Only {product.stock} units available'}, status=400)
-            
-            # Update quantity or remove if zero
-            if quantity > 0:
-                cart_item.quantity = quantity
-                cart_item.save()
-            else:
-                cart_item.delete()
-                
-            return JsonResponse({'success': True})
-        except CartItem.DoesNotExist:
-            return JsonResponse({'error': 'Item not found in cart'}, status=404)
         except Product.DoesNotExist:
             return JsonResponse({'error': 'Product not found'}, status=404)
+        if quantity > product.stock:
+            return JsonResponse({'error': f'Only {product.stock} units available'}, status=400)
+        
+        # Update quantity or remove if zero
+        if not cart.update_item(product_id, quantity):
+            return JsonResponse({'error': 'Item not found in cart'}, status=404)
+        
+        return JsonResponse({'success': True})
     
     return JsonResponse({'error': 'Invalid request'}, status=400)
 
@@ -122,20 +101,20 @@ def checkout_view(request):
         country = request.POST.get('country')
         postal_code = request.POST.get('postal_code')
         
-        shipping_info = ShippingInfo.objects.create(
-            shipping_address=shipping_address,
-            city=city,
-            country=country,
-            postal_code=postal_code
-        )
+        # Apply the discount code stored by apply_promotion_view, if still valid
+        promotion, _ = get_active_promotion(request.session.get('discount_code'))
         
         # Create order
         try:
-            order = cart.checkout()
-            
-            # Add shipping info to order
-            order.shipping_info = shipping_info
-            order.save()
+            with transaction.atomic():
+                shipping_info = ShippingInfo.objects.create(
+                    shipping_address=shipping_address,
+                    city=city,
+                    country=country,
+                    postal_code=postal_code
+                )
+                order = cart.checkout(shipping_info=shipping_info, promotion=promotion)
+            request.session.pop('discount_code', None)
             
             # Process payment
             if 'use_saved_card' in request.POST and request.user.billing_info:
@@ -167,63 +146,23 @@ def checkout_view(request):
                         }
                     )
             
-            # Process the payment
-            order.process_payment(payment_info)
-            
-            # Create notification for buyer
-            Notification.objects.create(
-                user=request.user,
-                message=f"Your order #{order.order_id} has been placed successfully. Total amount: ${order.total_amount}."
-            )
+            # Process the payment; the gateway may settle it after this request
+            payment_status = order.process_payment(payment_info)
             
-            # Create notification for seller
-            for item in order.items.all():
-                try:
-                    product = Product.objects.get(product_id=item.product_id)
-                    seller = product.store.user
-                    
-                    # Create notification for each unique seller
-                    Notification.objects.get_or_create(
-                        user=seller,
-                        message=f"New order #{order.order_id} received from {request.user.username}. Please check your orders.",
-                        defaults={'is_read': False}
-                    )
-                except Product.DoesNotExist:
-                    continue
+            # Notify the buyer and every seller in the order
+            OrderService.notify_order_placed(order)
             
-            messages.success(request, 'Order placed successfully!')
+            if payment_status == 'PENDING':
+                messages.success(request, 'Order placed successfully! Your payment is being processed.')
+            else:
+                messages.success(request, 'Order placed successfully!')
             return redirect('orders:detail', order_id=order.order_id)
             
         except ValueError as e:
             messages.error(request, str(e))
             return redirect('orders:cart')
     
-    # Calculate order totals
-    subtotal = Decimal('0.00')
-    for item in cart.items.all():
-        try:
-            product = Product.objects.get(product_id=item.product_id)
-            subtotal += product.price * item.quantity
-        except Product.DoesNotExist:
-            continue
-    
-    # Apply fixed shipping cost for demo
-    shipping = Decimal('5.00') if subtotal > 0 else Decimal('0.00')
-    
-    # Apply tax
-    tax = subtotal * Decimal('0.08')  # 8% tax
-    
-    # Total
-    total = subtotal + shipping + tax
-    
-    context = {
-        'cart': cart,
-        'subtotal': subtotal,
-        'shipping': shipping,
-        'tax': tax,
-        'total': total,
-    }
-    return render(request, 'orders/checkout.html', context)
+    return render(request, 'orders/checkout.html', pricing_context(request, cart))
 
 @login_required
 def shipping_info_view(request):
@@ -242,50 +181,31 @@ def order_list_view(request):
 
 @login_required
 def order_detail_view(request, order_id):
-    order = get_object_or_404(Order, order_id=order_id, user=request.user)
+    order = Order.objects.filter(order_id=order_id, user=request.user).first()
+    if order is None:
+        # Orders moved to the archive are read-only
+        order = get_object_or_404(ArchivedOrder, order_id=order_id, user=request.user)
     
     # If cancelling the order
     if request.method == 'POST' and request.POST.get('action') == 'cancel':
-        if order.payment_status == 'PAID' and order.order_status != 'DELIVERED' and order.order_status != 'CANCELLED':
-            # Refund payment
-            order.payment.refund_payment()
-            
-            # Create notification for the order cancellation
-            Notification.objects.create(
-                user=request.user,
-                message=f"Your order #{order.order_id} has been cancelled and payment refunded."
-            )
-            
-            # Notify sellers about the cancellation
-            for item in order.items.all():
-                try:
-                    product = Product.objects.get(product_id=item.product_id)
-                    seller = product.store.user
-                    Notification.objects.create(
-                        user=seller,
-                        message=f"Order #{order.order_id} from {order.user.username} has been cancelled."
-                    )
-                    
-                    # Restore stock
-                    product.stock += item.quantity
-                    product.save()
-                except Product.DoesNotExist:
-                    continue
-                    
+        try:
+            if isinstance(order, ArchivedOrder):
+                raise ValueError("This order cannot be cancelled.")
+            OrderService.cancel_order(order)
             messages.success(request, 'Your order has been cancelled and payment refunded.')
-        else:
-            messages.error(request, 'This order cannot be cancelled.')
+        except ValueError as e:
+            messages.error(request, str(e))
         
         return redirect('orders:detail', order_id=order.order_id)
     
-    # Calculate subtotal for display
-    subtotal = sum(item.price * item.quantity for item in order.items.all())
-    tax = subtotal * (order.tax_rate / 100)
+    # Totals for display, from the prices stored on the order
+    pricing = price_order(order)
     
     context = {
         'order': order,
-        'subtotal': subtotal,
-        'tax': tax,
+        'subtotal': pricing.subtotal,
+        'discount': pricing.discount,
+        'tax': pricing.tax,
     }
     return render(request, 'orders/order_detail.html', context)
 
@@ -293,14 +213,13 @@ def order_detail_view(request, order_id):
 def apply_promotion_view(request):
     if request.method == 'POST':
         discount_code = request.POST.get('discount_code')
-        try:
-            promotion = Promotion.objects.get(discount_code=discount_code)
-        except Promotion.DoesNotExist:
-            messages.error(request, 'Invalid discount code.')
+        promotion, error = get_active_promotion(discount_code)
+        if error:
+            messages.error(request, f'{error}.')
             return redirect('orders:cart')
         
-        # Store the promotion in the session
-        request.session['promotion_id'] = promotion.promotion_id
+        # Store the code in the session so checkout can apply it
+        request.session['discount_code'] = promotion.discount_code
         messages.success(request, f'Discount code {discount_code} applied!')
     
     return redirect('orders:cart')
@@ -5,12 +5,15 @@ from rest_framework.decorators import api_view, permission_classes
 from rest_framework.pagination import PageNumberPagination
 from rest_framework.permissions import IsAuthenticated
 from django.shortcuts import get_object_or_404
+from django.db import transaction
 from .models import Product, ProductLike
 from .serializers import ProductSerializer, ProductCreateSerializer, LikeSerializer
 from django.db.models import Q, Count, F, OuterRef, Subquery, IntegerField, Sum
 from orders.models import OrderItem
 from rest_framework.exceptions import PermissionDenied, ValidationError
 from stores.models import Store
+from techshelf.db import upsert
+from techshelf.versioning import StaleObjectError, expected_version
 import logging
 
 logger = logging.getLogger(__name__)
@@ -109,6 +112,23 @@ class ProductUpdateView(generics.UpdateAPIView):
     
     def get_queryset(self):
         return Product.objects.filter(store__user=self.request.user)
+    
+    def update(self, request, *args, **kwargs):
+        try:
+            return super().update(request, *args, **kwargs)
+        except StaleObjectError as e:
+            return Response({'error': str(e)}, status=status.HTTP_409_CONFLICT)
+    
+    def perform_update(self, serializer):
+        # Saves only succeed against the version the client read, when it sends one
+        try:
+            version = expected_version(self.request.data)
+        except ValueError as e:
+            raise ValidationError({'version': str(e)})
+        if version is not None:
+            serializer.instance.version = version
+        with transaction.atomic():
+            serializer.save()
 
 class ProductLikeView(APIView):
     """Like or unlike a product"""
@@ -118,11 +138,12 @@ class ProductLikeView(APIView):
         """Like a product"""
         product = get_object_or_404(Product, product_id=product_id)
         
-        # Check if already liked
-        like, created = ProductLike.objects.get_or_create(
-            user=request.user,
-            product=product
+        # Insert the like unless it already exists, in a single statement
+        like = upsert(
+            ProductLike(like_id=f"like_{product.product_id}_{request.user.id}", user=request.user, product=product),
+            unique_fields=['user', 'product']
         )
+        created = like is not None
         
         return Response({'liked': True}, status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
     
@@ -1,8 +1,9 @@
 from django.db import models
 from django.conf import settings
 from django.utils.text import slugify
+from techshelf.versioning import VersionedModel
 
-class Product(models.Model):
+class Product(VersionedModel):
     product_id = models.CharField(max_length=50, unique=True)
     name = models.CharField(max_length=255)
     price = models.DecimalField(max_digits=10, decimal_places=2)
@@ -26,7 +27,7 @@ class Product(models.Model):
     
     def update_price(self, new_price):
         self.price = new_price
-        self.save()
+        self.save(update_fields=['price', 'updated_at'])
     
     def add_like(self):
         # This is handled by the Like model's creation
@@ -35,7 +36,7 @@ class Product(models.Model):
     def decrement_stock(self, quantity):
         if self.stock >= quantity:
             self.stock -= quantity
-            self.save()
+            self.save(update_fields=['stock', 'updated_at'])
             return True
         return False
     
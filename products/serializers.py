@@ -12,9 +12,9 @@ class ProductSerializer(serializers.ModelSerializer):
         model = Product
         fields = ['product_id', 'name', 'price', 'stock', 'category', 'description', 
                  'image', 'store', 'store_name', 'store_subdomain',  # Include store_subdomain
-                 'created_at', 'updated_at',
+                 'version', 'created_at', 'updated_at',
                  'like_count', 'is_liked']
-        read_only_fields = ['product_id', 'store', 'created_at', 'updated_at', 
+        read_only_fields = ['product_id', 'store', 'version', 'created_at', 'updated_at', 
                            'store_name', 'store_subdomain', 'like_count', 'is_liked']
     
     def get_store_name(self, obj):
@@ -2,7 +2,9 @@ from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from .models import Product, Like
+from django.db import transaction
 from django.db.models import Q
+from techshelf.versioning import StaleObjectError, expected_version
 
 def product_list_view(request):
     products = Product.objects.all()
@@ -119,7 +121,15 @@ def edit_product_view(request, product_id):
         if 'image' in request.FILES:
             product.image = request.FILES.get('image')
         
-        product.save()
+        try:
+            version = expected_version(request.POST)
+            if version is not None:
+                product.version = version
+            with transaction.atomic():
+                product.save()
+        except (ValueError, StaleObjectError) as e:
+            messages.error(request, str(e))
+            return redirect('products:edit', product_id=product.product_id)
         messages.success(request, f'Product "{product.name}" has been updated.')
         return redirect('products:detail', product_id=product.product_id)
     
@@ -4,6 +4,7 @@ from rest_framework.views import APIView
 from django.shortcuts import get_object_or_404
 from .models import Store, StoreTheme, Rating
 from .serializers import StoreSerializer, StoreCreateSerializer, StoreThemeSerializer, RatingSerializer
+from techshelf.db import upsert
 import logging
 import traceback
 
@@ -162,23 +163,17 @@ class StoreRatingCreateView(APIView):
         if not serializer.is_valid():
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
             
-        # Check if the user already rated this store
-        existing_rating = Rating.objects.filter(user=request.user, store=store).first()
+        # Only decides the status code, so a race between two first ratings by the same user is harmless
+        created = not Rating.objects.filter(user=request.user, store=store).exists()
         
-        if existing_rating:
-            # Update existing rating
-            existing_rating.score = serializer.validated_data['score']
-            existing_rating.comment = serializer.validated_data.get('comment', '')
-            existing_rating.save()
-            
-            # Return updated rating data
-            return Response(RatingSerializer(existing_rating).data, status=status.HTTP_200_OK)
-        else:
-            # Create new rating
-            rating = serializer.save(
-                user=request.user,
-                store=store,
-                rating_id=f"rating_{request.user.id}_{store.store_id}"
-            )
-            
-            return Response(RatingSerializer(rating).data, status=status.HTTP_201_CREATED)
+        # Create the rating or replace the user's previous one in a single statement
+        new_rating = Rating(
+            rating_id=f"rating_{request.user.id}_{store.store_id}",
+            user=request.user,
+            store=store,
+            score=serializer.validated_data['score'],
+            comment=serializer.validated_data.get('comment', '')
+        )
+        rating = upsert(new_rating, unique_fields=['user', 'store'], update_fields=['score', 'comment'])
+        rating.user = request.user
+        return Response(RatingSerializer(rating).data, status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
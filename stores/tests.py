@@ -0,0 +1,23 @@
+from rest_framework.test import APITestCase
+
+from users.models import User
+
+from .models import Rating, Store
+
+
+class StoreRatingTests(APITestCase):
+    def setUp(self):
+        seller = User.objects.create_user(username='seller', email='seller@example.com', password='pass')
+        self.store = Store.objects.create(store_name='Gadgets', user=seller)
+        self.user = User.objects.create_user(username='buyer', email='buyer@example.com', password='pass')
+        self.client.force_authenticate(self.user)
+
+    def rate(self, score):
+        return self.client.post(f'/api/stores/{self.store.subdomain_name}/rate/', {'score': score}, format='json')
+
+    def test_first_rating_is_created_and_later_ones_replace_it(self):
+        self.assertEqual(self.rate(4).status_code, 201)
+        response = self.rate(2)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['score'], 2)
+        self.assertEqual(Rating.objects.get().score, 2)
@@ -1,5 +1,10 @@
 """
 ASGI config for techshelf project.
+
+Serve the project through this module so async views such as the notification
+stream run on the event loop instead of a worker thread:
+
+    gunicorn techshelf.asgi:application -k uvicorn_worker.UvicornWorker
 """
 
 import os
@@ -0,0 +1,66 @@
+"""
+Single-statement upserts for the hot write paths (cart lines, likes, ratings).
+
+Django's get_or_create and update_or_create read first and write second, which
+costs two or three round trips and races under concurrent requests. upsert()
+issues one INSERT ... ON CONFLICT ... RETURNING instead. SQLite (3.35+) and
+PostgreSQL support it; other backends raise NotSupportedError.
+"""
+
+from django.db import NotSupportedError, connections, router
+
+
+def upsert(instance, unique_fields, update_fields=(), increment_fields=()):
+    """
+    Insert an unsaved model instance, or update the row it conflicts with on
+    unique_fields. update_fields take the new value, increment_fields have the
+    new value added to the stored one. With neither, a conflicting insert is
+    skipped.
+
+    Returns the stored row as a model instance, or None when the insert was
+    skipped. Model.save() is not called, so primary keys built in save()
+    must be set by the caller.
+    """
+    model = type(instance)
+    using = router.db_for_write(model, instance=instance)
+    connection = connections[using]
+    features = connection.features
+    if not (features.supports_update_conflicts_with_target and features.can_return_columns_from_insert):
+        raise NotSupportedError(f"{connection.vendor} does not support INSERT ... ON CONFLICT ... RETURNING")
+
+    meta = model._meta
+    quote = connection.ops.quote_name
+    table = quote(meta.db_table)
+
+    # Auto-increment primary keys are left to the database
+    insert_fields = [field for field in meta.concrete_fields if not (field.primary_key and field.auto_created)]
+    columns = [quote(field.column) for field in insert_fields]
+    params = [field.get_db_prep_save(field.pre_save(instance, add=True), connection) for field in insert_fields]
+
+    assignments = [f"{quote(meta.get_field(name).column)} = EXCLUDED.{quote(meta.get_field(name).column)}"
+                   for name in update_fields]
+    assignments += [f"{column} = {table}.{column} + EXCLUDED.{column}"
+                    for column in (quote(meta.get_field(name).column) for name in increment_fields)]
+    action = f"DO UPDATE SET {', '.join(assignments)}" if assignments else 'DO NOTHING'
+
+    conflict = ', '.join(quote(meta.get_field(name).column) for name in unique_fields)
+    returning = ', '.join(quote(field.column) for field in meta.concrete_fields)
+    sql = (
+        f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))}) "
+        f"ON CONFLICT ({conflict}) {action} RETURNING {returning}"
+    )
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        row = cursor.fetchone()
+    if row is None:
+        return None
+
+    # Apply the same conversions a queryset would (e.g. SQLite returns datetimes as text)
+    values = []
+    for field, value in zip(meta.concrete_fields, row):
+        col = field.get_col(meta.db_table)
+        for converter in connection.ops.get_db_converters(col) + col.get_db_converters(connection):
+            value = converter(value, col, connection)
+        values.append(value)
+    return model.from_db(using, [field.attname for field in meta.concrete_fields], values)
@@ -0,0 +1,77 @@
+"""
+Time-ordered identifiers shared by the order, payment, cart, promotion and
+notification models.
+
+Ids are ULIDs (48-bit millisecond timestamp + 80 random bits) encoded in
+lowercase Crockford base32, so they sort by creation time and new rows land
+at the right-hand edge of the unique index instead of at random positions.
+"""
+
+import os
+import threading
+import time
+
+CROCKFORD_ALPHABET = '0123456789abcdefghjkmnpqrstvwxyz'
+ULID_LENGTH = 26
+RANDOM_BITS = 80
+RANDOM_LIMIT = 1 << RANDOM_BITS
+
+
+def encode_ulid(value):
+    """Encode a 128-bit integer as a 26 character base32 string"""
+    chars = []
+    for _ in range(ULID_LENGTH):
+        value, index = divmod(value, 32)
+        chars.append(CROCKFORD_ALPHABET[index])
+    return ''.join(reversed(chars))
+
+
+class MonotonicULIDGenerator:
+    """
+    Per-process ULID generator.
+    Ids generated within the same millisecond increment the random part, so
+    they are strictly increasing even if the clock stalls or steps back.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._last_ms = -1
+        self._last_random = 0
+
+    def reset(self):
+        with self._lock:
+            self._last_ms = -1
+            self._last_random = 0
+
+    def generate(self):
+        with self._lock:
+            now_ms = time.time_ns() // 1_000_000
+            if now_ms > self._last_ms:
+                timestamp = now_ms
+                random_part = int.from_bytes(os.urandom(10), 'big')
+            else:
+                timestamp = self._last_ms
+                random_part = self._last_random + 1
+                if random_part >= RANDOM_LIMIT:
+                    # Random space for this millisecond is exhausted, borrow the next one
+                    timestamp += 1
+                    random_part = int.from_bytes(os.urandom(10), 'big')
+            self._last_ms = timestamp
+            self._last_random = random_part
+        return encode_ulid((timestamp << RANDOM_BITS) | random_part)
+
+
+_generator = MonotonicULIDGenerator()
+
+# Forked workers must not continue the parent's sequence or they would collide
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_generator.reset)
+
+
+def generate_ulid():
+    return _generator.generate()
+
+
+def generate_id(prefix):
+    """Return a prefixed, time-ordered id such as 'order_01j9z3k4...'"""
+    return f"{prefix}_{_generator.generate()}"
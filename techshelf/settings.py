@@ -1,5 +1,7 @@
 from pathlib import Path
 from datetime import timedelta
+from decimal import Decimal
+import json
 import os
 import dj_database_url
 from dotenv import load_dotenv
@@ -42,6 +44,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'orders.guest_cart.GuestCartMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -69,6 +72,7 @@ CORS_ALLOW_HEADERS = [
     'user-agent',
     'x-csrftoken',
     'x-requested-with',
+    'idempotency-key',
 ]
 
 ROOT_URLCONF = 'techshelf.urls'
@@ -164,3 +168,73 @@ MEDIA_URL = 'media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Idempotency keys for checkout, cancellation and seller status updates
+IDEMPOTENCY_KEY_TTL = timedelta(hours=int(os.environ.get('IDEMPOTENCY_KEY_TTL_HOURS', '24')))
+IDEMPOTENCY_LOCK_TIMEOUT = timedelta(seconds=int(os.environ.get('IDEMPOTENCY_LOCK_SECONDS', '60')))
+IDEMPOTENCY_WAIT_TIMEOUT = float(os.environ.get('IDEMPOTENCY_WAIT_TIMEOUT', '10'))
+IDEMPOTENCY_POLL_INTERVAL = 0.2
+
+# Per-worker promotion code cache
+PROMOTION_CACHE_TTL = int(os.environ.get('PROMOTION_CACHE_TTL', '60'))
+PROMOTION_CACHE_MAX_ENTRIES = 10000
+
+# Order pricing
+ORDER_TAX_RATE = Decimal(os.environ.get('ORDER_TAX_RATE', '8.00'))  # percent
+ORDER_SHIPPING_COST = Decimal(os.environ.get('ORDER_SHIPPING_COST', '5.00'))
+
+# Cart summary badge. Entries are keyed by the cart's summary_version, so they are stale nowhere once
+# the cart's items change, even with the default per-process cache.
+CART_SUMMARY_CACHE_TTL = int(os.environ.get('CART_SUMMARY_CACHE_TTL', '300'))
+
+# Guest carts live in a signed cookie until the visitor logs in
+GUEST_CART_COOKIE_NAME = 'guest_cart'
+GUEST_CART_COOKIE_AGE = int(os.environ.get('GUEST_CART_COOKIE_DAYS', '30')) * 24 * 60 * 60
+GUEST_CART_MAX_LINES = 50  # keeps the cookie well under the 4 KB browser limit
+
+# Payment gateway. Charges run on a bounded per-process pool unless PAYMENT_GATEWAY_ASYNC is off,
+# in which case checkout waits for the gateway. SimulatedGateway options: connect_latency,
+# latency, jitter (seconds), decline_rate (0-1) and seed.
+PAYMENT_GATEWAY = os.environ.get('PAYMENT_GATEWAY', 'orders.gateway.SimulatedGateway')
+PAYMENT_GATEWAY_OPTIONS = json.loads(os.environ.get('PAYMENT_GATEWAY_OPTIONS', '{}'))
+PAYMENT_GATEWAY_ASYNC = os.environ.get('PAYMENT_GATEWAY_ASYNC', 'True').lower() == 'true'
+PAYMENT_GATEWAY_CONNECT_TIMEOUT = float(os.environ.get('PAYMENT_GATEWAY_CONNECT_TIMEOUT', '3'))
+PAYMENT_GATEWAY_READ_TIMEOUT = float(os.environ.get('PAYMENT_GATEWAY_READ_TIMEOUT', '10'))
+PAYMENT_GATEWAY_MAX_WORKERS = int(os.environ.get('PAYMENT_GATEWAY_MAX_WORKERS', '16'))
+PAYMENT_GATEWAY_MAX_PENDING = int(os.environ.get('PAYMENT_GATEWAY_MAX_PENDING', '500'))
+# reconcile_payments settles payments pending for longer than this. Keep it well above the gateway
+# timeouts, so that charges still in flight are left to the worker making them.
+PAYMENT_RECONCILE_AFTER_SECONDS = int(os.environ.get('PAYMENT_RECONCILE_AFTER_SECONDS', '600'))
+
+# Order event log consumers skip events younger than this, and notification streams keep their cursor
+# behind it, so rows committed out of order are not missed
+ORDER_EVENT_SETTLE_SECONDS = int(os.environ.get('ORDER_EVENT_SETTLE_SECONDS', '5'))
+
+# Live notification stream (server-sent events). Streams are only live when the project is served
+# through techshelf.asgi; under WSGI each request gets one batch of updates and reconnects after the
+# poll interval. Streams wake up immediately for rows written in the same process and re-check the
+# database at the poll interval for the rest.
+NOTIFICATION_STREAM_POLL_SECONDS = float(os.environ.get('NOTIFICATION_STREAM_POLL_SECONDS', '5'))
+NOTIFICATION_STREAM_KEEPALIVE_SECONDS = 15
+NOTIFICATION_STREAM_TICKET_SECONDS = 30  # lifetime of the single-use ticket EventSource clients open it with
+NOTIFICATION_STREAM_MAX_SECONDS = int(os.environ.get('NOTIFICATION_STREAM_MAX_SECONDS', '300'))  # clients reconnect
+
+# Seller notifications of the same kind within this many seconds are merged into one digest and email.
+# Users can change theirs; 0 turns digests off.
+NOTIFICATION_DIGEST_SECONDS = int(os.environ.get('NOTIFICATION_DIGEST_SECONDS', '600'))
+
+# Outgoing mail is queued in notifications.QueuedEmail and sent by the send_queued_emails worker.
+# For local testing use the console, file (with EMAIL_FILE_PATH) or locmem backend, or point
+# EMAIL_HOST/EMAIL_PORT at a debug SMTP server.
+EMAIL_BACKEND = os.environ.get('EMAIL_BACKEND', 'django.core.mail.backends.smtp.EmailBackend')
+EMAIL_HOST = os.environ.get('EMAIL_HOST', 'localhost')
+EMAIL_PORT = int(os.environ.get('EMAIL_PORT', '25'))
+EMAIL_HOST_USER = os.environ.get('EMAIL_HOST_USER', '')
+EMAIL_HOST_PASSWORD = os.environ.get('EMAIL_HOST_PASSWORD', '')
+EMAIL_USE_TLS = os.environ.get('EMAIL_USE_TLS', 'False').lower() == 'true'
+EMAIL_TIMEOUT = 10
+EMAIL_FILE_PATH = os.environ.get('EMAIL_FILE_PATH', str(BASE_DIR / 'sent_emails'))
+DEFAULT_FROM_EMAIL = 'noreply@techshelf.com'
+EMAIL_QUEUE_RATE = float(os.environ.get('EMAIL_QUEUE_RATE', '10'))  # messages per second per worker
+EMAIL_QUEUE_MAX_ATTEMPTS = 5
+EMAIL_QUEUE_RETRY_SECONDS = 60  # doubled after every failed attempt
@@ -0,0 +1,72 @@
+from datetime import datetime
+from decimal import Decimal
+
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from orders.models import Cart, CartItem
+from products.models import Product, ProductLike
+from stores.models import Rating, Store
+from users.models import User
+
+from .db import upsert
+
+
+class UpsertTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='buyer', email='buyer@example.com', password='pass')
+        seller = User.objects.create_user(username='seller', email='seller@example.com', password='pass')
+        self.store = Store.objects.create(store_name='Gadgets', user=seller)
+
+    def rate(self, score, comment=''):
+        return upsert(
+            Rating(rating_id='rating_1', user=self.user, store=self.store, score=score, comment=comment),
+            unique_fields=['user', 'store'], update_fields=['score', 'comment']
+        )
+
+    def test_inserts_a_new_row(self):
+        rating = self.rate(4, 'Good')
+        self.assertIsNotNone(rating.pk)
+        self.assertEqual((rating.score, rating.comment, rating.user_id), (4, 'Good', self.user.pk))
+        # Values are converted as a queryset would, e.g. datetimes stored as text by SQLite
+        self.assertIsInstance(rating.timestamp, datetime)
+        self.assertEqual(Rating.objects.get(), rating)
+
+    def test_updates_the_conflicting_row(self):
+        first = self.rate(4, 'Good')
+        second = self.rate(2, 'Broke after a week')
+        self.assertEqual(second.pk, first.pk)
+        self.assertEqual((second.score, second.comment), (2, 'Broke after a week'))
+        # Fields not in update_fields keep their stored value
+        self.assertEqual(second.timestamp, first.timestamp)
+        self.assertEqual(Rating.objects.count(), 1)
+
+    def test_increments_the_conflicting_row(self):
+        cart = Cart.objects.create(user=self.user)
+        for quantity in (2, 3):
+            line = upsert(CartItem(cart=cart, product_id='product_1', quantity=quantity),
+                          unique_fields=['cart', 'product_id'], increment_fields=['quantity'])
+        self.assertEqual(line.quantity, 5)
+        self.assertEqual(CartItem.objects.get().quantity, 5)
+
+    def test_conflicting_insert_without_update_fields_is_skipped(self):
+        product = Product.objects.create(name='Phone', price=Decimal('10.00'), stock=1, category='Phones',
+                                         store=self.store)
+
+        def like():
+            return upsert(ProductLike(like_id='like_1', user=self.user, product=product),
+                          unique_fields=['user', 'product'])
+        self.assertEqual(like().pk, 'like_1')
+        self.assertIsNone(like())
+        self.assertEqual(ProductLike.objects.count(), 1)
+
+    def test_columns_are_quoted(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.rate(4)
+        quote = connection.ops.quote_name
+        self.assertIn(
+            f"ON CONFLICT ({quote('user_id')}, {quote('store_id')}) DO UPDATE SET "
+            f"{quote('score')} = EXCLUDED.{quote('score')}, {quote('comment')} = EXCLUDED.{quote('comment')}",
+            queries[-1]['sql']
+        )
@@ -0,0 +1,58 @@
+"""
+Optimistic concurrency for rows that several requests update at once.
+
+VersionedModel adds a version column. Saving an existing row becomes
+UPDATE ... SET ..., version = version + 1 WHERE pk = %s AND version = n,
+so a save based on a stale read raises StaleObjectError instead of silently
+overwriting whoever wrote in between. No row locks are taken.
+
+QuerySet.update() bypasses save(), so bulk updates of versioned rows must
+bump the column themselves: .update(..., version=F('version') + 1).
+"""
+
+from django.db import models
+from django.db.models import F
+
+
+class StaleObjectError(Exception):
+    """The row was changed by someone else since it was read"""
+
+
+class VersionedModel(models.Model):
+    version = models.PositiveIntegerField(default=1)
+
+    class Meta:
+        abstract = True
+
+    def _do_update(self, base_qs, using, pk_val, values, update_fields, forced_update):
+        # The version is always written, even when update_fields leaves it out
+        version_field = self._meta.get_field('version')
+        values = [value for value in values if value[0] is not version_field]
+        values.append((version_field, None, F('version') + 1))
+
+        if base_qs.filter(pk=pk_val, version=self.version)._update(values):
+            self.version += 1
+            return True
+        if not forced_update and not base_qs.filter(pk=pk_val).exists():
+            # The row is gone; let save() insert it as Django normally does
+            return False
+        raise StaleObjectError(
+            f"This {self._meta.verbose_name} was changed by someone else. Reload it and try again."
+        )
+
+
+def expected_version(data):
+    """
+    The version a client says it last read, from a request's 'version' field.
+    Returns None when absent. Raises ValueError if it is not a positive integer.
+    """
+    value = data.get('version')
+    if value in (None, ''):
+        return None
+    try:
+        version = int(value)
+    except (TypeError, ValueError):
+        raise ValueError("version must be a positive integer")
+    if version < 1:
+        raise ValueError("version must be a positive integer")
+    return version